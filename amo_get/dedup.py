@@ -0,0 +1,93 @@
+# amo_get/dedup.py
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DedupWindow:
+    """
+    Окно идемпотентности для вебхуков amoCRM: id сообщения -> «уже принято».
+
+    Локально — LRU на max_size ключей с TTL. Если задан redis_url, ключи
+    дополнительно ставятся в Redis через SET NX EX, и повтор, пришедший на
+    другую реплику, тоже распознаётся. При ошибке Redis работаем по локальному
+    окну. Если обработка не удалась, ключ снимается release(), чтобы повтор
+    amoCRM был обработан заново.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 3600.0,
+                 redis_url: Optional[str] = None, prefix: str = "amo_get:dedup:") -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._redis = None
+        self.counters = {"checked": 0, "duplicates": 0, "shared_duplicates": 0,
+                         "released": 0, "evictions": 0, "shared_errors": 0}
+
+    async def start(self) -> None:
+        if not self.redis_url:
+            return
+        import redis.asyncio as aioredis  # Нужен только при общем окне на несколько реплик
+        self._redis = aioredis.from_url(self.redis_url)
+        logger.info("[DEDUP] Общее окно в Redis включено")
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    def _seen_locally(self, key: str) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False
+        return True
+
+    def _remember(self, key: str) -> None:
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def claim(self, key: str) -> bool:
+        """True — сообщение видим впервые и его надо обработать; False — повтор."""
+        self.counters["checked"] += 1
+        if self._seen_locally(key):
+            self.counters["duplicates"] += 1
+            return False
+        self._remember(key)
+        if self._redis is not None:
+            try:
+                first = await self._redis.set(self.prefix + key, 1, nx=True, ex=max(1, int(self.ttl)))
+            except Exception as e:
+                self.counters["shared_errors"] += 1
+                logger.error(f"[DEDUP] Ошибка Redis, проверка только по локальному окну: {e}")
+                return True
+            if not first:
+                self.counters["duplicates"] += 1
+                self.counters["shared_duplicates"] += 1
+                return False
+        return True
+
+    async def release(self, key: str) -> None:
+        """Снимает отметку после неудачной обработки: повтор amoCRM пройдёт заново."""
+        self._entries.pop(key, None)
+        self.counters["released"] += 1
+        if self._redis is not None:
+            try:
+                await self._redis.delete(self.prefix + key)
+            except Exception as e:
+                self.counters["shared_errors"] += 1
+                logger.error(f"[DEDUP] Не удалось снять ключ {key} в Redis: {e}")
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "shared": self._redis is not None, **self.counters}
@@ -0,0 +1,202 @@
+# amo_get/ingest.py
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aio_pika
+
+from common import tracing
+
+logger = logging.getLogger(__name__)
+
+# Доставка одного сообщения в telegram_bot: True — доставлено
+Forwarder = Callable[[Dict], Awaitable[bool]]
+
+
+class WebhookQueue:
+    """
+    Приём вебхуков amoCRM через durable-очередь.
+
+    Обработчик вебхука только публикует проверенное сообщение (с подтверждением
+    брокера) и сразу отвечает 200. Пул воркеров, ограниченный prefetch и
+    семафором, доставляет сообщения в telegram_bot. Неудачная доставка
+    повторяется с растущей паузой (очереди {name}.retry.{i} с TTL 1, 2, 4...
+    до max_backoff секунд, по истечении — обратно в основную), после
+    max_attempts сообщение уходит в {name}.failed.
+
+    Порядок внутри чата (tg_id) — как в outbox amo_send: ответы одного чата
+    доставляются по одному в порядке получения, а пока первое недоставленное
+    ждёт повтора, следующие перекладываются за ним в ту же очередь задержки
+    без увеличения x-attempt. Удержание — в памяти процесса: amo_get
+    работает в одном экземпляре (container_name в docker-compose).
+    """
+
+    def __init__(self, url: str, forwarder: Forwarder, name: str = "amo_incoming",
+                 workers: int = 16, max_attempts: int = 5, max_backoff: float = 30.0) -> None:
+        self.url = url
+        self.forwarder = forwarder
+        self.name = name
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.delays: List[float] = [min(max_backoff, 2 ** i) for i in range(max(1, max_attempts - 1))]
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        # tg_id -> (message_id, индекс очереди задержки) сообщения, ждущего повтора
+        self._held: Dict[str, Tuple[str, int]] = {}
+        # tg_id -> завершение последнего принятого в обработку сообщения
+        self._tails: Dict[str, asyncio.Future] = {}
+        self.counters = {"published": 0, "delivered": 0, "retried": 0, "failed": 0, "held_back": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._channel is not None
+
+    def retry_queue_name(self, index: int) -> str:
+        return f"{self.name}.retry.{index}"
+
+    @property
+    def failed_queue_name(self) -> str:
+        return f"{self.name}.failed"
+
+    async def start(self, retries: int = 10, delay: float = 5.0) -> None:
+        for attempt in range(retries):
+            try:
+                self._connection = await aio_pika.connect_robust(self.url)
+                break
+            except Exception as e:
+                logger.error(f"[INGEST] Ошибка подключения к RabbitMQ ({attempt + 1}/{retries}): {e}")
+                await asyncio.sleep(delay)
+        else:
+            logger.critical("[INGEST] RabbitMQ недоступен, вебхуки обрабатываются синхронно")
+            return
+
+        self._semaphore = asyncio.Semaphore(self.workers)
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self.workers)
+        self._queue = await channel.declare_queue(self.name, durable=True)
+        for index, seconds in enumerate(self.delays):
+            await channel.declare_queue(
+                self.retry_queue_name(index),
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(seconds * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.name,
+                },
+            )
+        await channel.declare_queue(self.failed_queue_name, durable=True)
+        await self._queue.consume(self._on_message, no_ack=False)
+        self._channel = channel
+        logger.info(f"[INGEST] Очередь {self.name} готова, воркеров доставки: {self.workers}")
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+        self._connection = None
+        self._channel = None
+
+    async def _publish(self, routing_key: str, body: bytes, message_id: str, attempt: int) -> None:
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=body,
+                message_id=message_id,
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                headers=tracing.inject({"x-attempt": attempt}),
+            ),
+            routing_key=routing_key,
+        )
+
+    async def publish(self, payload: Dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._publish(self.name, body, str(uuid.uuid4()), attempt=0)
+        self.counters["published"] += 1
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        attempt = int((message.headers or {}).get("x-attempt", 0)) + 1
+        try:
+            payload = json.loads(message.body)
+            key = str(payload["tg_id"]) if payload.get("tg_id") is not None else None
+        except Exception:
+            payload, key = None, None
+        # Ответы одного чата — строго по одному, в порядке получения
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        try:
+            if previous is not None:
+                await previous
+            # Трасса вебхука продолжается из заголовка сообщения
+            with tracing.start_span("amo_get.deliver", tracing.extract(message.headers), "consumer", attempt=attempt):
+                await self._deliver(message, payload, key, attempt)
+        finally:
+            done.set_result(None)
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def _deliver(self, message: aio_pika.abc.AbstractIncomingMessage, payload: Optional[Dict],
+                       key: Optional[str], attempt: int) -> None:
+        message_id = message.message_id or ""
+        held = self._held.get(key) if key is not None else None
+        if held is not None and held[0] != message_id:
+            await self._hold_back(message, message_id, attempt, held[1])
+            return
+
+        async with self._semaphore:
+            self._in_flight += 1
+            try:
+                if payload is None:
+                    raise ValueError("некорректное тело сообщения")
+                delivered = await self.forwarder(payload)
+            except Exception as e:
+                logger.error(f"[INGEST] Ошибка доставки: {e}")
+                delivered = False
+            finally:
+                self._in_flight -= 1
+
+        try:
+            if delivered:
+                self.counters["delivered"] += 1
+                self._held.pop(key, None)
+            elif attempt >= self.max_attempts:
+                await self._publish(self.failed_queue_name, message.body, message_id, attempt)
+                self.counters["failed"] += 1
+                # Сообщение в failed больше не держит чат
+                self._held.pop(key, None)
+                logger.error(f"[INGEST] Сообщение не доставлено за {attempt} попыток, перенесено в {self.failed_queue_name}")
+            else:
+                index = min(attempt - 1, len(self.delays) - 1)
+                await self._publish(self.retry_queue_name(index), message.body, message_id, attempt)
+                self.counters["retried"] += 1
+                if key is not None:
+                    self._held[key] = (message_id, index)
+            await message.ack()
+        except Exception as e:
+            logger.critical(f"[INGEST] Ошибка перекладывания сообщения: {e}")
+            await message.nack(requeue=True)
+
+    async def _hold_back(self, message: aio_pika.abc.AbstractIncomingMessage, message_id: str,
+                         attempt: int, index: int) -> None:
+        """Ставит сообщение за удерживающим чат в ту же очередь задержки; попытка не засчитывается."""
+        try:
+            await self._publish(self.retry_queue_name(index), message.body, message_id, attempt - 1)
+            self.counters["held_back"] += 1
+            await message.ack()
+        except Exception as e:
+            logger.critical(f"[INGEST] Ошибка перекладывания сообщения: {e}")
+            await message.nack(requeue=True)
+
+    async def stats(self) -> Dict:
+        result = {"ready": self.ready, "in_flight": self._in_flight, "chats_held": len(self._held), **self.counters}
+        if self.ready:
+            declare_ok = await self._queue.declare()
+            result["queued"] = declare_ok.message_count
+        return result
@@ -0,0 +1,136 @@
+# amo_send/amo_client.py
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+
+import aiohttp
+
+from common.metrics import timed
+
+
+# --- Подпись запросов amoCRM ---
+def create_body_checksum(body: str) -> str:
+    """Создает MD5-чексумму тела запроса."""
+    return hashlib.md5(body.encode('utf-8')).hexdigest().lower()
+
+def rfc_date() -> str:
+    return datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S +0000')
+
+def create_signature(secret: str, checksum: str, api_method: str, date_rfc: str,
+                     http_method: str = 'POST', content_type: str = 'application/json') -> str:
+    """Создает HMAC-SHA1 подпись для заголовка X-Signature."""
+    str_to_sign = '\n'.join([http_method.upper(), checksum, content_type, date_rfc, api_method])
+    # Подпись и строка подписи в лог не пишутся: по ним можно подделать запрос
+    return hmac.new(secret.encode('utf-8'), str_to_sign.encode('utf-8'), hashlib.sha1).hexdigest().lower()
+
+def prepare_headers(checksum: str, signature: str, date_rfc: str) -> Dict[str, str]:
+    """Готовит словарь с заголовками для запроса к amoCRM."""
+    headers = {
+        'Date': date_rfc,
+        'Content-Type': 'application/json',
+        'Content-MD5': checksum,
+        'X-Signature': signature,
+        'User-Agent': 'FlowSync-Integration/1.0'
+    }
+    return headers
+
+
+class AmoResponse(NamedTuple):
+    status: int
+    text: str
+    headers: Dict[str, str]  # имена заголовков в нижнем регистре
+
+
+class AmoClient:
+    """
+    Неблокирующий клиент amoCRM с пулом keep-alive соединений.
+
+    Тело сериализуется один раз, и из одной и той же строки и одной даты
+    строятся чексумма, подпись и заголовки, так что подписанный Date
+    всегда совпадает с отправленным.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        secret: str,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 10.0,
+        pool_size: int = 20,
+        max_concurrency: int = 10,
+        keepalive_timeout: float = 30.0,
+    ) -> None:
+        self.base_url = base_url
+        self.secret = secret
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logging.info(
+            f"Клиент amoCRM запущен: pool={self.pool_size}, concurrency={self.max_concurrency}, "
+            f"connect_timeout={self.connect_timeout}s, read_timeout={self.read_timeout}s"
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def sign(self, json_body: str, api_method: str) -> Dict[str, str]:
+        """Подписывает тело и возвращает заголовки с той же датой, что в подписи."""
+        date_rfc = rfc_date()
+        checksum = create_body_checksum(json_body)
+        signature = create_signature(self.secret, checksum, api_method, date_rfc)
+        return prepare_headers(checksum, signature, date_rfc)
+
+    async def post(self, api_method: str, request_body: Dict, read_timeout: Optional[float] = None,
+                   operation: str = "post") -> AmoResponse:
+        """
+        Отправляет подписанный POST в amoCRM; operation — метка метрик hop="amocrm".
+        Сетевые ошибки и таймауты пробрасываются (aiohttp.ClientError, asyncio.TimeoutError).
+        """
+        if self._session is None:
+            await self.start()
+        json_body = json.dumps(request_body, ensure_ascii=False)
+        url = self.base_url + api_method
+        timeout = None
+        if read_timeout is not None:
+            timeout = aiohttp.ClientTimeout(
+                total=None, sock_connect=self.connect_timeout, sock_read=read_timeout
+            )
+        async with self._semaphore:
+            # Подписываем непосредственно перед отправкой, уже получив слот
+            headers = self.sign(json_body, api_method)
+            with timed("amocrm", operation) as call:
+                async with self._session.post(
+                    url, data=json_body.encode('utf-8'), headers=headers, timeout=timeout
+                ) as response:
+                    text = await response.text()
+                    call.outcome = str(response.status)
+                    return AmoResponse(
+                        response.status, text, {k.lower(): v for k, v in response.headers.items()}
+                    )
@@ -0,0 +1,51 @@
+# amo_send/ids.py
+
+import os
+import threading
+import time
+
+# Crockford base32: без I, L, O, U — строки сортируются так же, как числа
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def new_ulid() -> str:
+    """
+    ULID: 48 бит миллисекунд Unix-времени + 80 бит случайности, 26 символов.
+    Внутри одной миллисекунды случайная часть увеличивается на 1, поэтому
+    идентификаторы процесса строго возрастают и не совпадают.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:  # исчерпали миллисекунду — занимаем следующую
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), "big")
+        else:
+            _last_random = int.from_bytes(os.urandom(10), "big")
+        _last_ms = now_ms
+        return _encode(now_ms, 10) + _encode(_last_random, 16)
+
+
+def new_conversation_id() -> str:
+    return f"conv-{new_ulid()}"
+
+
+def new_message_id() -> str:
+    return f"msg-{new_ulid()}"
@@ -0,0 +1,259 @@
+# amo_send/outbox.py
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aio_pika
+
+from common import tracing
+
+# Отправка одного сообщения из outbox: True — доставлено, False — повторить позже,
+# PermanentFailure — повтор не поможет (например, 4xx от amoCRM)
+Sender = Callable[[Dict], Awaitable[bool]]
+# Ключ порядка сообщения (чат amoCRM); None — порядок не важен
+OrderingKey = Callable[[Dict], Optional[str]]
+
+
+class PermanentFailure(Exception):
+    """Сообщение отклонено адресатом окончательно: сразу в parked, без повторов."""
+
+
+def payload_conversation(payload: Dict) -> Optional[str]:
+    return payload.get("amocrm_id")
+
+
+class Outbox:
+    """
+    Надёжный outbox исходящих сообщений в amoCRM поверх RabbitMQ.
+
+    Очереди (все durable):
+      - {name}                основная очередь, из неё читают воркеры
+      - {name}.retry.{i}      очереди задержки: TTL = delays[i], по истечении
+                              сообщение через dead-letter возвращается в основную
+      - {name}.parked         сообщения, исчерпавшие max_attempts или отклонённые
+                              окончательно (PermanentFailure); ждут replay
+
+    Номер попытки хранится в заголовке x-attempt. Новое сообщение публикуется
+    с подтверждением брокера, а из основной очереди подтверждается только
+    после того, как оно доставлено или переложено в retry/parked.
+
+    Порядок внутри чата (ordering_key): сообщения одного чата обрабатываются
+    по одному в порядке получения. Пока первое недоставленное ждёт повтора,
+    следующие за ним не отправляются, а перекладываются в ту же очередь
+    задержки без увеличения x-attempt — очередь FIFO с одним TTL, поэтому
+    они возвращаются после него и снова встают за ним, пока оно не будет
+    доставлено или отложено в parked. Удержание хранится в памяти процесса:
+    amo_send работает в одном экземпляре; после перезапуска порядок
+    восстанавливается при следующей неудаче.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        sender: Sender,
+        name: str = "amo_outbox",
+        delays: Optional[List[float]] = None,
+        max_attempts: int = 8,
+        prefetch: int = 20,
+        ordering_key: OrderingKey = payload_conversation,
+    ) -> None:
+        self.url = url
+        self.sender = sender
+        self.name = name
+        self.delays = delays or [5, 30, 120, 600, 3600]
+        self.max_attempts = max_attempts
+        self.prefetch = prefetch
+        self.ordering_key = ordering_key
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self._parked_queue: Optional[aio_pika.abc.AbstractQueue] = None
+        # Чат -> (message_id, индекс очереди задержки) сообщения, ждущего повтора
+        self._held: Dict[str, Tuple[str, int]] = {}
+        # Чат -> завершение последнего принятого в обработку сообщения
+        self._tails: Dict[str, asyncio.Future] = {}
+        self.counters = {
+            "enqueued": 0, "delivered": 0, "retried": 0, "parked": 0, "replayed": 0, "held_back": 0,
+        }
+
+    @property
+    def ready(self) -> bool:
+        return self._channel is not None
+
+    def retry_queue_name(self, index: int) -> str:
+        return f"{self.name}.retry.{index}"
+
+    @property
+    def parked_queue_name(self) -> str:
+        return f"{self.name}.parked"
+
+    async def start(self, retries: int = 10, delay: float = 5.0) -> None:
+        for attempt in range(retries):
+            try:
+                self._connection = await aio_pika.connect_robust(self.url)
+                break
+            except Exception as e:
+                logging.error(f"Outbox: ошибка подключения к RabbitMQ ({attempt + 1}/{retries}): {e}")
+                await asyncio.sleep(delay)
+        else:
+            logging.critical("Outbox: RabbitMQ недоступен, сообщения отправляются напрямую")
+            return
+
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch)
+        self._queue = await channel.declare_queue(self.name, durable=True)
+        for index, seconds in enumerate(self.delays):
+            await channel.declare_queue(
+                self.retry_queue_name(index),
+                durable=True,
+                arguments={
+                    "x-message-ttl": int(seconds * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.name,
+                },
+            )
+        self._parked_queue = await channel.declare_queue(self.parked_queue_name, durable=True)
+        await self._queue.consume(self._on_message, no_ack=False)
+        self._channel = channel
+        logging.info(
+            f"Outbox {self.name} запущен: задержки={self.delays}, max_attempts={self.max_attempts}"
+        )
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+        self._connection = None
+        self._channel = None
+
+    async def _publish(self, routing_key: str, body: bytes, message_id: str, attempt: int,
+                       headers: Optional[Dict] = None) -> None:
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=body,
+                message_id=message_id,
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                headers=tracing.inject({**(headers or {}), "x-attempt": attempt}),
+            ),
+            routing_key=routing_key,
+        )
+
+    async def enqueue(self, payload: Dict) -> str:
+        """Сохраняет сообщение в outbox; возвращает его message_id."""
+        message_id = str(uuid.uuid4())
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._publish(self.name, body, message_id, attempt=0)
+        self.counters["enqueued"] += 1
+        return message_id
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        attempt = int((message.headers or {}).get("x-attempt", 0)) + 1
+        try:
+            payload = json.loads(message.body)
+            key = self.ordering_key(payload)
+        except Exception:
+            payload, key = None, None
+        # Сообщения одного чата — строго по одному, в порядке получения
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        try:
+            if previous is not None:
+                await previous
+            # Трасса запроса /send продолжается из заголовка сообщения, в том числе после повторов
+            with tracing.start_span("amo_send.outbox", tracing.extract(message.headers), "consumer", attempt=attempt):
+                await self._deliver(message, payload, key, attempt)
+        finally:
+            done.set_result(None)
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def _deliver(self, message: aio_pika.abc.AbstractIncomingMessage, payload: Optional[Dict],
+                       key: Optional[str], attempt: int) -> None:
+        held = self._held.get(key) if key is not None else None
+        if held is not None and held[0] != message.message_id:
+            await self._hold_back(message, attempt, held[1])
+            return
+
+        error = None
+        permanent = False
+        try:
+            if payload is None:
+                raise PermanentFailure("некорректное тело сообщения")
+            delivered = await self.sender(payload)
+        except PermanentFailure as e:
+            delivered = False
+            permanent = True
+            error = str(e)
+        except Exception as e:
+            delivered = False
+            error = str(e)
+
+        try:
+            if delivered:
+                self.counters["delivered"] += 1
+                self._held.pop(key, None)
+            elif permanent or attempt >= self.max_attempts:
+                await self._publish(
+                    self.parked_queue_name, message.body, message.message_id, attempt,
+                    headers={"x-last-error": error or "delivery failed"},
+                )
+                self.counters["parked"] += 1
+                # Отложенное сообщение больше не держит чат: следующие уходят по порядку без него
+                self._held.pop(key, None)
+                reason = f"отклонено: {error}" if permanent else f"после {attempt} попыток"
+                logging.error(
+                    f"Outbox: сообщение {message.message_id} отложено в {self.parked_queue_name} {reason}"
+                )
+            else:
+                index = min(attempt - 1, len(self.delays) - 1)
+                await self._publish(self.retry_queue_name(index), message.body, message.message_id, attempt)
+                self.counters["retried"] += 1
+                if key is not None:
+                    self._held[key] = (message.message_id, index)
+                logging.warning(
+                    f"Outbox: сообщение {message.message_id} не доставлено (попытка {attempt}), "
+                    f"повтор через {self.delays[index]}с"
+                )
+            await message.ack()
+        except Exception as e:
+            # Не смогли переложить — возвращаем в основную очередь, сообщение не теряется
+            logging.critical(f"Outbox: ошибка перекладывания сообщения {message.message_id}: {e}")
+            await message.nack(requeue=True)
+
+    async def _hold_back(self, message: aio_pika.abc.AbstractIncomingMessage, attempt: int, index: int) -> None:
+        """Ставит сообщение за удерживающим чат в ту же очередь задержки; попытка не засчитывается."""
+        try:
+            await self._publish(self.retry_queue_name(index), message.body, message.message_id, attempt - 1)
+            self.counters["held_back"] += 1
+            await message.ack()
+        except Exception as e:
+            logging.critical(f"Outbox: ошибка перекладывания сообщения {message.message_id}: {e}")
+            await message.nack(requeue=True)
+
+    async def replay_parked(self, limit: int = 100) -> int:
+        """Возвращает до limit отложенных сообщений в основную очередь со сбросом попыток."""
+        replayed = 0
+        while replayed < limit:
+            message = await self._parked_queue.get(no_ack=False, fail=False)
+            if message is None:
+                break
+            await self._publish(self.name, message.body, message.message_id or str(uuid.uuid4()), attempt=0)
+            await message.ack()
+            replayed += 1
+        self.counters["replayed"] += replayed
+        if replayed:
+            logging.info(f"Outbox: возвращено из {self.parked_queue_name} сообщений: {replayed}")
+        return replayed
+
+    async def stats(self) -> Dict:
+        result = {"ready": self.ready, "conversations_held": len(self._held), **self.counters}
+        if self.ready:
+            for key, queue in (("queued", self._queue), ("parked_count", self._parked_queue)):
+                declare_ok = await queue.declare()
+                result[key] = declare_ok.message_count
+        return result
@@ -0,0 +1,215 @@
+# amo_send/scheduler.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from amo_client import AmoResponse
+from common import tracing
+
+SendCall = Callable[[], Awaitable[AmoResponse]]
+
+
+def parse_retry_after(value: Optional[str], default: float = 1.0) -> float:
+    """Retry-After в секундах: число или HTTP-дата."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket с адаптацией под ответы amoCRM:
+    на 429 — пауза на Retry-After и мультипликативное снижение скорости,
+    на успех — аддитивный возврат к исходной скорости.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.5,
+                 decrease_factor: float = 0.5, increase_step: float = 0.1) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Под замком ожидающие получают токены строго по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_throttled(self, retry_after: float) -> None:
+        now = time.monotonic()
+        if now >= self._paused_until:
+            # Одновременные 429 одной паузы снижают скорость только один раз
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self._paused_until = max(self._paused_until, now + retry_after)
+        self._tokens = 0.0
+        self._updated = now
+
+    def on_success(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def stats(self) -> Dict:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+        }
+
+
+class _Job:
+    __slots__ = ("scope_id", "call", "future", "attempts", "trace")
+
+    def __init__(self, scope_id: str, call: SendCall, future: asyncio.Future) -> None:
+        self.scope_id = scope_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+        self.trace = tracing.current()  # запрос выполняет воркер, контекст трассы — от вызвавшего
+
+
+class AmoScheduler:
+    """
+    Планировщик исходящих запросов в amoCRM.
+
+    - token bucket на каждый scope_id, подстраивается под 429/Retry-After;
+    - внутри conversation_id запросы уходят строго по порядку (один в полёте);
+    - между разговорами — round-robin, так что один шумный чат не вытесняет остальных.
+    """
+
+    def __init__(self, rate: float = 7.0, burst: int = 7, workers: int = 10,
+                 max_throttle_retries: int = 5) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.workers = workers
+        self.max_throttle_retries = max_throttle_retries
+        self._buckets: Dict[str, AdaptiveTokenBucket] = {}
+        self._conversations: Dict[Tuple[str, str], Deque[_Job]] = {}
+        self._busy: Set[Tuple[str, str]] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._queued = 0
+        self.throttled_total = 0
+
+    def bucket(self, scope_id: str) -> AdaptiveTokenBucket:
+        bucket = self._buckets.get(scope_id)
+        if bucket is None:
+            bucket = self._buckets[scope_id] = AdaptiveTokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def start(self) -> None:
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Планировщик amoCRM запущен: rate={self.rate}/s, burst={self.burst}, workers={self.workers}")
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, scope_id: str, conversation_id: str, call: SendCall) -> AmoResponse:
+        """Ставит запрос в очередь разговора и ждёт ответ amoCRM."""
+        if self._ready is None:
+            await self.start()
+        key = (scope_id, conversation_id)
+        job = _Job(scope_id, call, asyncio.get_running_loop().create_future())
+        queue = self._conversations.get(key)
+        if queue is None:
+            queue = self._conversations[key] = deque()
+        queue.append(job)
+        self._queued += 1
+        if key not in self._busy and len(queue) == 1:
+            self._ready.put_nowait(key)
+        return await job.future
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._conversations.get(key)
+            if not queue:
+                continue
+            self._busy.add(key)
+            job = queue[0]
+            try:
+                done = await self._run(job)
+            finally:
+                self._busy.discard(key)
+            if done:
+                queue.popleft()
+                self._queued -= 1
+            if queue:
+                self._ready.put_nowait(key)  # в конец круга: очередь других разговоров
+            else:
+                del self._conversations[key]
+
+    async def _run(self, job: _Job) -> bool:
+        """Выполняет голову очереди; False — запрос надо повторить после паузы."""
+        if job.future.cancelled():
+            return True
+        bucket = self.bucket(job.scope_id)
+        await bucket.acquire()
+        job.attempts += 1
+        try:
+            with tracing.activate(job.trace):
+                response = await job.call()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return True
+        if response.status == 429 and job.attempts <= self.max_throttle_retries:
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            bucket.on_throttled(retry_after)
+            self.throttled_total += 1
+            logging.warning(
+                f"amoCRM 429 для scope_id={job.scope_id}: пауза {retry_after:.1f}с, "
+                f"скорость снижена до {bucket.rate:.2f}/s (попытка {job.attempts})"
+            )
+            return False
+        if response.status != 429:
+            bucket.on_success()
+        if not job.future.done():
+            job.future.set_result(response)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self._queued,
+            "conversations_waiting": len(self._conversations),
+            "in_flight": len(self._busy),
+            "throttled_total": self.throttled_total,
+            "scopes": {scope_id: bucket.stats() for scope_id, bucket in self._buckets.items()},
+        }
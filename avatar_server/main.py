@@ -0,0 +1,117 @@
+# avatar_server/main.py
+
+import asyncio
+import logging
+import os
+import re
+from typing import Dict
+
+from aiohttp import web
+from PIL import Image
+
+from common import log, profiling
+from common.metrics import STATS, aiohttp_metrics_handler, aiohttp_middleware, timed
+
+# --- Настройка логгера ---
+log.setup("avatar_server", '%(asctime)s | %(levelname)s | %(message)s')
+
+# --- Конфигурация ---
+AVATAR_DIR = os.getenv("AVATAR_DIR", "/Data/profile_picture")
+THUMB_DIR = os.path.join(AVATAR_DIR, ".thumbs")
+THUMB_SIZES = {int(s) for s in os.getenv("AVATAR_THUMB_SIZES", "64,128,256").split(",")}
+# Файлы аватаров не меняются: новое изображение получает новое имя (file_unique_id)
+CACHE_CONTROL = os.getenv("AVATAR_CACHE_CONTROL", "public, max-age=31536000, immutable")
+PORT = int(os.getenv("PORT", "8000"))
+
+# Только сами изображения: без индекса avatars.json, .part-файлов и выхода из каталога
+FILENAME_RE = re.compile(r"^[A-Za-z0-9_-]+\.(jpg|jpeg|png|webp)$", re.IGNORECASE)
+
+# Миниатюры, которые сейчас генерируются: параллельные запросы ждут одну генерацию
+_thumbnails_in_progress: Dict[str, asyncio.Future] = {}
+
+
+def make_thumbnail(source_path: str, thumb_path: str, size: int) -> None:
+    """Уменьшает изображение до size x size с сохранением пропорций (в пуле потоков)."""
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    part_path = thumb_path + ".part"
+    image_format = Image.registered_extensions()[os.path.splitext(thumb_path)[1].lower()]
+    with Image.open(source_path) as image:
+        image.thumbnail((size, size))
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(part_path, format=image_format)
+    os.replace(part_path, thumb_path)
+
+
+async def ensure_thumbnail(source_path: str, filename: str, size: int) -> str:
+    """Путь к миниатюре; генерирует её один раз и хранит на диске рядом с оригиналами."""
+    thumb_path = os.path.join(THUMB_DIR, str(size), filename)
+    try:
+        if os.stat(thumb_path).st_mtime >= os.stat(source_path).st_mtime:
+            return thumb_path
+    except FileNotFoundError:
+        pass
+
+    pending = _thumbnails_in_progress.get(thumb_path)
+    if pending is not None:
+        await asyncio.shield(pending)
+        return thumb_path
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, make_thumbnail, source_path, thumb_path, size)
+    _thumbnails_in_progress[thumb_path] = future
+    try:
+        with timed("thumbnail", str(size)):
+            await asyncio.shield(future)
+        logging.info(f"Миниатюра {size}px создана: {filename}")
+    finally:
+        _thumbnails_in_progress.pop(thumb_path, None)
+    return thumb_path
+
+
+async def serve_avatar(request: web.Request) -> web.StreamResponse:
+    """
+    Отдаёт аватар или его миниатюру (?size=128).
+
+    FileResponse отправляет файл через sendfile, выставляет ETag и Last-Modified,
+    обрабатывает If-None-Match / If-Modified-Since (304) и Range (206).
+    """
+    filename = request.match_info["filename"]
+    if not FILENAME_RE.match(filename):
+        raise web.HTTPNotFound()
+    source_path = os.path.join(AVATAR_DIR, filename)
+    if not os.path.isfile(source_path):
+        raise web.HTTPNotFound()
+
+    path = source_path
+    size = request.query.get("size")
+    if size is not None:
+        if not size.isdigit() or int(size) not in THUMB_SIZES:
+            raise web.HTTPBadRequest(text=f"size must be one of {sorted(THUMB_SIZES)}")
+        try:
+            path = await ensure_thumbnail(source_path, filename, int(size))
+        except Exception as e:
+            logging.error(f"Ошибка создания миниатюры {filename} ({size}px): {e}")
+            raise web.HTTPInternalServerError()
+
+    return web.FileResponse(path, headers={"Cache-Control": CACHE_CONTROL})
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[aiohttp_middleware()])
+    app.router.add_get("/profile_picture/{filename}", serve_avatar)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", aiohttp_metrics_handler)
+    app.router.add_get("/debug/profile", profiling.aiohttp_profile_handler)
+    app.on_startup.append(profiling.aiohttp_startup)
+    STATS.register("avatar_server", lambda: {"thumbnails_in_progress": len(_thumbnails_in_progress)})
+    return app
+
+
+if __name__ == "__main__":
+    logging.info(f"Раздача аватаров из {AVATAR_DIR} на порту {PORT}")
+    web.run_app(create_app(), port=PORT, access_log=None)
@@ -3,12 +3,10 @@
 import asyncio
 import logging
 from user_db import main as user_db_main  # Импорт main из user_db.py
+from common import log
 
 # Настройка логгера
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+log.setup("bd_connector", '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+# bd_connector/sharding.py
+"""Имена очередей и обменника шардированного bd_connector; распределение разделов — common/sharding.py."""
+
+REQUEST_QUEUE = "user_requests"
+MEMBERSHIP_EXCHANGE = "bd_membership"
+
+
+def partition_queue(partition: int) -> str:
+    return f"{REQUEST_QUEUE}.p{partition:03d}"
@@ -0,0 +1,348 @@
+# bd_connector/storage.py
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Начало каждой записи журнала (json.dumps с разделителями по умолчанию)
+RECORD_START = b'{"op": '
+
+
+class UserStore:
+    """
+    Хранилище пользователей: хэш-индекс в памяти + append-only журнал на диске.
+
+    Файлы рядом со снимком:
+      - users.json             снимок (формат прежнего users.json, читается как есть)
+      - users.log              журнал изменений, одна JSON-запись на строку
+      - users.log.compacting   журнал, который сейчас сворачивается в снимок
+      - users.lock             эксклюзивная блокировка единственного писателя
+
+    Запись попадает в буфер и сбрасывается на диск пачкой одним fsync
+    (group commit), после чего put() возвращает управление. Если запись или
+    fsync не удались, журнал обрезается до начала пачки: отказ, который
+    увидел вызывающий, не появится после перезапуска. Когда журнал
+    разрастается, он в фоне сворачивается в новый снимок.
+
+    Второй индекс amocrm_id -> tg_id строится в памяти при загрузке
+    и обновляется вместе с основным.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: Path,
+        fsync_interval: float = 0.005,
+        compact_threshold: int = 10000,
+    ) -> None:
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = self.snapshot_path.with_suffix(".log")
+        self.compacting_path = self.snapshot_path.with_suffix(".log.compacting")
+        self.lock_path = self.snapshot_path.with_suffix(".lock")
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+
+        self._users: Dict[str, Dict] = {}
+        self._by_amocrm_id: Dict[str, str] = {}
+        self._log_fd: Optional[int] = None
+        self._lock_file = None
+        self._log_records = 0
+        self._pending: List[Tuple[List[Tuple[str, Dict]], bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._io_lock: Optional[asyncio.Lock] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    # --- Открытие и восстановление ---
+    def open(self, blocking: bool = True, seed: Optional[Callable[[], Dict[str, Dict]]] = None) -> None:
+        """
+        Берёт блокировку, загружает снимок и доигрывает журналы после сбоя.
+        blocking=False: если файл держит другой процесс, сразу BlockingIOError.
+        seed() даёт начальные данные, если снимка ещё нет.
+        """
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise
+
+        if not self.snapshot_path.exists():
+            self._write_snapshot(seed() if seed else {})
+            logger.info(f"Создан новый файл {self.snapshot_path.name}")
+        self._users = self._load_snapshot()
+        self._by_amocrm_id = {}
+        for tg_id, user in self._users.items():
+            self._index_amocrm_id(tg_id, None, user)
+
+        replayed = 0
+        had_compacting = self.compacting_path.exists()
+        if had_compacting:
+            replayed += self._replay(self.compacting_path)
+        replayed += self._replay(self.log_path)
+
+        # Непустой журнал без применённых записей — только повреждённые строки: их тоже убираем
+        had_log = self.log_path.exists() and self.log_path.stat().st_size > 0
+        if had_compacting or replayed or had_log:
+            # Незавершённая работа с прошлого запуска: сразу фиксируем её в снимке
+            self._write_snapshot(self._users)
+            if had_compacting:
+                os.remove(self.compacting_path)
+            open(self.log_path, "w").close()
+            self._fsync_dir()
+            logger.info(f"Восстановлено {replayed} записей журнала в {self.snapshot_path.name}")
+
+        self._open_log()
+        self._log_records = 0
+        logger.info(f"Хранилище открыто: {len(self._users)} пользователей")
+
+    @classmethod
+    def read_all(cls, snapshot_path: Path) -> Dict[str, Dict]:
+        """Снимок с журналами без блокировки и без изменения файлов (для переноса данных)."""
+        reader = cls(snapshot_path)
+        if not reader.snapshot_path.exists():
+            return {}
+        reader._users = reader._load_snapshot()
+        for path in (reader.compacting_path, reader.log_path):
+            if path.exists():
+                with open(path, "rb") as f:
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        record = cls._parse(line)
+                        if record is not None:
+                            reader._apply(record)
+        return reader._users
+
+    def _load_snapshot(self) -> Dict[str, Dict]:
+        with open(self.snapshot_path, "r") as f:
+            content = f.read().strip()
+        if not content:
+            logger.info(f"Файл {self.snapshot_path} пустой, начинаем с пустого индекса")
+            return {}
+        # Ошибку декодирования не глотаем: иначе следующий снимок затрёт данные
+        return json.loads(content)
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[Dict]:
+        """
+        Запись из строки журнала или None. Оборванный фрагмент, к которому
+        приклеилась следующая запись, отбрасывается, а сама запись читается.
+        """
+        try:
+            return json.loads(line)
+        except ValueError:
+            pass
+        # Внутри строковых значений кавычки экранированы, поэтому RECORD_START — только начало записи
+        start = line.rfind(RECORD_START)
+        if start > 0:
+            try:
+                return json.loads(line[start:])
+            except ValueError:
+                pass
+        return None
+
+    def _replay(self, path: Path) -> int:
+        """
+        Применяет записи журнала к индексу. Повреждённая строка в середине
+        пропускается, остальные записи применяются; оборванный хвост отрезается.
+        """
+        if not path.exists():
+            return 0
+        count = 0
+        skipped = 0
+        offset = 0
+        torn_at = None
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    torn_at = offset  # без перевода строки бывает только последняя запись
+                    break
+                record = self._parse(line)
+                try:
+                    if record is None:
+                        raise ValueError("не JSON")
+                    self._apply(record)
+                    count += 1
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error(f"Повреждённая запись в {path.name} на смещении {offset} пропущена: {e}")
+                    skipped += 1
+                offset += len(line)
+        if skipped:
+            logger.error(f"В {path.name} пропущено повреждённых записей: {skipped}, применено: {count}")
+        if torn_at is not None:
+            logger.warning(f"Обрезаем {path.name} до {torn_at} байт (незавершённая запись)")
+            with open(path, "r+b") as f:
+                f.truncate(torn_at)
+        return count
+
+    def _apply(self, record: Dict) -> None:
+        if record["op"] == "put":
+            self._set(record["key"], record["value"])
+
+    def _set(self, tg_id: str, user: Dict) -> None:
+        previous = self._users.get(tg_id)
+        self._users[tg_id] = user
+        self._index_amocrm_id(tg_id, previous, user)
+
+    def _index_amocrm_id(self, tg_id: str, previous: Optional[Dict], user: Dict) -> None:
+        old_amocrm_id = (previous or {}).get("amocrm_id")
+        new_amocrm_id = user.get("amocrm_id")
+        if old_amocrm_id and old_amocrm_id != new_amocrm_id and self._by_amocrm_id.get(old_amocrm_id) == tg_id:
+            del self._by_amocrm_id[old_amocrm_id]
+        if new_amocrm_id:
+            self._by_amocrm_id[new_amocrm_id] = tg_id
+
+    # --- Чтение ---
+    def get(self, tg_id: str) -> Optional[Dict]:
+        return self._users.get(tg_id)
+
+    def get_by_amocrm_id(self, amocrm_id: str) -> Optional[Dict]:
+        tg_id = self._by_amocrm_id.get(amocrm_id)
+        return self._users.get(tg_id) if tg_id is not None else None
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    # --- Запись (group commit) ---
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def put(self, tg_id: str, record: Dict) -> None:
+        """Записывает пользователя; возвращается, когда запись сброшена на диск."""
+        await self.put_many([(tg_id, record)])
+
+    async def put_many(self, items: List[Tuple[str, Dict]]) -> None:
+        """Записывает пачку пользователей одной записью в журнал и одним fsync."""
+        if not items:
+            return
+        data = "".join(
+            json.dumps({"op": "put", "key": tg_id, "value": record}, ensure_ascii=False) + "\n"
+            for tg_id, record in items
+        ).encode("utf-8")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, data, future))
+        self._wakeup.set()
+        await future
+
+    async def _writer(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if self.fsync_interval:
+                await asyncio.sleep(self.fsync_interval)  # копим пачку под один fsync
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                if self._closing:
+                    return
+                continue
+            data = b"".join(item[1] for item in batch)
+            try:
+                async with self._io_lock:
+                    await asyncio.to_thread(self._append_and_sync, data)
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала {self.log_path.name}: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for items, _, future in batch:
+                for tg_id, record in items:
+                    self._set(tg_id, record)
+                    self._log_records += 1
+                if not future.done():
+                    future.set_result(None)
+            if self._log_records >= self.compact_threshold and self._compaction_task is None:
+                self._compaction_task = asyncio.create_task(self._compact_in_background())
+            if self._closing:
+                self._wakeup.set()  # дочищаем остаток буфера и выходим
+
+    def _open_log(self) -> None:
+        self._log_fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _append_and_sync(self, data: bytes) -> None:
+        # Без буфера Python: при ошибке в памяти процесса не остаётся байтов, которые уйдут со следующей пачкой
+        offset = os.fstat(self._log_fd).st_size
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._log_fd, view):]
+            os.fsync(self._log_fd)
+        except BaseException:
+            try:
+                os.ftruncate(self._log_fd, offset)
+                os.fsync(self._log_fd)
+            except OSError as e:
+                logger.critical(f"Не удалось откатить {self.log_path.name} до {offset} байт: {e}")
+            raise
+
+    # --- Компакция ---
+    async def _compact_in_background(self) -> None:
+        try:
+            await self.compact()
+        except Exception as e:
+            logger.error(f"Ошибка компакции {self.snapshot_path.name}: {e}")
+        finally:
+            self._compaction_task = None
+
+    async def compact(self) -> None:
+        """Сворачивает журнал в новый снимок, не останавливая запись."""
+        async with self._io_lock:
+            os.close(self._log_fd)
+            if self.compacting_path.exists():
+                # Прошлая компакция не удалась: дописываем журнал к несвёрнутому хвосту
+                with open(self.compacting_path, "ab") as dst, open(self.log_path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.compacting_path)
+            self._open_log()
+            self._log_records = 0
+            snapshot = dict(self._users)
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        os.remove(self.compacting_path)
+        logger.info(f"Компакция завершена: {len(snapshot)} пользователей в {self.snapshot_path.name}")
+
+    def _write_snapshot(self, users: Dict[str, Dict]) -> None:
+        tmp_path = self.snapshot_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(users, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._fsync_dir()
+
+    def _fsync_dir(self) -> None:
+        fd = os.open(self.snapshot_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --- Завершение ---
+    async def close(self) -> None:
+        if self._writer_task:
+            self._closing = True
+            self._wakeup.set()
+            await self._writer_task
+        if self._compaction_task:
+            await self._compaction_task
+        if self._log_fd is not None:
+            os.close(self._log_fd)
+            self._log_fd = None
+        if self._lock_file:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
@@ -0,0 +1,241 @@
+# benchmarks/fakes.py
+"""
+Заглушки внешних API для бенчмарков: amoCRM (чаты, /v2/origin/custom/{scope_id})
+и Telegram Bot API (getUpdates, sendMessage, getFile, скачивание файлов).
+
+FakeAmoCRM проверяет Content-MD5 и X-Signature так же, как amoCRM, отвечает
+с заданной задержкой и долей 429 с Retry-After и, если у сообщения есть
+ссылка на вложение, скачивает его, как это делает amoCRM.
+FakeTelegram отдаёт добавленные через inject() апдейты долгим опросом
+и отвечает на исходящие вызовы бота; файлы генерирует заданного размера.
+Полученные сообщения передаются в on_message(text, received_at).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+OnMessage = Callable[[str, float], None]
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+class FakeAmoCRM:
+    def __init__(self, secret: str, scope_id: str, on_message: OnMessage, latency: float = 0.0,
+                 jitter: float = 0.0, throttle_ratio: float = 0.0, retry_after: int = 1,
+                 on_media: Optional[Callable[[float, int, bool], None]] = None) -> None:
+        self.secret = secret.encode("utf-8")
+        self.scope_id = scope_id
+        self.on_message = on_message
+        self.on_media = on_media
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_ratio = throttle_ratio
+        self.retry_after = retry_after
+        self.counters: Counter = Counter()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: set = set()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 * 1024)
+        app.router.add_post("/v2/origin/custom/{scope_id}", self.handle)
+        return app
+
+    async def start(self, port: int) -> web.AppRunner:
+        self._session = aiohttp.ClientSession()
+        return await start_site(self.app(), port)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+    def _signature_ok(self, request: web.Request, body: bytes) -> bool:
+        checksum = hashlib.md5(body).hexdigest()
+        if request.headers.get("Content-MD5", "").lower() != checksum:
+            return False
+        string_to_sign = "\n".join([
+            "POST", checksum, request.headers.get("Content-Type", ""), request.headers.get("Date", ""), request.path,
+        ])
+        expected = hmac.new(self.secret, string_to_sign.encode("utf-8"), hashlib.sha1).hexdigest()
+        return hmac.compare_digest(expected, request.headers.get("X-Signature", "").lower())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        self.counters["requests"] += 1
+        if request.match_info["scope_id"] != self.scope_id:
+            self.counters["wrong_scope"] += 1
+            return web.json_response({"error": "scope not found"}, status=404)
+        if not self._signature_ok(request, body):
+            self.counters["bad_signature"] += 1
+            return web.json_response({"error": "invalid signature"}, status=403)
+        if self.throttle_ratio and random.random() < self.throttle_ratio:
+            self.counters["throttled"] += 1
+            return web.json_response(
+                {"error": "too many requests"}, status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        payload = json.loads(body)["payload"]
+        message = payload.get("message") or {}
+        self.counters["messages"] += 1
+        self.on_message(message.get("text") or "", time.perf_counter())
+        if message.get("media"):
+            task = asyncio.create_task(self._fetch_media(message["media"]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.json_response({
+            "new_message": {
+                "conversation_id": payload.get("conversation_id"),
+                "sender_id": f"sender-{payload['sender']['id']}",
+                "msgid": f"amo-{payload.get('msgid')}",
+                "ref_id": payload.get("msgid"),
+            }
+        })
+
+    async def _fetch_media(self, url: str) -> None:
+        started = time.perf_counter()
+        size = 0
+        ok = False
+        try:
+            async with self._session.get(url) as response:
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            pass
+        self.counters["media_fetched" if ok else "media_failed"] += 1
+        if self.on_media is not None:
+            self.on_media(time.perf_counter() - started, size, ok)
+
+
+class FakeTelegram:
+    def __init__(self, token: str, on_message: OnMessage) -> None:
+        self.token = token
+        self.on_message = on_message
+        self.counters: Counter = Counter()
+        self.files: Dict[str, int] = {}  # file_id -> размер
+        self._updates: List[Dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates: Optional[asyncio.Event] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", f"/bot{self.token}/{{method}}", self.handle)
+        app.router.add_get(f"/file/bot{self.token}/{{path:.+}}", self.download)
+        return app
+
+    async def start(self, port: int) -> web.AppRunner:
+        self._new_updates = asyncio.Event()
+        return await start_site(self.app(), port)
+
+    def inject(self, update: Dict) -> None:
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def add_file(self, file_id: str, size: int) -> None:
+        self.files[file_id] = size
+
+    @property
+    def pending(self) -> int:
+        return len(self._updates)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def _params(self, request: web.Request) -> Dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        if request.method == "POST":
+            post = await request.post()
+            return {key: value for key, value in post.items() if isinstance(value, str)}
+        return dict(request.query)
+
+    def _sent(self, chat_id, text: str) -> Dict:
+        self.on_message(text, time.perf_counter())
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.counters[method] += 1
+        if method == "getUpdates":
+            return self.ok(await self._get_updates(params))
+        if method == "sendMessage":
+            return self.ok(self._sent(params["chat_id"], params.get("text", "")))
+        if method in ("sendPhoto", "sendDocument", "sendVideo", "sendVoice", "sendAudio"):
+            return self.ok(self._sent(params["chat_id"], params.get("caption", "")))
+        if method == "getFile":
+            file_id = params["file_id"]
+            if file_id not in self.files:
+                return web.json_response(
+                    {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}, status=400
+                )
+            return self.ok({
+                "file_id": file_id, "file_unique_id": f"u{file_id}",
+                "file_size": self.files[file_id], "file_path": f"photos/{file_id}.jpg",
+            })
+        if method == "getMe":
+            return self.ok({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        if method in ("deleteWebhook", "setWebhook"):
+            return self.ok(True)
+        if method == "getUserProfilePhotos":
+            return self.ok({"total_count": 0, "photos": []})
+        self.counters["unknown_method"] += 1
+        return web.json_response(
+            {"ok": False, "error_code": 404, "description": f"Not Found: method {method} not found"}, status=404
+        )
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def download(self, request: web.Request) -> web.StreamResponse:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].split(".", 1)[0]
+        size = self.files.get(file_id)
+        if size is None:
+            raise web.HTTPNotFound()
+        self.counters["file_downloads"] += 1
+        response = web.StreamResponse(headers={"Content-Length": str(size)})
+        await response.prepare(request)
+        chunk = b"\0" * (64 * 1024)
+        left = size
+        while left > 0:
+            await response.write(chunk[:left])
+            left -= len(chunk)
+        await response.write_eof()
+        return response
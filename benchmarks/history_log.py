@@ -0,0 +1,88 @@
+# benchmarks/history_log.py
+"""
+Пропускная способность записи и задержка чтения истории разговоров (telegram_bot/history.py).
+
+Пишет -n сообщений по --conversations разговорам во временный каталог,
+переоткрывает журнал (время восстановления) и измеряет задержку чтения
+последних --limit сообщений и интервала времени для случайных разговоров.
+
+Пример:
+    python benchmarks/history_log.py -n 2000000 --conversations 20000 --reads 20000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_bot"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from history import ConversationLog  # noqa: E402
+from stats import format_summary, summarize  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--messages", type=int, default=1000000)
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--text-size", type=int, default=120, help="длина текста сообщения")
+    parser.add_argument("--segment-mb", type=int, default=64)
+    parser.add_argument("--reads", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--dir", help="каталог журнала (по умолчанию временный, удаляется)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="history-bench-")
+    log = ConversationLog(directory, segment_bytes=args.segment_mb * 1024 * 1024)
+    log.open()
+    text = "x" * args.text_size
+    base_ts = time.time() - args.messages * 0.001
+    try:
+        started = time.perf_counter()
+        for i in range(args.messages):
+            log.append(str(100000 + i % args.conversations), "in" if i % 2 else "out", text,
+                       ts=base_ts + i * 0.001, message_id=i)
+        elapsed = time.perf_counter() - started
+        stats = log.stats()
+        print(f"append: {args.messages} msgs in {elapsed:.2f}s = {args.messages / elapsed:,.0f} msg/s, "
+              f"{stats['bytes'] / elapsed / 2 ** 20:.1f} MiB/s, segments={stats['segments']}")
+        log.close()
+
+        started = time.perf_counter()
+        log.open()
+        print(f"reopen: {time.perf_counter() - started:.2f}s, conversations={log.stats()['conversations']}")
+
+        rng = random.Random(1)
+        tail_ms = []
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            conversation = str(100000 + rng.randrange(args.conversations))
+            t0 = time.perf_counter()
+            messages = log.tail(conversation, args.limit)
+            tail_ms.append((time.perf_counter() - t0) * 1000)
+            assert len(messages) == min(args.limit, args.messages // args.conversations)
+        print(format_summary(f"tail limit={args.limit}", summarize(tail_ms, time.perf_counter() - started, 0)))
+
+        # Последние ~10% времени записи: интервал попадает в хвост журнала
+        span = args.messages * 0.001
+        range_ms = []
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            conversation = str(100000 + rng.randrange(args.conversations))
+            since = base_ts + span * 0.9
+            t0 = time.perf_counter()
+            log.range(conversation, since, since + span * 0.05)
+            range_ms.append((time.perf_counter() - t0) * 1000)
+        print(format_summary("range 5% window", summarize(range_ms, time.perf_counter() - started, 0)))
+    finally:
+        log.close()
+        if not args.dir:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# benchmarks/memory_broker.py
+"""
+RabbitMQ в памяти процесса для бенчмарка конвейера без брокера.
+
+install() подменяет aio_pika.connect_robust / aio_pika.connect, и сервисы,
+загруженные в тот же процесс, работают через общий MemoryBroker. Поддержано
+ровно то, чем пользуются сервисы: default и fanout-обменники, очереди
+с durable/exclusive/auto_delete, x-message-ttl и dead-letter (очереди
+повторов outbox), prefetch канала, ack(multiple)/nack/reject, get(),
+cancel() и declare().message_count. Сообщения не переживают процесс,
+порядок и возврат неподтверждённых при закрытии канала — как у RabbitMQ.
+"""
+
+import asyncio
+import itertools
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+import aio_pika
+from aio_pika.exceptions import QueueEmpty
+
+
+class _DeclareOk:
+    def __init__(self, message_count: int, consumer_count: int) -> None:
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+
+
+class MemoryMessage:
+    """Доставленное сообщение с интерфейсом AbstractIncomingMessage, которым пользуются сервисы."""
+
+    def __init__(self, message: aio_pika.Message, channel: "MemoryChannel", delivery_tag: int,
+                 redelivered: bool, no_ack: bool, routing_key: str) -> None:
+        self._message = message
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+        self.routing_key = routing_key
+        self.processed = no_ack
+
+    def __getattr__(self, name: str) -> Any:
+        # body, headers, correlation_id, reply_to, message_id, content_type, ...
+        return getattr(self._message, name)
+
+    async def ack(self, multiple: bool = False) -> None:
+        self.channel._ack(self.delivery_tag, multiple)
+        self.processed = True
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        self.channel._reject(self.delivery_tag, multiple, requeue)
+        self.processed = True
+
+    async def reject(self, requeue: bool = False) -> None:
+        self.channel._reject(self.delivery_tag, False, requeue)
+        self.processed = True
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, ignore_processed: bool = False):
+        try:
+            yield self
+        except BaseException:
+            if not self.processed:
+                await self.reject(requeue=requeue)
+            raise
+        if not self.processed:
+            await self.ack()
+
+
+class _Consumer:
+    def __init__(self, tag: str, channel: "MemoryChannel", callback: Callable, no_ack: bool) -> None:
+        self.tag = tag
+        self.channel = channel
+        self.callback = callback
+        self.no_ack = no_ack
+
+    def has_capacity(self) -> bool:
+        channel = self.channel
+        return self.no_ack or not channel.prefetch_count or len(channel.unacked) < channel.prefetch_count
+
+
+class MemoryQueue:
+    def __init__(self, broker: "MemoryBroker", name: str, owner: Optional["MemoryConnection"],
+                 auto_delete: bool, arguments: Optional[Dict]) -> None:
+        self.broker = broker
+        self.name = name
+        self.owner = owner  # соединение эксклюзивной очереди
+        self.auto_delete = auto_delete
+        self.arguments = arguments or {}
+        self.messages: Deque[List] = deque()  # [message, redelivered, routing_key]
+        self.consumers: List[_Consumer] = []
+        self._next_consumer = 0
+
+    def put(self, message: aio_pika.Message, routing_key: str, redelivered: bool = False, front: bool = False) -> None:
+        entry = [message, redelivered, routing_key]
+        if front:
+            self.messages.appendleft(entry)
+        else:
+            self.messages.append(entry)
+        ttl = self.arguments.get("x-message-ttl")
+        if ttl is not None and not front:
+            asyncio.get_running_loop().call_later(ttl / 1000, self._expire, entry)
+        self.dispatch()
+
+    def _expire(self, entry: List) -> None:
+        try:
+            self.messages.remove(entry)
+        except ValueError:
+            return  # уже доставлено
+        self.dead_letter(entry[0], entry[2])
+
+    def dead_letter(self, message: aio_pika.Message, routing_key: str) -> None:
+        exchange = self.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        self.broker.route(exchange, self.arguments.get("x-dead-letter-routing-key") or routing_key, message)
+
+    def dispatch(self) -> None:
+        while self.messages and self.consumers:
+            consumer = None
+            for _ in range(len(self.consumers)):
+                candidate = self.consumers[self._next_consumer % len(self.consumers)]
+                self._next_consumer += 1
+                if candidate.has_capacity():
+                    consumer = candidate
+                    break
+            if consumer is None:
+                return  # все упёрлись в prefetch, продолжим после ack
+            message, redelivered, routing_key = self.messages.popleft()
+            incoming = consumer.channel.deliver(self, message, redelivered, routing_key, consumer.no_ack)
+            self.broker.spawn(consumer.callback(incoming))
+
+    def remove_consumer(self, tag: str) -> None:
+        self.consumers = [c for c in self.consumers if c.tag != tag]
+        if self.auto_delete and not self.consumers:
+            self.broker.delete_queue(self.name)
+
+
+class MemoryQueueHandle:
+    """Очередь, объявленная на канале: API aio_pika.Queue, доставка с prefetch и delivery_tag этого канала."""
+
+    def __init__(self, queue: MemoryQueue, channel: "MemoryChannel") -> None:
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def declare(self, timeout: Optional[float] = None) -> _DeclareOk:
+        return _DeclareOk(len(self.queue.messages), len(self.queue.consumers))
+
+    async def bind(self, exchange, routing_key: Optional[str] = None, **kwargs) -> None:
+        name = exchange if isinstance(exchange, str) else exchange.name
+        self.queue.broker.exchanges[name].bindings.add(self.name)
+
+    async def consume(self, callback: Callable, no_ack: bool = False, exclusive: bool = False,
+                      consumer_tag: Optional[str] = None, **kwargs) -> str:
+        tag = consumer_tag or f"ctag.{uuid.uuid4().hex}"
+        self.queue.consumers.append(_Consumer(tag, self.channel, callback, no_ack))
+        self.channel.consumers[tag] = self.queue
+        self.queue.dispatch()
+        return tag
+
+    async def cancel(self, consumer_tag: str, timeout: Optional[float] = None, nowait: bool = False) -> None:
+        self.channel.consumers.pop(consumer_tag, None)
+        self.queue.remove_consumer(consumer_tag)
+
+    async def get(self, no_ack: bool = False, fail: bool = True, timeout: Optional[float] = None):
+        if not self.queue.messages:
+            if fail:
+                raise QueueEmpty()
+            return None
+        message, redelivered, routing_key = self.queue.messages.popleft()
+        return self.channel.deliver(self.queue, message, redelivered, routing_key, no_ack)
+
+    async def purge(self, no_wait: bool = False, timeout: Optional[float] = None) -> None:
+        self.queue.messages.clear()
+
+
+class MemoryExchange:
+    def __init__(self, broker: "MemoryBroker", name: str, type_: str) -> None:
+        self.broker = broker
+        self.name = name
+        self.type = type_
+        self.bindings: Set[str] = set()
+
+    async def publish(self, message: aio_pika.Message, routing_key: str = "", **kwargs) -> None:
+        self.broker.route(self.name, routing_key, message)
+
+
+class MemoryChannel:
+    def __init__(self, connection: "MemoryConnection") -> None:
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.unacked: Dict[int, List] = {}  # delivery_tag -> [queue, message, routing_key]
+        self.consumers: Dict[str, MemoryQueue] = {}
+        self._tags = itertools.count(1)
+        self.is_closed = False
+
+    @property
+    def default_exchange(self) -> MemoryExchange:
+        return self.broker.exchanges[""]
+
+    async def set_qos(self, prefetch_count: int = 0, prefetch_size: int = 0, global_: bool = False, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: Optional[str] = None, *, durable: bool = False, exclusive: bool = False,
+                            passive: bool = False, auto_delete: bool = False,
+                            arguments: Optional[Dict] = None, timeout: Optional[float] = None) -> MemoryQueue:
+        name = name or f"amq.gen-{uuid.uuid4().hex}"
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            owner = self.connection if exclusive else None
+            queue = self.broker.queues[name] = MemoryQueue(self.broker, name, owner, auto_delete, arguments)
+        return MemoryQueueHandle(queue, self)
+
+    async def declare_exchange(self, name: str, type=aio_pika.ExchangeType.DIRECT, *, durable: bool = False,
+                               auto_delete: bool = False, **kwargs) -> MemoryExchange:
+        exchange = self.broker.exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker.exchanges[name] = MemoryExchange(self.broker, name, getattr(type, "value", type))
+        return exchange
+
+    def deliver(self, queue: MemoryQueue, message: aio_pika.Message, redelivered: bool, routing_key: str,
+                 no_ack: bool) -> MemoryMessage:
+        tag = next(self._tags)
+        if not no_ack:
+            self.unacked[tag] = [queue, message, routing_key]
+        return MemoryMessage(message, self, tag, redelivered, no_ack, routing_key)
+
+    def _settled(self, tag: int, multiple: bool) -> List[List]:
+        tags = [t for t in self.unacked if t <= tag] if multiple else [tag]
+        return [self.unacked.pop(t) for t in tags if t in self.unacked]
+
+    def _ack(self, tag: int, multiple: bool) -> None:
+        for queue, _, _ in self._settled(tag, multiple):
+            queue.dispatch()
+
+    def _reject(self, tag: int, multiple: bool, requeue: bool) -> None:
+        for queue, message, routing_key in reversed(self._settled(tag, multiple)):
+            if requeue:
+                queue.put(message, routing_key, redelivered=True, front=True)
+            else:
+                queue.dead_letter(message, routing_key)
+                queue.dispatch()
+
+    async def close(self, exc: Any = None) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for tag, queue in list(self.consumers.items()):
+            queue.remove_consumer(tag)
+        self.consumers.clear()
+        # Неподтверждённые возвращаются в голову своих очередей в исходном порядке
+        for tag in sorted(self.unacked, reverse=True):
+            queue, message, routing_key = self.unacked.pop(tag)
+            queue.put(message, routing_key, redelivered=True, front=True)
+        self.connection.channels.discard(self)
+
+
+class MemoryConnection:
+    def __init__(self, broker: "MemoryBroker") -> None:
+        self.broker = broker
+        self.channels: Set[MemoryChannel] = set()
+        self.is_closed = False
+
+    async def channel(self, *args, **kwargs) -> MemoryChannel:
+        channel = MemoryChannel(self)
+        self.channels.add(channel)
+        return channel
+
+    async def close(self, exc: Any = None) -> None:
+        self.is_closed = True
+        for channel in list(self.channels):
+            await channel.close()
+        for name, queue in list(self.broker.queues.items()):
+            if queue.owner is self:
+                self.broker.delete_queue(name)
+
+    async def __aenter__(self) -> "MemoryConnection":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+class MemoryBroker:
+    def __init__(self) -> None:
+        self.queues: Dict[str, MemoryQueue] = {}
+        self.exchanges: Dict[str, MemoryExchange] = {}
+        self.exchanges[""] = MemoryExchange(self, "", "direct")
+        self.counters = {"published": 0, "unroutable": 0}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def route(self, exchange_name: str, routing_key: str, message: aio_pika.Message) -> None:
+        self.counters["published"] += 1
+        if exchange_name == "":
+            targets = [routing_key]
+        else:
+            exchange = self.exchanges.get(exchange_name)
+            targets = list(exchange.bindings) if exchange is not None else []
+        delivered = False
+        for name in targets:
+            queue = self.queues.get(name)
+            if queue is not None:
+                queue.put(message, routing_key)
+                delivered = True
+        if not delivered:
+            self.counters["unroutable"] += 1
+
+    def delete_queue(self, name: str) -> None:
+        self.queues.pop(name, None)
+        for exchange in self.exchanges.values():
+            exchange.bindings.discard(name)
+
+    def spawn(self, coro) -> None:
+        # Как aio_pika: каждый обработчик — отдельная задача
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "queues": {name: len(queue.messages) for name, queue in self.queues.items() if queue.messages},
+        }
+
+
+def install(broker: Optional[MemoryBroker] = None) -> MemoryBroker:
+    """Подменяет подключение aio_pika на брокер в памяти; вызывать до старта сервисов."""
+    broker = broker or MemoryBroker()
+
+    async def connect(*args, **kwargs) -> MemoryConnection:
+        return MemoryConnection(broker)
+
+    aio_pika.connect_robust = connect
+    aio_pika.connect = connect
+    return broker
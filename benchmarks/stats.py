@@ -0,0 +1,30 @@
+# benchmarks/stats.py
+
+from typing import Dict, List, Sequence
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """Перцентиль по отсортированной выборке (ближайший ранг)."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(0, min(len(sorted_samples) - 1, int(round(q / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[rank]
+
+
+def summarize(samples_ms: List[float], elapsed_s: float, errors: int = 0) -> Dict[str, float]:
+    """Сводка по задержкам в миллисекундах и пропускной способности."""
+    ordered = sorted(samples_ms)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed_s, 1) if elapsed_s else 0.0,
+        "p50_ms": round(percentile(ordered, 50), 3),
+        "p95_ms": round(percentile(ordered, 95), 3),
+        "p99_ms": round(percentile(ordered, 99), 3),
+        "max_ms": round(ordered[-1], 3) if ordered else 0.0,
+    }
+
+
+def format_summary(title: str, summary: Dict[str, float]) -> str:
+    fields = " ".join(f"{key}={value}" for key, value in summary.items())
+    return f"{title}: {fields}"
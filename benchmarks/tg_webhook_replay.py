@@ -0,0 +1,117 @@
+# benchmarks/tg_webhook_replay.py
+"""
+Воспроизведение апдейтов Telegram на webhook telegram_bot с заданной скоростью.
+
+Апдейты берутся из файла (JSONL по одному апдейту в строке или сохранённый
+ответ getUpdates: {"ok": true, "result": [...]}) либо генерируются: текстовые
+сообщения от --users пользователей. update_id переписываются на каждом круге,
+чтобы бот не отбросил их как повторы. Ответ webhook приходит после постановки
+апдейта в очередь пользователя (с TELEGRAM_PARTITIONS — в очередь раздела
+в брокере), так что задержка — это задержка приёма.
+
+Примеры:
+    # бот запущен локально с TELEGRAM_MODE=webhook TELEGRAM_WEBHOOK_SECRET=s
+    python benchmarks/tg_webhook_replay.py --url http://127.0.0.1:8000/tg_webhook --secret s -n 20000 --rate 2000
+
+    # записанные апдейты: curl "https://api.telegram.org/bot$TOKEN/getUpdates" > updates.json
+    python benchmarks/tg_webhook_replay.py --file updates.json --secret s --loops 50 --rate 0 -c 100
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from stats import format_summary, summarize  # noqa: E402
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("{") and '"result"' in content.split("\n", 1)[0]:
+        return json.loads(content)["result"]
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def synthetic_update(i: int, users: int) -> Dict:
+    user_id = 900000000 + i % users
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": f"bench message {i}",
+        },
+    }
+
+
+def replay(updates: List[Dict], loops: int) -> Iterator[Dict]:
+    """Повторяет записанные апдейты loops раз с новыми update_id."""
+    base = max(u["update_id"] for u in updates) + 1
+    for loop in range(loops):
+        for update in updates:
+            yield dict(update, update_id=update["update_id"] + loop * base)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/tg_webhook")
+    parser.add_argument("--secret", default=os.getenv("TELEGRAM_WEBHOOK_SECRET", ""))
+    parser.add_argument("--file", help="записанные апдейты (JSONL или ответ getUpdates)")
+    parser.add_argument("--loops", type=int, default=1, help="сколько раз проиграть файл")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="число сгенерированных апдейтов")
+    parser.add_argument("--users", type=int, default=500, help="число пользователей в сгенерированных апдейтах")
+    parser.add_argument("--rate", type=float, default=1000.0, help="апдейтов в секунду, 0 — без ограничения")
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.file:
+        updates = replay(load_updates(args.file), args.loops)
+    else:
+        updates = (synthetic_update(i, args.users) for i in range(1, args.requests + 1))
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    latencies = []
+    errors = 0
+    sent = itertools.count()
+    started = time.perf_counter()
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        for update in updates:
+            if args.rate > 0:
+                # Общий темп для всех воркеров: i-й апдейт не раньше started + i / rate
+                delay = started + next(sent) / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            request_started = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - request_started) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    print(format_summary(f"webhook replay rate={args.rate or 'max'} c={args.concurrency}", summarize(latencies, elapsed, errors)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
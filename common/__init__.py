@@ -0,0 +1,2 @@
+# common/__init__.py
+# Код, общий для сервисов: в образ каждого сервиса копируется как пакет common
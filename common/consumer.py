@@ -0,0 +1,303 @@
+# common/consumer.py
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+import aio_pika
+
+from common import log, tracing
+from common.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Обработчик запроса: (type, payload) -> ответ или None, если отвечать не нужно
+RequestHandler = Callable[[str, Dict], Awaitable[Optional[Dict]]]
+# Ключи порядка запроса: (type, payload) -> tg_id, которые он читает или меняет
+OrderingKeys = Callable[[str, Dict], List]
+
+
+def payload_tg_id(request_type: str, payload: Dict) -> List:
+    return [payload["tg_id"]] if payload.get("tg_id") is not None else []
+
+
+class KeyedSerializer:
+    """
+    Выполняет задачи с одинаковым ключом строго в порядке поступления.
+    Очередь на ключ фиксируется синхронно при вызове enter(), до первого await.
+    """
+
+    def __init__(self) -> None:
+        self._tails: Dict[str, asyncio.Future] = {}
+
+    def enter(self, key: str):
+        loop = asyncio.get_running_loop()
+        previous = self._tails.get(key)
+        done = loop.create_future()
+        self._tails[key] = done
+        return previous, done
+
+    def leave(self, key: str, done: asyncio.Future) -> None:
+        done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    def enter_many(self, keys) -> tuple:
+        """
+        Встаёт в очереди всех ключей сразу (пакетный запрос): ждать нужно всех
+        предшественников. Все очереди занимаются синхронно, в порядке поступления,
+        поэтому взаимной блокировки пакетов с пересекающимися ключами нет.
+        """
+        entries = [(key, *self.enter(key)) for key in dict.fromkeys(keys)]
+        return [previous for _, previous, _ in entries if previous is not None], [(key, done) for key, _, done in entries]
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._tails)
+
+
+class AckBatcher:
+    """
+    Пакетное подтверждение сообщений одного канала.
+    Подтверждается только непрерывный префикс обработанных доставок
+    (basic.ack с multiple=True), поэтому порядок завершения не важен.
+    """
+
+    def __init__(self, batch_size: int = 32, interval: float = 0.02) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+        self._received: Deque[aio_pika.abc.AbstractIncomingMessage] = deque()
+        self._done: set = set()
+        self._last_ready: Optional[aio_pika.abc.AbstractIncomingMessage] = None
+        self._ready_count = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_ack: Optional[asyncio.Task] = None
+
+    def track(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        if self._received and message.delivery_tag <= self._received[-1].delivery_tag:
+            # Канал переподключился и нумерация тегов началась заново
+            self._reset()
+        self._received.append(message)
+
+    def complete(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        self._done.add(message.delivery_tag)
+        while self._received and self._received[0].delivery_tag in self._done:
+            head = self._received.popleft()
+            self._done.discard(head.delivery_tag)
+            self._last_ready = head
+            self._ready_count += 1
+        if self._ready_count >= self.batch_size:
+            self._ack_ready()
+        elif self._ready_count and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.interval)
+            self._ack_ready()
+        finally:
+            self._flush_task = None
+
+    def _ack_ready(self) -> None:
+        if self._last_ready is None:
+            return
+        message, self._last_ready, self._ready_count = self._last_ready, None, 0
+        # Подтверждения уходят строго по возрастанию тегов: повторный ack
+        # уже покрытого тега брокер считает ошибкой и закрывает канал
+        self._last_ack = asyncio.create_task(self._ack(message, self._last_ack))
+
+    async def _ack(self, message: aio_pika.abc.AbstractIncomingMessage, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await message.ack(multiple=True)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного подтверждения до delivery_tag={message.delivery_tag}: {e}")
+
+    @property
+    def pending(self) -> int:
+        """Принятые, но ещё не подтверждённые сообщения."""
+        return len(self._received) + self._ready_count
+
+    async def flush(self) -> None:
+        """Подтверждает всё готовое сейчас и дожидается отправки подтверждений."""
+        self._ack_ready()
+        if self._last_ack is not None:
+            await asyncio.wait([self._last_ack])
+
+    def _reset(self) -> None:
+        self._received.clear()
+        self._done.clear()
+        self._last_ready = None
+        self._ready_count = 0
+
+
+class RequestConsumer:
+    """
+    Потребитель очереди запросов: prefetch, ограниченная параллельность,
+    порядок по tg_id, один канал для публикации ответов и пакетные ack.
+    ordering_keys даёт tg_id запроса; пакетный запрос ждёт все запросы
+    к своим tg_id, начатые раньше, и задерживает более поздние.
+    stop() ждёт начатые запросы не дольше drain_timeout, затем прерывает их
+    без ack — брокер вернёт их в очередь. span_name и hop — имена span
+    трассы и шага в метриках (bd_connector: bd_connector.request, bd_request).
+    """
+
+    def __init__(
+        self,
+        connection: aio_pika.abc.AbstractRobustConnection,
+        queue_name: str,
+        handler: RequestHandler,
+        prefetch: int = 256,
+        concurrency: int = 64,
+        ack_batch: int = 32,
+        ack_interval: float = 0.02,
+        ordering_keys: OrderingKeys = payload_tg_id,
+        drain_timeout: float = 30.0,
+        span_name: str = "request",
+        hop: str = "request",
+    ) -> None:
+        self.connection = connection
+        self.queue_name = queue_name
+        self.handler = handler
+        self.ordering_keys = ordering_keys
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.drain_timeout = drain_timeout
+        self.span_name = span_name
+        self.hop = hop
+        self._acks = AckBatcher(ack_batch, ack_interval)
+        self._ordering = KeyedSerializer()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._publish_channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self._consumer_tag: Optional[str] = None
+        self._stopping = False
+        self._in_flight = 0
+        self._tasks: Set[asyncio.Task] = set()  # задачи доставок, ещё не завершённых
+
+    async def start(self) -> None:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        channel = await self.connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch)
+        # Отдельный канал под ответы, чтобы публикация не конкурировала с доставкой
+        self._publish_channel = await self.connection.channel()
+        queue = await channel.declare_queue(self.queue_name, durable=True)
+        self._consumer_tag = await queue.consume(self._on_message, no_ack=False)
+        self._channel = channel
+        self._queue = queue
+        logger.info(
+            f"Потребитель {self.queue_name} запущен: prefetch={self.prefetch}, "
+            f"concurrency={self.concurrency}"
+        )
+
+    async def stop(self) -> None:
+        """
+        Прекращает приём: начатые запросы дорабатываются и подтверждаются,
+        а доставленные после остановки возвращаются брокером в очередь
+        при закрытии канала. Запросы, не завершившиеся за drain_timeout,
+        отменяются и тоже возвращаются в очередь без ack.
+        """
+        self._stopping = True
+        if self._queue is not None:
+            await self._queue.cancel(self._consumer_tag)
+        try:
+            await asyncio.wait_for(self._drain(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Потребитель {self.queue_name}: {len(self._tasks)} запросов не завершились "
+                f"за {self.drain_timeout:g}с, отменяем; брокер вернёт их в очередь"
+            )
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for channel in (self._channel, self._publish_channel):
+            if channel is not None:
+                await channel.close()
+        logger.info(f"Потребитель {self.queue_name} остановлен")
+
+    async def _drain(self) -> None:
+        while self._acks.pending:
+            await self._acks.flush()
+            await asyncio.sleep(0.01)
+        await self._acks.flush()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "unacked": self._acks.pending,
+            "ordered_keys": self._ordering.active_keys,
+        }
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        if self._stopping:
+            return  # без ack: после закрытия канала сообщение получит новый владелец
+        self._acks.track(message)
+        # aio_pika вызывает обработчик в отдельной задаче на каждую доставку
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await self._handle(message)
+        finally:
+            self._tasks.discard(task)
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        try:
+            data = json.loads(message.body)
+        except ValueError as e:
+            logger.error(f"Некорректное тело сообщения: {e}")
+            self._acks.complete(message)
+            return
+
+        # Span с момента доставки: ожидание очереди по tg_id и семафора входит в него
+        span = tracing.start_span(
+            self.span_name, tracing.extract(message.headers), "consumer", type=str(data.get("type"))
+        )
+        try:
+            keys = [str(key) for key in self.ordering_keys(data.get("type"), data.get("payload") or {}) if key is not None]
+        except Exception:
+            keys = []  # некорректный payload: обработчик ответит ошибкой
+        previous, entries = self._ordering.enter_many(keys)
+        cancelled = False
+        try:
+            for waiting in previous:
+                await waiting
+            async with self._semaphore:
+                self._in_flight += 1
+                try:
+                    await span.run(self._process(message, data))
+                finally:
+                    self._in_flight -= 1
+        except asyncio.CancelledError:
+            cancelled = True  # остановка по drain_timeout: без ack
+            raise
+        finally:
+            for key, done in entries:
+                self._ordering.leave(key, done)
+            if not cancelled:
+                self._acks.complete(message)
+
+    async def _process(self, message: aio_pika.abc.AbstractIncomingMessage, data: Dict) -> None:
+        try:
+            with timed(self.hop, str(data.get("type"))):
+                response = await self.handler(data.get("type"), data.get("payload", {}))
+            if response is None:
+                return
+            reply_to = data.get("reply_to") or message.reply_to
+            await self._publish_channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps(response).encode(),
+                    correlation_id=data.get("correlation_id") or message.correlation_id,
+                ),
+                routing_key=reply_to
+            )
+            log.event(logger, "bd.reply", f"Отправлен ответ на {reply_to}", response=response)
+        except Exception as e:
+            logger.error(f"Ошибка обработки сообщения: {e}")
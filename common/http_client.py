@@ -0,0 +1,229 @@
+# common/http_client.py
+"""
+HTTP-клиент для вызовов между сервисами (amo_get → telegram_bot,
+telegram_bot → amo_send).
+
+upstream(name, base_url, ...) — один на адресата на всё время жизни процесса:
+своя ClientSession с пулом keep-alive соединений и кэшем DNS, явные таймауты
+(подключение, чтение, весь запрос), ограничение одновременных запросов
+и очереди к ним и автомат отключения (circuit breaker):
+- closed — запросы идут; failure_threshold ошибок подряд (сеть, таймаут,
+  ответ 5xx) переводят в open;
+- open — запросы сразу получают CircuitOpen, не занимая соединений и корутин,
+  пока не пройдёт reset_timeout;
+- half_open — пропускается один пробный запрос: успех закрывает автомат,
+  ошибка снова открывает. Пока автомат не closed, исход запросов, начатых
+  до его открытия, ничего не меняет — решает только пробный.
+Ошибкой адресата считаются сбои HTTP-клиента и ответы 5xx, но не исключения
+кода вызывающего внутри async with. count_timeouts=False — таймаут ответа
+не ошибка адресата: для вызовов, которые по задумке могут долго ждать
+(доставка в Telegram в темпе чата).
+Состояние пула и автомата — stats() и gauge upstream_{name}_* на /metrics.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from common.metrics import STATS
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """Запрос не отправлен: адресат считается недоступным или перегружен."""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+
+class UpstreamBusy(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # подряд
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probe = False
+
+    def before_request(self) -> bool:
+        """Пропускает запрос или бросает CircuitOpen; True — это пробный запрос half_open."""
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probe:
+            self._probe = True
+            return True
+        self.rejected += 1
+        raise CircuitOpen(f"{self.name}: circuit {self.state}")
+
+    def record(self, ok: Optional[bool], probe: bool = False) -> None:
+        """Исход запроса; None — запрос отменён до ответа и ничего не говорит об адресате."""
+        if probe:
+            self._probe = False
+        elif self.state != CLOSED:
+            return  # запрос начат до открытия автомата: решает пробный
+        if ok is None:
+            return
+        if ok:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != OPEN:
+                self.opens += 1
+                self._set(OPEN)
+
+    def _set(self, state: str) -> None:
+        log = logging.warning if state == OPEN else logging.info
+        log(f"{self.name}: автомат отключения {self.state} -> {state} (ошибок подряд: {self.failures})")
+        self.state = state
+
+
+class Upstream:
+    """Пул соединений, лимиты и автомат отключения одного адресата."""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float = 30.0,
+        connect_timeout: float = 3.0,
+        read_timeout: Optional[float] = None,
+        pool_size: int = 100,
+        max_concurrency: int = 100,
+        max_pending: int = 1000,
+        keepalive_timeout: float = 30.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+        count_timeouts: bool = True,
+    ) -> None:
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.keepalive_timeout = keepalive_timeout
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.count_timeouts = count_timeouts
+        self.counters = {"requests": 0, "failures": 0, "busy_rejected": 0, "timeouts": 0}
+        self._pending = 0  # в очереди на слот и в работе
+        self._in_flight = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _start(self) -> None:
+        # Сессия создаётся в работающем цикле при первом запросе и живёт до close()
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size, keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @asynccontextmanager
+    async def request(self, method: str, path: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        async with upstream.request("POST", "/send", json=...) as response: ...
+        Сбои клиента (сеть, таймауты, в том числе при чтении тела внутри блока)
+        и ответы 5xx считаются ошибками адресата; прочие исключения блока —
+        нет. Без отправки бросаются UpstreamBusy (очередь к адресату
+        заполнена) и CircuitOpen.
+        """
+        if self._pending >= self.max_pending:
+            self.counters["busy_rejected"] += 1
+            raise UpstreamBusy(f"{self.name}: {self._pending} requests pending")
+        probe = self.breaker.before_request()
+        if self._session is None:
+            self._start()
+        self._pending += 1
+        ok: Optional[bool] = None
+        response: Optional[aiohttp.ClientResponse] = None
+        try:
+            async with self._semaphore:
+                self._in_flight += 1
+                self.counters["requests"] += 1
+                try:
+                    async with self._session.request(method, self.base_url + path, **kwargs) as response:
+                        yield response
+                    ok = response.status < 500
+                except asyncio.TimeoutError:
+                    self.counters["timeouts"] += 1
+                    ok = False if self.count_timeouts else None
+                    raise
+                except aiohttp.ClientError:
+                    ok = False
+                    raise
+                except Exception:
+                    # Ошибка кода вызывающего: об адресате говорит только статус ответа
+                    ok = response.status < 500 if response is not None else None
+                    raise
+                finally:
+                    self._in_flight -= 1
+        finally:
+            self._pending -= 1
+            if ok is False:
+                self.counters["failures"] += 1
+            self.breaker.record(ok, probe)
+
+    def stats(self) -> Dict:
+        connector = self._session.connector if self._session is not None else None
+        return {
+            "breaker_state": _STATE_CODES[self.breaker.state],  # 0 closed, 1 half_open, 2 open
+            "breaker_failures": self.breaker.failures,
+            "breaker_opens": self.breaker.opens,
+            "breaker_rejected": self.breaker.rejected,
+            "in_flight": self._in_flight,
+            "pending": self._pending,
+            "connections_in_use": len(getattr(connector, "_acquired", ())),
+            "connections_idle": sum(len(c) for c in getattr(connector, "_conns", {}).values()),
+            **self.counters,
+        }
+
+    def state(self) -> Dict:
+        """stats() с именем состояния автомата — для JSON-эндпоинтов."""
+        return {"base_url": self.base_url, "breaker": self.breaker.state, **self.stats()}
+
+
+_upstreams: Dict[str, Upstream] = {}
+
+
+def upstream(name: str, base_url: str, **options) -> Upstream:
+    """Клиент адресата name; повторный вызов с тем же именем возвращает уже созданный."""
+    client = _upstreams.get(name)
+    if client is None:
+        client = _upstreams[name] = Upstream(name, base_url, **options)
+        STATS.register("upstream_" + re.sub(r"\W", "_", name), client.stats)
+    return client
+
+
+def states() -> Dict[str, Dict]:
+    return {name: client.state() for name, client in _upstreams.items()}
+
+
+async def close_all() -> None:
+    for client in _upstreams.values():
+        await client.close()
@@ -0,0 +1,289 @@
+# common/log.py
+"""
+Логи сервисов: запись без блокировки event loop, структурированные события,
+выборка и маскирование секретов и персональных данных.
+
+setup(service, fmt) вызывается вместо logging.basicConfig. Корневой логгер
+получает обработчик-очередь: в потоке вызова запись проходит выборку,
+маскируется и кладётся в ограниченную очередь (при переполнении запись
+отбрасывается и считается — цикл не ждёт stdout). Форматирование и вывод
+в stderr — в отдельном потоке (QueueListener). Логгеры uvicorn переводятся
+на тот же обработчик.
+
+event(logger, name, message, level, **fields) — структурированное событие.
+Если уровень выключен или событие не попало в выборку, стоимость вызова —
+одна проверка: поля не сериализуются и не копируются. Иначе поля копируются
+с ограничением глубины, числа элементов и длины строк — стоимость записи
+не зависит от размера payload — и маскируются по именам ключей; в JSON
+или key=value они превращаются уже в потоке вывода. Текст сообщений
+маскируется по шаблонам (токены, подписи, email, телефоны).
+
+Настройка из окружения:
+- LOG_LEVEL — уровень корневого логгера (INFO);
+- LOG_FORMAT=json — одна JSON-строка на запись (ts, level, service, logger,
+  trace_id, event, msg, where, поля), иначе прежний текстовый формат сервиса;
+- LOG_SAMPLE="amo_get.webhook=0.01,uvicorn.access=0.1" — доля записей по имени
+  события или логгера; WARNING и выше и записи выбранных трасс пишутся всегда;
+- LOG_QUEUE_SIZE — ёмкость очереди (10000);
+- LOG_REDACT_KEYS — дополнительные ключи полей для маскирования через запятую.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from common import tracing
+
+DEFAULT_FORMAT = "%(asctime)s | %(levelname)s | %(trace_id)s | %(message)s"
+
+# Ограничения копии полей и текста сообщения: стоимость записи ограничена
+MAX_MESSAGE = 2000
+MAX_STRING = 256
+MAX_ITEMS = 32
+MAX_DEPTH = 4
+
+# Ключи полей (без учёта регистра, '-' равен '_'), значения которых не пишутся
+REDACT_KEYS = {
+    "secret", "channel_secret", "token", "bot_token", "password", "authorization", "cookie",
+    "signature", "x_signature", "api_key", "email", "phone", "name", "username", "first_name", "last_name",
+}
+# Содержимое переписки: пишется только длина
+LENGTH_ONLY_KEYS = {"text", "caption", "welcome_text"}
+
+_PATTERNS = (
+    (re.compile(r"\d{5,}:[A-Za-z0-9_-]{30,}"), "***"),  # токен бота Telegram (в т.ч. в URL файлов)
+    (re.compile(r"(?i)\b(bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1***"),
+    (re.compile(r"(?i)\b(secret|token|password|signature|api_key)(['\"]?\s*[:=]\s*['\"]?)[^\s'\",}]+"), r"\1\2***"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "***@***"),
+    (re.compile(r"\+\d[\d ()-]{8,}\d"), "+***"),
+)
+# Без этих символов ни один шаблон не совпадёт: короткие id и числа проходят одной проверкой
+_TRIGGER = re.compile(r"[:=@+]|bearer", re.IGNORECASE)
+
+
+def redact_text(text: str) -> str:
+    """Обрезает текст до MAX_MESSAGE и маскирует секреты и контакты по шаблонам."""
+    if len(text) > MAX_MESSAGE:
+        text = f"{text[:MAX_MESSAGE]}…(+{len(text) - MAX_MESSAGE})"
+    if not _TRIGGER.search(text):
+        return text
+    for pattern, replacement in _PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _mask(key: str, value: Any) -> Any:
+    if value is None or value == "":
+        return value
+    if key in LENGTH_ONLY_KEYS and isinstance(value, str):
+        return f"<{len(value)} симв.>"
+    return "***"
+
+
+def scrub(value: Any, depth: int = 0) -> Any:
+    """Ограниченная копия значения для лога: секреты и персональные данные замаскированы."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        if len(value) > MAX_STRING:
+            value = f"{value[:MAX_STRING]}…(+{len(value) - MAX_STRING})"
+        return redact_text(value)
+    if depth >= MAX_DEPTH:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        result = {}
+        for i, (key, item) in enumerate(value.items()):
+            if i == MAX_ITEMS:
+                result["…"] = f"+{len(value) - MAX_ITEMS}"
+                break
+            key = str(key)
+            normalized = key.lower().replace("-", "_")
+            if normalized in REDACT_KEYS or normalized in LENGTH_ONLY_KEYS:
+                result[key] = _mask(normalized, item)
+            else:
+                result[key] = scrub(item, depth + 1)
+        return result
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [scrub(item, depth + 1) for _, item in zip(range(MAX_ITEMS), value)]
+        if len(value) > MAX_ITEMS:
+            items.append(f"…(+{len(value) - MAX_ITEMS})")
+        return items
+    if isinstance(value, bytes):
+        return f"<{len(value)} байт>"
+    if hasattr(value, "model_dump"):  # модели pydantic: дамп только для записи, попавшей в лог
+        return scrub(value.model_dump(), depth)
+    return scrub(str(value), depth)
+
+
+# --- Выборка ---
+_sample_rates: Dict[str, float] = {}
+_counters = {"records": 0, "dropped": 0, "sampled_out": 0, "emit_seconds": 0.0}
+
+
+def _keep(key: str, levelno: int) -> bool:
+    rate = _sample_rates.get(key)
+    if rate is None or rate >= 1.0 or levelno >= logging.WARNING:
+        return True
+    context = tracing.current()
+    if (context is not None and context.sampled) or random.random() < rate:
+        return True
+    _counters["sampled_out"] += 1
+    return False
+
+
+def event(logger: logging.Logger, name: str, message: Optional[str] = None, level: int = logging.INFO,
+          /, **fields) -> None:
+    """
+    Структурированное событие: log.event(logger, "amo_send.request", "Запрос в amoCRM", body=request_body).
+    Имя события — ключ выборки в LOG_SAMPLE и поле event в JSON.
+    """
+    if not logger.isEnabledFor(level) or not _keep(name, level):
+        return
+    logger.log(level, message or name, extra={"event": name, "fields": fields}, stacklevel=2)
+
+
+# --- Обработчик в потоке вызова ---
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Выборка, маскирование и постановка в очередь; ничего не пишет и не ждёт."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self._traceback = logging.Formatter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # События уже прошли выборку в event(); прочие записи — по имени логгера
+        if not hasattr(record, "fields") and not _keep(record.name, record.levelno):
+            return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы и поля могут измениться после вызова: текст и копия полей — здесь
+        record.msg = redact_text(record.getMessage())
+        record.args = None
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = scrub(fields)
+        if record.exc_info:
+            record.exc_text = self._traceback.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _counters["dropped"] += 1
+
+    def emit(self, record: logging.LogRecord) -> None:
+        started = time.perf_counter()
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+        _counters["records"] += 1
+        _counters["emit_seconds"] += time.perf_counter() - started
+
+
+# --- Форматирование в потоке вывода ---
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат сервиса; поля события дописываются как key=value."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.msg = f"{record.msg} | " + " ".join(f"{key}={_dumps(value)}" for key, value in fields.items())
+            record.fields = None
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str) -> None:
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(getattr(record, "fields", None) or {})
+        entry.update({
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+            "where": f"{record.filename}:{record.lineno}",
+        })
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return _dumps(entry)
+
+
+_queue: Optional[queue.Queue] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        key, _, rate = item.partition("=")
+        if key.strip() and rate.strip():
+            rates[key.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+def setup(service: str, fmt: str = DEFAULT_FORMAT, sample: Optional[Dict[str, float]] = None) -> None:
+    """
+    Настраивает логи процесса; повторный вызов (второй модуль того же сервиса) ничего не делает.
+    sample — доли выборки по умолчанию, LOG_SAMPLE их переопределяет.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return
+    _sample_rates.update(sample or {})
+    _sample_rates.update(_parse_rates(os.getenv("LOG_SAMPLE", "")))
+    REDACT_KEYS.update(k.strip().lower().replace("-", "_") for k in os.getenv("LOG_REDACT_KEYS", "").split(",") if k.strip())
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter(service) if os.getenv("LOG_FORMAT", "text") == "json" else TextFormatter(fmt))
+    _queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    _listener = logging.handlers.QueueListener(_queue, output)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(_queue))
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # uvicorn, запущенный из командной строки, уже повесил свои синхронные обработчики
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.propagate = True
+
+    _listener.start()
+    atexit.register(_listener.stop)  # дописывает очередь при выходе
+
+
+def stats() -> Dict:
+    records = _counters["records"]
+    return {
+        "records": records,
+        "dropped": _counters["dropped"],
+        "sampled_out": _counters["sampled_out"],
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "emit_seconds": round(_counters["emit_seconds"], 6),
+        "emit_avg_us": round(_counters["emit_seconds"] / records * 1e6, 2) if records else 0.0,
+    }
@@ -0,0 +1,264 @@
+# common/metrics.py
+"""
+Метрики сервисов в формате Prometheus (prometheus_client), отдаются на /metrics.
+
+Имена одинаковые во всех сервисах, сервис различается меткой job при сборе:
+- http_* — входящие HTTP-запросы (FastAPI через MetricsMiddleware, aiohttp
+  через aiohttp_middleware), маршрут — шаблон пути, а не сам путь;
+- hop_* — исходящие шаги цепочки (amoCRM, Telegram API, RPC в bd_connector,
+  HTTP между сервисами) и обработка запросов в bd_connector: timed(hop, operation);
+- errors_total — исключения по типу;
+- event_loop_* — задержка и зависания event loop (common.profiling);
+- прочие gauge — числовые поля stats() компонентов (глубины очередей,
+  in-flight, счётчики), снимаются в момент опроса: STATS.register(...).
+
+Дочерние метрики по (hop, operation) ищутся по меткам один раз, дальше
+замер шага — несколько инкрементов под локом (около 6 мкс на CPython),
+поэтому метрики включены всегда. В выбранной трассе (common.tracing) шаг
+timed заодно пишется как span.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple, Union
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, disable_created_metrics, generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from common import log, profiling, tracing
+
+disable_created_metrics()  # без рядов *_created: вдвое меньше ответ /metrics
+
+# От миллисекунды (кэш, файловое хранилище) до таймаутов внешних API
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUESTS = Counter("http_requests_total", "Входящие HTTP-запросы", ["route", "method", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Время обработки входящего HTTP-запроса",
+                         ["route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Входящие HTTP-запросы в обработке")
+
+HOP_REQUESTS = Counter("hop_requests_total", "Шаги цепочки по исходу", ["hop", "operation", "outcome"])
+HOP_LATENCY = Histogram("hop_duration_seconds", "Время шага цепочки", ["hop", "operation"], buckets=LATENCY_BUCKETS)
+HOP_IN_FLIGHT = Gauge("hop_in_flight", "Шаги цепочки в работе", ["hop"])
+
+ERRORS = Counter("errors_total", "Исключения по месту и типу", ["component", "type"])
+
+
+class _HopMetrics:
+    """Дочерние метрики одного (hop, operation): поиск по меткам — один раз."""
+    __slots__ = ("hop", "operation", "in_flight", "latency", "outcomes")
+
+    def __init__(self, hop: str, operation: str) -> None:
+        self.hop = hop
+        self.operation = operation
+        self.in_flight = HOP_IN_FLIGHT.labels(hop)
+        self.latency = HOP_LATENCY.labels(hop, operation)
+        self.outcomes: Dict[str, Counter] = {}
+
+    def count(self, outcome: str) -> None:
+        counter = self.outcomes.get(outcome)
+        if counter is None:
+            counter = self.outcomes[outcome] = HOP_REQUESTS.labels(self.hop, self.operation, outcome)
+        counter.inc()
+
+
+_hops: Dict[Tuple[str, str], _HopMetrics] = {}
+
+
+class timed:
+    """
+    Замеряет шаг: with timed("amocrm", "send") as call: ...; call.outcome = "429".
+    Исключение записывается как outcome="error" и errors_total{component=hop}.
+    """
+    __slots__ = ("metrics", "outcome", "started", "span")
+
+    def __init__(self, hop: str, operation: str) -> None:
+        metrics = _hops.get((hop, operation))
+        if metrics is None:
+            metrics = _hops[(hop, operation)] = _HopMetrics(hop, operation)
+        self.metrics = metrics
+        self.outcome = "ok"
+
+    def __enter__(self) -> "timed":
+        self.metrics.in_flight.inc()
+        self.span = tracing.hop_span(self.metrics.hop, self.metrics.operation)
+        if self.span is not None:
+            self.span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        metrics = self.metrics
+        metrics.latency.observe(time.perf_counter() - self.started)
+        metrics.in_flight.dec()
+        if exc_type is not None:
+            self.outcome = "error"
+            ERRORS.labels(metrics.hop, exc_type.__name__).inc()
+        metrics.count(self.outcome)
+        if self.span is not None:
+            self.span.set("outcome", self.outcome)
+            self.span.__exit__(exc_type, exc, tb)
+
+
+def count_error(component: str, error: BaseException) -> None:
+    ERRORS.labels(component, type(error).__name__).inc()
+
+
+StatsSource = Callable[[], Union[Dict, Awaitable[Dict]]]
+
+
+class StatsCollector:
+    """
+    Числовые поля stats() компонентов как gauge {component}_{поле}.
+
+    Синхронные stats() вызываются при сборе; асинхронные (глубина очереди
+    в RabbitMQ) — в refresh() перед сбором, из обработчика /metrics.
+    Вложенные словари и нечисловые поля пропускаются.
+    """
+
+    def __init__(self) -> None:
+        self._sources: Dict[str, StatsSource] = {}
+        self._snapshots: Dict[str, Dict] = {}
+
+    def register(self, component: str, stats: StatsSource) -> None:
+        self._sources[component] = stats
+
+    async def refresh(self) -> None:
+        for component, stats in list(self._sources.items()):
+            if asyncio.iscoroutinefunction(stats):
+                try:
+                    self._snapshots[component] = await stats()
+                except Exception as e:
+                    count_error("metrics", e)
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        for component, stats in list(self._sources.items()):
+            if asyncio.iscoroutinefunction(stats):
+                values = self._snapshots.get(component) or {}
+            else:
+                try:
+                    values = stats()
+                except Exception as e:
+                    count_error("metrics", e)
+                    continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    yield GaugeMetricFamily(f"{component}_{key}", f"{component}.stats()['{key}']", value=value)
+
+
+STATS = StatsCollector()
+REGISTRY.register(STATS)
+STATS.register("tracing", tracing.stats)
+STATS.register("logging", log.stats)
+STATS.register("event_loop", profiling.MONITOR.stats)
+
+
+async def render() -> Tuple[bytes, str]:
+    """Тело и Content-Type ответа /metrics."""
+    await STATS.refresh()
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# --- FastAPI (ASGI) ---
+class MetricsMiddleware:
+    """ASGI-middleware: не оборачивает тело ответа, поэтому StreamingResponse не буферизуется."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.labels(route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(route, scope["method"], str(status[0])).inc()
+
+
+def instrument_fastapi(app) -> None:
+    """
+    Подключает MetricsMiddleware, трассировку входящих запросов, GET /metrics,
+    замер event loop (common.profiling) и GET /debug/profile.
+    """
+    from fastapi import Response
+
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(tracing.TracingMiddleware)
+    app.on_event("startup")(profiling.MONITOR.start)
+    app.on_event("shutdown")(profiling.MONITOR.close)
+    profiling.add_fastapi_route(app)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> Response:
+        body, content_type = await render()
+        return Response(body, media_type=content_type)
+
+
+# --- aiohttp ---
+def aiohttp_middleware():
+    from aiohttp import web
+
+    @web.middleware
+    async def middleware(request, handler):
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            HTTP_LATENCY.labels(route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(route, request.method, str(status)).inc()
+
+    return middleware
+
+
+async def aiohttp_metrics_handler(request):
+    from aiohttp import web
+
+    body, content_type = await render()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def start_metrics_server(port: int, routes: List = ()) -> "web.AppRunner":
+    """
+    HTTP-сервер только для /metrics, /debug/profile (и дополнительных маршрутов) —
+    для сервисов без своего HTTP; заодно запускает замер event loop.
+    """
+    from aiohttp import web
+
+    profiling.MONITOR.start()
+    app = web.Application()
+    app.router.add_get("/metrics", aiohttp_metrics_handler)
+    app.router.add_get("/debug/profile", profiling.aiohttp_profile_handler)
+    for route in routes:
+        app.router.add_route(*route)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
@@ -0,0 +1,260 @@
+# common/profiling.py
+"""
+Диагностика event loop: задержка планирования, зависания с кодом, который
+их вызвал, и профиль по запросу.
+
+MONITOR — один на процесс; запускается из metrics.instrument_fastapi,
+metrics.start_metrics_server или aiohttp_startup:
+- задача в цикле раз в LOOP_MONITOR_INTERVAL_MS (100) засыпает и меряет,
+  насколько позже срока проснулась, — event_loop_lag_seconds;
+- сторожевой поток: если цикл не отмечался дольше LOOP_STALL_MS (250), его
+  держит синхронный код; стек потока цикла и текущая задача пишутся в лог
+  (WARNING, один раз на зависание), event_loop_stalls_total растёт.
+Цена — десять пробуждений в секунду и сравнение времени в потоке-стороже.
+
+Профиль: GET /debug/profile?seconds=10&hz=100&threads=loop|all. Поток-сэмплер
+снимает стеки через sys._current_frames() и отдаёт collapsed stacks
+(«поток;f1;f2;f3 N» на строку) для flamegraph.pl, speedscope или inferno.
+Для продакшена: эндпоинт выключен, пока не задан ADMIN_TOKEN (заголовок
+X-Admin-Token); одновременно идёт один профиль; длительность не больше
+PROFILE_MAX_SECONDS (60), частота не больше 1000 Гц; цикл не останавливается.
+"""
+
+import asyncio
+import collections
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType
+from typing import Dict, Mapping, Optional, Set, Tuple
+
+from prometheus_client import Counter, Histogram
+
+# Задержка пробуждения: от планового джиттера до заметных пользователю зависаний
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Опоздание пробуждения задачи-замера в event loop",
+                     buckets=LAG_BUCKETS)
+LOOP_STALLS = Counter("event_loop_stalls_total", "Зависания event loop дольше LOOP_STALL_MS")
+
+TOKEN_HEADER = "X-Admin-Token"
+MAX_HZ = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Замер задержки event loop и сторож зависаний; параметры по умолчанию — из окружения при start()."""
+
+    def __init__(self, interval: Optional[float] = None, stall_threshold: Optional[float] = None,
+                 stack_depth: int = 15) -> None:
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stack_depth = stack_depth
+        self.last_lag = 0.0
+        self.longest_stall = 0.0
+        self.stalls = 0
+        self._beat = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Запускает замер в текущем цикле и сторожевой поток; повторный вызов ничего не делает."""
+        if self._task is not None:
+            return
+        if self.interval is None:
+            self.interval = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+        if self.stall_threshold is None:
+            self.stall_threshold = float(os.getenv("LOOP_STALL_MS", "250")) / 1000  # 0 — без сторожа
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._measure())
+        if self.stall_threshold > 0:
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def close(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure(self) -> None:
+        interval = self.interval
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - interval)
+            self._beat = now
+            self.last_lag = lag
+            LOOP_LAG.observe(lag)
+            if lag >= self.stall_threshold > 0 and lag > self.longest_stall:
+                self.longest_stall = lag
+
+    def _watch(self) -> None:
+        reported = 0.0  # отметка цикла, на которой зависание уже записано
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.stall_threshold or beat == reported:
+                continue
+            reported = beat
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            try:
+                self._report(stalled)
+            except Exception as e:
+                logger.error(f"Не удалось снять стек зависшего event loop: {e}")
+
+    def _report(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        task = asyncio.current_task(self._loop)  # из другого потока — только чтение ссылки
+        coro = task.get_coro() if task is not None else None
+        where = getattr(coro, "__qualname__", None) or "колбэк вне задачи"
+        stack = traceback.extract_stack(frame)[-self.stack_depth:]
+        lines = [f"  {os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in stack]
+        if stack and stack[-1].line:
+            lines[-1] += f": {stack[-1].line}"
+        logger.warning(
+            f"Event loop не отвечает {stalled * 1000:.0f} мс, задача: {where}; стек потока цикла:\n" + "\n".join(lines)
+        )
+
+    def stats(self) -> Dict:
+        # Число зависаний — в event_loop_stalls_total, здесь для /metrics не дублируется
+        return {
+            "running": self._task is not None,
+            "lag_ms": round(self.last_lag * 1000, 3),
+            "longest_stall_ms": round(self.longest_stall * 1000, 1),
+            "profiling": _profile_lock.locked(),
+        }
+
+
+MONITOR = LoopMonitor()
+
+
+async def aiohttp_startup(app) -> None:
+    """Для app.on_startup aiohttp-приложений."""
+    MONITOR.start()
+
+
+# --- Профиль по запросу ---
+_profile_lock = threading.Lock()
+_sampler: Optional[ThreadPoolExecutor] = None
+
+
+def sample_stacks(seconds: float, hz: int, thread_ids: Optional[Set[int]] = None) -> collections.Counter:
+    """Снимает стеки потоков (всех, кроме своего, или thread_ids) hz раз в секунду в течение seconds."""
+    stacks: collections.Counter = collections.Counter()
+    labels: Dict[CodeType, str] = {}
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    period = 1.0 / hz
+    deadline = time.monotonic() + seconds
+    next_at = time.monotonic()
+    while True:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (thread_ids is not None and ident not in thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        next_at += period
+        now = time.monotonic()
+        if now >= deadline:
+            return stacks
+        if next_at > now:
+            time.sleep(next_at - now)
+        else:
+            next_at = now  # не догоняем пропущенные сэмплы пачкой
+
+
+def _sample_and_unlock(seconds: float, hz: int, thread_ids: Optional[Set[int]]) -> collections.Counter:
+    # Лок отпускается, когда сэмплер закончил, даже если запрос уже отменён
+    try:
+        return sample_stacks(seconds, hz, thread_ids)
+    finally:
+        _profile_lock.release()
+
+
+def collapse(stacks: collections.Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def admin_denial(token: Optional[str]) -> Optional[Tuple[int, str]]:
+    """
+    Проверка заголовка X-Admin-Token служебных эндпоинтов: None — доступ есть,
+    иначе (HTTP-статус, тело): 404, пока ADMIN_TOKEN не задан, 403 при неверном токене.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token:
+        return 404, "disabled: ADMIN_TOKEN is not set\n"
+    if not hmac.compare_digest(admin_token.encode(), (token or "").encode()):
+        return 403, "forbidden\n"
+    return None
+
+
+async def profile_request(query: Mapping[str, str], token: Optional[str]) -> Tuple[int, str]:
+    """Обработчик /debug/profile для любого фреймворка: (HTTP-статус, тело text/plain)."""
+    global _sampler
+    denial = admin_denial(token)
+    if denial is not None:
+        return denial
+    try:
+        seconds = float(query.get("seconds", "10"))
+        hz = int(query.get("hz", "100"))
+    except ValueError:
+        return 400, "seconds and hz must be numbers\n"
+    threads = query.get("threads", "loop")
+    max_seconds = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    if not 0 < seconds <= max_seconds or not 0 < hz <= MAX_HZ or threads not in ("loop", "all"):
+        return 400, f"expected 0 < seconds <= {max_seconds:g}, 0 < hz <= {MAX_HZ}, threads=loop|all\n"
+    if not _profile_lock.acquire(blocking=False):
+        return 409, "another profile is running\n"
+    try:
+        if _sampler is None:
+            _sampler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiler")
+        thread_ids = None if threads == "all" else {threading.get_ident()}
+        future = asyncio.get_running_loop().run_in_executor(_sampler, _sample_and_unlock, seconds, hz, thread_ids)
+    except BaseException:
+        _profile_lock.release()
+        raise
+    logger.info(f"Профиль: {seconds:g} с, {hz} Гц, потоки: {threads}")
+    return 200, collapse(await future)
+
+
+async def aiohttp_profile_handler(request):
+    from aiohttp import web
+
+    status, body = await profile_request(request.query, request.headers.get(TOKEN_HEADER))
+    return web.Response(text=body, status=status, content_type="text/plain")
+
+
+def add_fastapi_route(app) -> None:
+    from fastapi import Request, Response
+
+    @app.get("/debug/profile", include_in_schema=False)
+    async def debug_profile(request: Request) -> Response:
+        status, body = await profile_request(request.query_params, request.headers.get(TOKEN_HEADER))
+        return Response(body, status_code=status, media_type="text/plain; charset=utf-8")
@@ -0,0 +1,179 @@
+# common/sharding.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import aio_pika
+
+logger = logging.getLogger(__name__)
+
+
+def partition_for(tg_id: Any, partitions: int) -> int:
+    """Раздел пользователя; по нему раскладываются данные на диске — формулу не менять."""
+    return zlib.crc32(str(tg_id).encode("utf-8")) % partitions
+
+
+def rendezvous_owner(partition: int, replicas: Iterable[str]) -> str:
+    """Владелец раздела — реплика с наибольшим весом; при смене состава переезжает ~1/N разделов."""
+    return max(
+        replicas,
+        key=lambda replica: hashlib.blake2b(f"{replica}:{partition}".encode("utf-8"), digest_size=8).digest(),
+    )
+
+
+class ShardManager:
+    """
+    Распределение разделов между репликами сервиса (bd_connector, telegram_bot).
+
+    Реплики раз в heartbeat_interval сообщают о себе в fanout-обменник
+    membership_exchange (свой у каждого сервиса); реплика, не подававшая признаков 3 интервала, считается
+    выбывшей. Каждая реплика по rendezvous-хэшу вычисляет свои разделы,
+    отпускает лишние и захватывает новые. Захват повторяется, пока прежний
+    владелец не отпустит раздел (start_partition бросает BlockingIOError).
+    Отпускание (stop_partition дорабатывает начатые запросы) идёт в своей
+    задаче и не задерживает heartbeat.
+    """
+
+    def __init__(
+        self,
+        connection: aio_pika.abc.AbstractRobustConnection,
+        partitions: int,
+        replica_id: str,
+        start_partition: Callable[[int], Awaitable[Any]],
+        stop_partition: Callable[[int, Any], Awaitable[None]],
+        heartbeat_interval: float = 2.0,
+        membership_exchange: str = "membership",
+    ) -> None:
+        self.connection = connection
+        self.partitions = partitions
+        self.replica_id = replica_id
+        self.start_partition = start_partition
+        self.stop_partition = stop_partition
+        self.heartbeat_interval = heartbeat_interval
+        self.membership_exchange = membership_exchange
+        self._peers: Dict[str, float] = {}
+        self._owned: Dict[int, Any] = {}
+        self._wanted: Set[int] = set()
+        self._acquiring: Dict[int, asyncio.Task] = {}
+        self._releasing: Dict[int, asyncio.Task] = {}
+        self._exchange: Optional[aio_pika.abc.AbstractExchange] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        channel = await self.connection.channel()
+        self._exchange = await channel.declare_exchange(self.membership_exchange, aio_pika.ExchangeType.FANOUT)
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(self._exchange)
+        await queue.consume(self._on_heartbeat, no_ack=True)
+        self._peers[self.replica_id] = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Реплика {self.replica_id}: разделов {self.partitions}, ждём остальные реплики")
+
+    async def _publish(self, leaving: bool = False) -> None:
+        await self._exchange.publish(
+            aio_pika.Message(body=json.dumps({"id": self.replica_id, "leaving": leaving}).encode()),
+            routing_key="",
+        )
+
+    async def _on_heartbeat(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        data = json.loads(message.body)
+        if data.get("leaving"):
+            self._peers.pop(data["id"], None)
+        else:
+            self._peers[data["id"]] = time.monotonic()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._publish()
+            except Exception as e:
+                logger.error(f"Ошибка отправки heartbeat: {e}")
+            # Первый пересчёт — после одного интервала, когда остальные реплики уже отозвались
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._rebalance()
+            except Exception as e:
+                logger.error(f"Ошибка перераспределения разделов: {e}")
+
+    async def _rebalance(self) -> None:
+        now = time.monotonic()
+        self._peers[self.replica_id] = now
+        expired = [peer for peer, seen in self._peers.items() if now - seen > 3 * self.heartbeat_interval]
+        for peer in expired:
+            del self._peers[peer]
+        replicas = sorted(self._peers)
+        wanted = {p for p in range(self.partitions) if rendezvous_owner(p, replicas) == self.replica_id}
+        if wanted != self._wanted:
+            logger.info(f"Реплик: {len(replicas)}, разделов у {self.replica_id}: {len(wanted)}")
+        self._wanted = wanted
+        # Сверка с фактическим состоянием, а не с прошлым расчётом: захват мог завершиться позже
+        for partition in sorted(set(self._owned) - wanted):
+            handle = self._owned.pop(partition)
+            self._releasing[partition] = asyncio.create_task(self._release(partition, handle))
+        for partition in sorted(wanted - set(self._owned) - set(self._acquiring)):
+            self._acquiring[partition] = asyncio.create_task(self._acquire(partition))
+
+    async def _acquire(self, partition: int) -> None:
+        try:
+            while partition in self._wanted:
+                try:
+                    handle = await self.start_partition(partition)
+                except BlockingIOError:
+                    await asyncio.sleep(0.5)  # прежний владелец ещё дорабатывает
+                    continue
+                except Exception as e:
+                    logger.error(f"Ошибка захвата раздела {partition}: {e}")
+                    await asyncio.sleep(self.heartbeat_interval)
+                    continue
+                if partition in self._wanted:
+                    self._owned[partition] = handle
+                    logger.info(f"Раздел {partition} захвачен")
+                else:
+                    # Пока раздел открывался, состав реплик изменился: сразу отдаём
+                    self._releasing[partition] = asyncio.create_task(self._release(partition, handle))
+                return
+        finally:
+            self._acquiring.pop(partition, None)
+
+    async def _release(self, partition: int, handle: Any) -> None:
+        try:
+            await self.stop_partition(partition, handle)
+            logger.info(f"Раздел {partition} отпущен")
+        except Exception as e:
+            logger.error(f"Ошибка освобождения раздела {partition}: {e}")
+        finally:
+            if self._releasing.get(partition) is asyncio.current_task():
+                del self._releasing[partition]
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        for task in list(self._acquiring.values()):
+            task.cancel()
+        self._wanted = set()
+        try:
+            await self._publish(leaving=True)
+        except Exception as e:
+            logger.error(f"Ошибка отправки heartbeat: {e}")
+        releasing = list(self._releasing.values())
+        releasing += [self._release(partition, self._owned.pop(partition)) for partition in list(self._owned)]
+        await asyncio.gather(*releasing)
+
+    @property
+    def handles(self) -> List[Any]:
+        """Результаты start_partition для разделов, которыми реплика владеет сейчас."""
+        return list(self._owned.values())
+
+    def stats(self) -> Dict:
+        return {
+            "replica_id": self.replica_id,
+            "replicas": sorted(self._peers),
+            "owned": sorted(self._owned),
+            "acquiring": sorted(self._acquiring),
+            "releasing": sorted(self._releasing),
+        }
@@ -0,0 +1,363 @@
+# common/tracing.py
+"""
+Сквозная трассировка сообщения через все сервисы.
+
+Контекст — trace_id, span_id родителя и флаг выборки в формате W3C
+traceparent — создаётся в точке входа (апдейт Telegram, вебхук amoCRM,
+HTTP-запрос без traceparent) и передаётся дальше в HTTP-заголовке
+traceparent и в заголовке traceparent сообщений RabbitMQ: inject() при
+отправке, extract() при приёме. Внутри процесса контекст живёт в contextvar;
+очереди с пулом воркеров (планировщик amoCRM, очередь отправки в Telegram)
+запоминают current() при постановке и восстанавливают его через activate().
+
+Шаги цепочки, замеряемые metrics.timed, становятся дочерними spans
+автоматически. Записываются только выбранные трассы (sample_rate в точке
+входа, дальше решение передаётся во флаге traceparent); trace_id есть у всех
+и попадает в логи как %(trace_id)s (фабрика записей ставится при импорте).
+Завершённые spans копятся в буфере и раз в секунду уходят в JSONL-файл
+или в OTLP/HTTP-коллектор (http(s)://host:4318, JSON-кодировка, /v1/traces).
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+TRACEPARENT = "traceparent"
+
+# Коды SpanKind в OTLP
+KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("trace_context", default=None)
+_INHERIT = object()
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+def current() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    context = _current.get()
+    return context.trace_id if context is not None else None
+
+
+class Span:
+    """
+    Шаг трассы: with start_span(...) as span: ... делает его текущим.
+    Время начала — момент создания, так что span, созданный при приёме
+    и открытый позже (после очереди), включает ожидание.
+    """
+    __slots__ = ("name", "kind", "context", "parent_id", "attributes", "start_ns", "error", "_token")
+
+    def __init__(self, name: str, parent: Optional[SpanContext], kind: str, attributes: Dict) -> None:
+        if parent is None:
+            sampled = _exporter is not None and random.random() < _sample_rate
+            self.context = SpanContext(_new_id(128), _new_id(64), sampled)
+            self.parent_id = None
+        else:
+            self.context = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+            self.parent_id = parent.span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def sampled(self) -> bool:
+        return self.context.sampled
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self.context)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        if exc_type is not None and self.error is None:
+            self.error = exc_type.__name__
+        self.finish()
+
+    def finish(self) -> None:
+        if self.context.sampled and _exporter is not None:
+            _exporter.add(self, time.time_ns())
+
+    async def run(self, awaitable):
+        with self:
+            return await awaitable
+
+
+def start_span(name: str, parent: Any = _INHERIT, kind: str = "internal", **attributes) -> Span:
+    """Новый span: дочерний к parent (по умолчанию — к текущему) или корень новой трассы."""
+    if parent is _INHERIT:
+        parent = _current.get()
+    return Span(name, parent, kind, attributes)
+
+
+def hop_span(hop: str, operation: str) -> Optional[Span]:
+    """Span исходящего шага для metrics.timed; None вне выбранной трассы (почти бесплатно)."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return None
+    return Span(f"{hop}.{operation}", parent, "client", {"hop": hop, "operation": operation})
+
+
+class activate:
+    """Делает контекст текущим без нового span: продолжение трассы в воркере очереди."""
+    __slots__ = ("context", "_token")
+
+    def __init__(self, context: Optional[SpanContext]) -> None:
+        self.context = context
+
+    def __enter__(self) -> None:
+        self._token = _current.set(self.context) if self.context is not None else None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._token is not None:
+            _current.reset(self._token)
+
+
+def inject(headers: Optional[Dict] = None) -> Dict:
+    """Заголовки (HTTP или AMQP) с traceparent текущего контекста."""
+    headers = {} if headers is None else headers
+    context = _current.get()
+    if context is not None:
+        headers[TRACEPARENT] = context.traceparent
+    return headers
+
+
+def extract(headers: Optional[Mapping]) -> Optional[SpanContext]:
+    """Контекст из traceparent входящих заголовков; None, если его нет или он некорректен."""
+    if not headers:
+        return None
+    value = headers.get(TRACEPARENT)
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2], sampled)
+
+
+# --- Экспорт ---
+class _Exporter:
+    """Буфер завершённых spans и фоновая отправка пачками; при переполнении старые отбрасываются."""
+
+    def __init__(self, service: str, target: str, buffer_size: int = 10000, batch_size: int = 512,
+                 interval: float = 1.0) -> None:
+        self.service = service
+        self.target = target
+        self.otlp = target.startswith(("http://", "https://"))
+        if self.otlp and not target.rstrip("/").endswith("/v1/traces"):
+            self.target = target.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer: Deque[Tuple[Span, int]] = deque(maxlen=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+        self._session = None
+        self.counters = {"exported": 0, "dropped": 0, "export_errors": 0}
+
+    def add(self, span: Span, end_ns: int) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.counters["dropped"] += 1
+        self._buffer.append((span, end_ns))
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                if self.otlp:
+                    await self._post_otlp(batch)
+                else:
+                    lines = "".join(json.dumps(self._record(span, end), ensure_ascii=False) + "\n" for span, end in batch)
+                    await asyncio.get_running_loop().run_in_executor(None, self._append, lines)
+                self.counters["exported"] += len(batch)
+            except Exception as e:
+                self.counters["export_errors"] += 1
+                logging.warning(f"Не удалось выгрузить {len(batch)} spans в {self.target}: {e}")
+                return
+
+    def _append(self, lines: str) -> None:
+        with open(self.target, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _record(self, span: Span, end_ns: int) -> Dict:
+        return {
+            "service": self.service,
+            "trace_id": span.context.trace_id,
+            "span_id": span.context.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "kind": span.kind,
+            "start": span.start_ns / 1e9,
+            "duration_ms": round((end_ns - span.start_ns) / 1e6, 3),
+            "attributes": span.attributes,
+            "error": span.error,
+        }
+
+    @staticmethod
+    def _value(value: Any) -> Dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _otlp_span(self, span: Span, end_ns: int) -> Dict:
+        result = {
+            "traceId": span.context.trace_id,
+            "spanId": span.context.span_id,
+            "name": span.name,
+            "kind": KINDS.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in span.attributes.items()],
+        }
+        if span.parent_id:
+            result["parentSpanId"] = span.parent_id
+        if span.error:
+            result["status"] = {"code": 2, "message": span.error}
+        return result
+
+    async def _post_otlp(self, batch: List[Tuple[Span, int]]) -> None:
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+            "scopeSpans": [{"scope": {"name": "flowsynk"}, "spans": [self._otlp_span(s, e) for s, e in batch]}],
+        }]}
+        async with self._session.post(self.target, json=body) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"HTTP {response.status}: {(await response.text())[:200]}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> Dict:
+        return {"buffered": len(self._buffer), **self.counters}
+
+
+_service = "unknown"
+_sample_rate = 0.0
+_exporter: Optional[_Exporter] = None
+
+
+def configure(service: str, export: str = "", sample_rate: float = 0.0, buffer_size: int = 10000) -> None:
+    """
+    Вызывается один раз при импорте main сервиса. export — путь к JSONL-файлу
+    или URL OTLP/HTTP; пусто — spans не пишутся, но trace_id передаётся и логируется.
+    """
+    global _service, _sample_rate, _exporter
+    _service = service
+    _sample_rate = max(0.0, min(1.0, sample_rate))
+    _exporter = _Exporter(service, export, buffer_size) if export else None
+
+
+async def shutdown() -> None:
+    """Выгружает оставшиеся spans; вызывать при остановке сервиса."""
+    if _exporter is not None:
+        await _exporter.close()
+
+
+def stats() -> Dict:
+    result = {"sample_rate": _sample_rate}
+    if _exporter is not None:
+        result.update(_exporter.stats())
+    return result
+
+
+# --- Логи: у каждой записи есть trace_id ('-' вне трассы) для формата %(trace_id)s ---
+_record_factory = logging.getLogRecordFactory()
+
+
+def _traced_record(*args, **kwargs) -> logging.LogRecord:
+    record = _record_factory(*args, **kwargs)
+    context = _current.get()
+    record.trace_id = context.trace_id if context is not None else "-"
+    return record
+
+
+logging.setLogRecordFactory(_traced_record)
+
+
+# --- Входящие HTTP-запросы (ASGI) ---
+class TracingMiddleware:
+    """Span server на каждый запрос: продолжает трассу из traceparent или начинает новую."""
+
+    SKIP_PATHS = ("/metrics",)
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.SKIP_PATHS:
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = extract({TRACEPARENT: value})
+                break
+        span = Span(f"{scope['method']} {scope['path']}", parent, "server", {})
+        status = [500]
+
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                span.set("http.status_code", status[0])
+                if status[0] >= 500 and span.error is None:
+                    span.error = f"HTTP {status[0]}"
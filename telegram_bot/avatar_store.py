@@ -0,0 +1,225 @@
+# telegram_bot/avatar_store.py
+
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from aiogram import Bot
+
+
+class AvatarStore:
+    """
+    Аватары пользователей с адресацией по содержимому.
+
+    Файл называется по file_unique_id фото в Telegram (одинаков для одного и
+    того же изображения), поэтому повторная загрузка того же аватара не нужна.
+    Загрузка идёт потоком во временный .part и атомарно переименовывается.
+    Индекс tg_id -> имя файла хранится в avatars.json рядом с файлами; при
+    смене аватара старая версия удаляется, если на неё никто не ссылается.
+
+    Каталог общий для процессов: поиск файла, обновление индекса и удаление
+    идут в пуле потоков под flock на avatars.lock, индекс перед записью
+    перечитывается с диска, а удалять можно только файлы, на которые не
+    ссылается индекс на диске. refresh() раз в refresh_interval секунд
+    проверяет, не сменил ли пользователь аватар.
+    """
+
+    INDEX_NAME = "avatars.json"
+    LOCK_NAME = "avatars.lock"
+
+    def __init__(self, directory: str, refresh_interval: float = 6 * 3600, max_tracked: int = 100000) -> None:
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.max_tracked = max_tracked
+        self._index_path = os.path.join(directory, self.INDEX_NAME)
+        self._lock_path = os.path.join(directory, self.LOCK_NAME)
+        self._index: Dict[str, str] = {}
+        self._loaded = False
+        self._fetching: Dict[str, asyncio.Task] = {}
+        self._stale: Dict[str, str] = {}
+        self._checked: Dict[str, float] = {}  # tg_id -> время последней проверки, по возрастанию
+        self.counters = {"fetched": 0, "downloaded": 0, "changed": 0, "removed": 0}
+
+    async def open(self) -> None:
+        """Загружает индекс вне event loop; без open() индекс читается при первом обращении."""
+        await asyncio.to_thread(self._load_index)
+
+    def _load_index(self) -> None:
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self._index_path, "r") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index = {}
+        except ValueError as e:
+            logging.error(f"Индекс аватаров повреждён, начинаем заново: {e}")
+            self._index = {}
+        self._loaded = True
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read_index(self) -> Dict[str, str]:
+        try:
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return dict(self._index)
+
+    def _write_index(self, index: Dict[str, str]) -> None:
+        tmp_path = self._index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+
+    def _assign(self, tg_id: str, filename: str) -> Optional[str]:
+        """Под блокировкой: индекс с диска + tg_id -> filename; возвращает прежний файл пользователя."""
+        index = self._read_index()
+        previous = index.get(tg_id)
+        if previous != filename:
+            index[tg_id] = filename
+            self._write_index(index)
+        self._index = index
+        return previous
+
+    def current(self, tg_id: str) -> Optional[str]:
+        """Имя уже скачанного аватара пользователя, без обращения к Telegram."""
+        self._load_index()
+        filename = self._index.get(tg_id)
+        if filename and os.path.exists(os.path.join(self.directory, filename)):
+            return filename
+        return None
+
+    def _find_by_unique_id(self, file_unique_id: str) -> Optional[str]:
+        for path in glob.glob(os.path.join(self.directory, glob.escape(file_unique_id) + ".*")):
+            if not path.endswith(".part"):
+                return os.path.basename(path)
+        return None
+
+    def _claim_existing(self, tg_id: str, file_unique_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """В пуле потоков: уже скачанное изображение закрепляется за пользователем до того, как его удалит GC."""
+        with self._locked():
+            filename = self._find_by_unique_id(file_unique_id)
+            if filename is None:
+                return None, None
+            return filename, self._assign(tg_id, filename)
+
+    def _install(self, tg_id: str, part_path: str, filename: str) -> Optional[str]:
+        with self._locked():
+            os.replace(part_path, os.path.join(self.directory, filename))
+            return self._assign(tg_id, filename)
+
+    async def fetch(self, bot: Bot, user_id: int) -> Optional[str]:
+        """Актуальный аватар пользователя; скачивает, только если такого изображения ещё нет."""
+        self._load_index()
+        tg_id = str(user_id)
+        profile_photos = await bot.get_user_profile_photos(user_id, limit=1)
+        if profile_photos.total_count == 0:
+            logging.warning(f"У пользователя {user_id} нет аватара.")
+            return None
+        photo = profile_photos.photos[0][-1]
+        self.counters["fetched"] += 1
+        filename, previous = await asyncio.to_thread(self._claim_existing, tg_id, photo.file_unique_id)
+        if filename is None:
+            file = await bot.get_file(photo.file_id)
+            file_ext = os.path.splitext(file.file_path)[1] or '.jpg'
+            filename = f"{photo.file_unique_id}{file_ext}"
+            part_path = os.path.join(self.directory, f"{filename}.{os.getpid()}.part")
+            try:
+                # aiogram пишет в файл по частям, не держа изображение в памяти
+                await bot.download_file(file.file_path, destination=part_path)
+                previous = await asyncio.to_thread(self._install, tg_id, part_path, filename)
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            self.counters["downloaded"] += 1
+            logging.info(f"Аватар для пользователя {user_id} сохранен как {filename}")
+
+        if previous and previous != filename:
+            self._stale[tg_id] = previous
+            self.counters["changed"] += 1
+            logging.info(f"Пользователь {user_id} сменил аватар: {previous} -> {filename}")
+        return filename
+
+    def fetch_in_background(self, bot: Bot, user_id: int, on_ready) -> None:
+        """
+        Запускает fetch() фоновой задачей (одна на пользователя);
+        on_ready(filename) вызывается, если аватар получен.
+        """
+        tg_id = str(user_id)
+        if tg_id in self._fetching:
+            return
+
+        async def run() -> None:
+            try:
+                filename = await self.fetch(bot, user_id)
+                if filename:
+                    await on_ready(filename)
+            except Exception as e:
+                logging.error(f"Ошибка загрузки аватара для {user_id}: {e}")
+            finally:
+                self._fetching.pop(tg_id, None)
+
+        self._checked.pop(tg_id, None)
+        self._checked[tg_id] = time.monotonic()
+        while len(self._checked) > self.max_tracked:
+            del self._checked[next(iter(self._checked))]
+        self._fetching[tg_id] = asyncio.create_task(run())
+
+    def refresh(self, bot: Bot, user_id: int, on_ready) -> None:
+        """
+        Проверка смены аватара для уже известного пользователя: не чаще раза
+        в refresh_interval секунд на tg_id, в фоне, как fetch_in_background().
+        """
+        checked = self._checked.get(str(user_id))
+        if checked is not None and time.monotonic() - checked < self.refresh_interval:
+            return
+        self.fetch_in_background(bot, user_id, on_ready)
+
+    def _remove_unreferenced(self, tg_id: str, stale: Optional[str]) -> int:
+        with self._locked():
+            # Ссылки — по индексу на диске: его могли обновить другие процессы
+            index = self._read_index()
+            self._index = index
+            if tg_id not in index:
+                return 0
+            referenced = set(index.values())
+            candidates = glob.glob(os.path.join(self.directory, f"avatar_{glob.escape(tg_id)}_*"))
+            if stale:
+                candidates.append(os.path.join(self.directory, stale))
+            removed = 0
+            for path in candidates:
+                # Одно изображение может быть аватаром нескольких пользователей
+                if os.path.basename(path) not in referenced and os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+            return removed
+
+    async def collect_garbage(self, tg_id: str) -> int:
+        """
+        Удаляет устаревшие аватары пользователя: файлы старого формата
+        avatar_{tg_id}_{время}.* и прежние версии, на которые не ссылается индекс.
+        Вызывать после того, как запись пользователя в БД указывает на актуальный файл.
+        """
+        removed = await asyncio.to_thread(self._remove_unreferenced, tg_id, self._stale.pop(tg_id, None))
+        if removed:
+            self.counters["removed"] += removed
+            logging.info(f"Удалено устаревших аватаров пользователя {tg_id}: {removed}")
+        return removed
+
+    def stats(self) -> Dict:
+        return {"users": len(self._index), "fetching": len(self._fetching), **self.counters}
@@ -0,0 +1,420 @@
+# telegram_bot/history.py
+
+import asyncio
+import bisect
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Запись индекса: хэш разговора, seq предыдущего сообщения того же разговора,
+# время (мс), смещение и длина записи в .log сегмента, вид записи
+ENTRY = struct.Struct("<QQqIIB7x")
+NO_PREV = 2 ** 64 - 1
+KIND_MESSAGE = 0
+KIND_DELETE = 1
+KIND_REMOVED = 2  # сообщение удалённого разговора, вырезанное компакцией
+
+
+def conversation_hash(conversation: str) -> int:
+    return int.from_bytes(hashlib.blake2b(conversation.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _Segment:
+    """Пара файлов {base}.log (тела сообщений) и {base}.idx (записи ENTRY по порядку seq)."""
+
+    def __init__(self, directory: str, base: int) -> None:
+        self.base = base
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.index_path = os.path.join(directory, f"{base:020d}.idx")
+        self.log_fd: Optional[int] = None
+        self.index_fd: Optional[int] = None  # только у активного сегмента
+        self.index = None  # mmap индекса закрытого сегмента
+        self.count = 0
+        self.size = 0
+        self.last_ts = 0.0
+
+    def open_active(self) -> None:
+        self.log_fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._recover()
+
+    def _recover(self) -> None:
+        """Отрезает недописанный хвост после сбоя: запись в .log, затем в .idx."""
+        index_size = os.fstat(self.index_fd).st_size
+        log_size = os.fstat(self.log_fd).st_size
+        count = index_size // ENTRY.size
+        while count:
+            _, _, ts_ms, offset, length, _ = self.entry_at(count - 1)
+            if offset + length <= log_size:
+                self.size = offset + length
+                self.last_ts = ts_ms / 1000
+                break
+            count -= 1
+        else:
+            self.size = 0
+        if count * ENTRY.size != index_size or self.size != log_size:
+            logging.warning(f"История: обрезаем незавершённую запись в {os.path.basename(self.log_path)}")
+            os.ftruncate(self.index_fd, count * ENTRY.size)
+            os.ftruncate(self.log_fd, self.size)
+        self.count = count
+
+    def open_sealed(self) -> None:
+        self.log_fd = os.open(self.log_path, os.O_RDONLY)
+        with open(self.index_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.count = len(self.index) // ENTRY.size
+        self.size = os.fstat(self.log_fd).st_size
+        if self.count:
+            self.last_ts = self.entry_at(self.count - 1)[2] / 1000
+
+    def seal(self) -> Tuple[int, int]:
+        """Переводит сегмент на чтение; возвращает дескрипторы записи — fsync и закрытие за вызывающим."""
+        fds = (self.log_fd, self.index_fd)
+        self.index_fd = None
+        self.open_sealed()
+        return fds
+
+    def entry_at(self, i: int) -> Tuple[int, int, int, int, int, int]:
+        if self.index_fd is None:
+            return ENTRY.unpack_from(self.index, i * ENTRY.size)
+        return ENTRY.unpack(os.pread(self.index_fd, ENTRY.size, i * ENTRY.size))
+
+    def entries(self) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        if self.index_fd is None:
+            return ENTRY.iter_unpack(self.index)
+        return ENTRY.iter_unpack(os.pread(self.index_fd, self.count * ENTRY.size, 0))
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self.log_fd, length, offset)
+
+    def close(self) -> None:
+        if isinstance(self.index, mmap.mmap):
+            self.index.close()
+        self.index = None
+        for fd in (self.log_fd, self.index_fd):
+            if fd is not None:
+                os.close(fd)
+        self.log_fd = self.index_fd = None
+
+
+class ConversationLog:
+    """
+    Журнал сообщений по разговорам: сегменты append-only + индекс фиксированной длины.
+
+    Каждая запись индекса хранит seq предыдущего сообщения того же разговора,
+    поэтому последние N сообщений читаются N обращениями к индексу (mmap для
+    закрытых сегментов) и N pread из .log — без загрузки истории в память.
+    В памяти только последняя запись каждого разговора; она восстанавливается
+    при открытии проходом по индексам.
+
+    Активный сегмент закрывается по достижении segment_bytes; его fsync идёт
+    в отдельном потоке, запись продолжается в новый сегмент. Закрытые сегменты
+    старше retention секунд удаляются целиком, а компакция вырезает из них
+    сообщения разговоров, удалённых через delete_conversation().
+
+    Каталог пишет один процесс: open() берёт flock на history.lock, с
+    blocking=False — BlockingIOError, пока каталог держит другая реплика.
+    """
+
+    LOCK_NAME = "history.lock"
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 retention: Optional[float] = None) -> None:
+        if segment_bytes >= 2 ** 32:
+            raise ValueError("segment_bytes must be below 4 GiB")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention = retention
+        self._segments: List[_Segment] = []
+        self._bases: List[int] = []
+        self._heads: Dict[int, int] = {}
+        self._deleted: Dict[int, int] = {}  # хэш разговора -> seq последнего удаления
+        self._compaction_pending = False
+        self._lock_file = None
+        # Один фоновый поток: fsync закрытых сегментов и компакция; close() его дожидается
+        self._syncer: Optional[ThreadPoolExecutor] = None
+        self.counters = {"appended": 0, "segments_rolled": 0, "segments_expired": 0,
+                         "segments_compacted": 0, "bytes_reclaimed": 0}
+
+    @property
+    def _active(self) -> _Segment:
+        return self._segments[-1]
+
+    # --- Открытие ---
+    def open(self, blocking: bool = True) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, self.LOCK_NAME), "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise
+        self._finish_compactions()
+        bases = sorted(int(os.path.basename(p)[:-4]) for p in glob.glob(os.path.join(self.directory, "*.log")))
+        if not bases:
+            bases = [0]
+        for base in bases[:-1]:
+            segment = _Segment(self.directory, base)
+            segment.open_sealed()
+            self._segments.append(segment)
+        active = _Segment(self.directory, bases[-1])
+        active.open_active()
+        self._segments.append(active)
+        self._bases = [segment.base for segment in self._segments]
+
+        for segment in self._segments:
+            for i, (h, _, _, _, _, kind) in enumerate(segment.entries()):
+                if kind == KIND_MESSAGE:
+                    self._heads[h] = segment.base + i
+                elif kind == KIND_DELETE:
+                    self._heads.pop(h, None)
+                    self._deleted[h] = segment.base + i
+        self._compaction_pending = bool(self._deleted)
+        logging.info(f"История открыта: сегментов {len(self._segments)}, разговоров {len(self._heads)}")
+
+    def _finish_compactions(self) -> None:
+        """Доводит до конца компакцию, прерванную между заменой .log и .idx."""
+        for index_tmp in glob.glob(os.path.join(self.directory, "*.idx.compact")):
+            log_tmp = index_tmp[:-len(".idx.compact")] + ".log.compact"
+            if os.path.exists(log_tmp):
+                # .log ещё не заменён: компакция не состоялась
+                os.remove(log_tmp)
+                os.remove(index_tmp)
+            else:
+                os.replace(index_tmp, index_tmp[:-len(".compact")])
+        for log_tmp in glob.glob(os.path.join(self.directory, "*.log.compact")):
+            os.remove(log_tmp)  # сбой до записи .idx.compact
+
+    def close(self) -> None:
+        if self._syncer is not None:
+            self._syncer.shutdown(wait=True)  # дописать fsync закрытых сегментов и идущую компакцию
+            self._syncer = None
+        for segment in self._segments:
+            if segment.index_fd is not None:
+                os.fsync(segment.log_fd)
+                os.fsync(segment.index_fd)
+            segment.close()
+        self._segments = []
+        self._bases = []
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    # --- Запись ---
+    def append(self, conversation: str, direction: str, text: str, ts: Optional[float] = None, **extra) -> int:
+        """Добавляет сообщение; возвращает его seq. Запись идёт в page cache, fsync — при смене сегмента."""
+        ts = time.time() if ts is None else ts
+        payload = {"conversation": conversation, "direction": direction, "text": text, "ts": ts, **extra}
+        return self._append(conversation, KIND_MESSAGE, json.dumps(payload, ensure_ascii=False).encode("utf-8"), ts)
+
+    def delete_conversation(self, conversation: str) -> bool:
+        """Скрывает историю разговора сразу; место освобождает следующая компакция."""
+        h = conversation_hash(conversation)
+        if h not in self._heads:
+            return False
+        ts = time.time()
+        payload = json.dumps({"conversation": conversation, "deleted": True, "ts": ts}).encode("utf-8")
+        self._append(conversation, KIND_DELETE, payload, ts)
+        return True
+
+    def _append(self, conversation: str, kind: int, payload: bytes, ts: float) -> int:
+        segment = self._active
+        if segment.count and segment.size + len(payload) > self.segment_bytes:
+            segment = self._roll()
+        h = conversation_hash(conversation)
+        seq = segment.base + segment.count
+        prev = self._heads.get(h, NO_PREV) if kind == KIND_MESSAGE else NO_PREV
+        os.write(segment.log_fd, payload)
+        os.write(segment.index_fd, ENTRY.pack(h, prev, int(ts * 1000), segment.size, len(payload), kind))
+        segment.size += len(payload)
+        segment.count += 1
+        segment.last_ts = ts
+        if kind == KIND_MESSAGE:
+            self._heads[h] = seq
+            self.counters["appended"] += 1
+        else:
+            self._heads.pop(h, None)
+            self._deleted[h] = seq
+            self._compaction_pending = True
+        return seq
+
+    @staticmethod
+    def _sync_and_close(fds: Tuple[int, int]) -> None:
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logging.error(f"История: fsync закрытого сегмента не удался: {e}")
+            finally:
+                os.close(fd)
+
+    def _background(self) -> ThreadPoolExecutor:
+        if self._syncer is None:
+            self._syncer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-fsync")
+        return self._syncer
+
+    def _roll(self) -> _Segment:
+        current = self._active
+        # fsync сотен мегабайт не должен держать event loop: закрытый сегмент уже читается из page cache
+        self._background().submit(self._sync_and_close, current.seal())
+        segment = _Segment(self.directory, current.base + current.count)
+        segment.open_active()
+        self._segments.append(segment)
+        self._bases.append(segment.base)
+        self.counters["segments_rolled"] += 1
+        return segment
+
+    # --- Чтение ---
+    def _locate(self, seq: int) -> Optional[_Segment]:
+        i = bisect.bisect_right(self._bases, seq) - 1
+        if i < 0:
+            return None
+        segment = self._segments[i]
+        return segment if seq - segment.base < segment.count else None
+
+    def _walk(self, conversation: str) -> Iterator[Tuple[int, _Segment, int, int]]:
+        """(время мс, сегмент, смещение, длина) сообщений разговора от новых к старым."""
+        h = conversation_hash(conversation)
+        seq = self._heads.get(h, NO_PREV)
+        while seq != NO_PREV:
+            segment = self._locate(seq)
+            if segment is None:
+                return  # дальше история удалена по retention
+            entry_hash, prev, ts_ms, offset, length, kind = segment.entry_at(seq - segment.base)
+            if entry_hash != h or kind != KIND_MESSAGE:
+                return
+            yield ts_ms, segment, offset, length
+            seq = prev
+
+    def _load(self, conversation: str, segment: _Segment, offset: int, length: int) -> Optional[Dict]:
+        record = json.loads(segment.read(offset, length))
+        # 64-битные хэши разных разговоров практически не совпадают, но проверяем
+        return record if record.get("conversation") == conversation else None
+
+    def tail(self, conversation: str, limit: int = 50) -> List[Dict]:
+        """Последние limit сообщений разговора в хронологическом порядке."""
+        result = []
+        for _, segment, offset, length in self._walk(conversation):
+            if len(result) >= limit:
+                break
+            record = self._load(conversation, segment, offset, length)
+            if record is not None:
+                result.append(record)
+        result.reverse()
+        return result
+
+    def range(self, conversation: str, since: float, until: Optional[float] = None, limit: int = 1000) -> List[Dict]:
+        """Сообщения разговора с since по until (unix-время), не больше limit последних."""
+        since_ms = int(since * 1000)
+        until_ms = int(until * 1000) if until is not None else None
+        result = []
+        for ts_ms, segment, offset, length in self._walk(conversation):
+            if until_ms is not None and ts_ms > until_ms:
+                continue
+            if ts_ms < since_ms or len(result) >= limit:
+                break
+            record = self._load(conversation, segment, offset, length)
+            if record is not None:
+                result.append(record)
+        result.reverse()
+        return result
+
+    # --- Обслуживание ---
+    def apply_retention(self, now: Optional[float] = None) -> int:
+        """Удаляет закрытые сегменты, все сообщения которых старше retention."""
+        if not self.retention:
+            return 0
+        cutoff = (time.time() if now is None else now) - self.retention
+        removed = 0
+        # Только с начала журнала, чтобы seq оставались непрерывными
+        while len(self._segments) > 1 and self._segments[0].last_ts < cutoff:
+            segment = self._segments.pop(0)
+            self._bases.pop(0)
+            segment.close()
+            os.remove(segment.log_path)
+            os.remove(segment.index_path)
+            removed += 1
+        if removed:
+            first = self._bases[0]
+            self._deleted = {h: seq for h, seq in self._deleted.items() if seq >= first}
+            self.counters["segments_expired"] += removed
+            logging.info(f"История: удалено сегментов по сроку хранения: {removed}")
+        return removed
+
+    @staticmethod
+    def _rewrite(segment: _Segment, deleted: Dict[int, int]) -> int:
+        """
+        Пишет копию закрытого сегмента без сообщений удалённых разговоров
+        в .compact-файлы; возвращает освобождаемые байты (0 — сегмент не трогаем).
+        Выполняется в пуле потоков, читает только неизменяемые файлы сегмента.
+        """
+        entries = list(segment.entries())
+        drop = [
+            kind == KIND_MESSAGE and deleted.get(h, -1) > segment.base + i
+            for i, (h, _, _, _, _, kind) in enumerate(entries)
+        ]
+        if not any(drop):
+            return 0
+        log_tmp = segment.log_path + ".compact"
+        index_tmp = segment.index_path + ".compact"
+        offset = 0
+        with open(log_tmp, "wb") as log_out, open(index_tmp, "wb") as index_out:
+            for (h, prev, ts_ms, old_offset, length, kind), dropped in zip(entries, drop):
+                if dropped:
+                    index_out.write(ENTRY.pack(h, prev, ts_ms, 0, 0, KIND_REMOVED))
+                    continue
+                log_out.write(segment.read(old_offset, length))
+                index_out.write(ENTRY.pack(h, prev, ts_ms, offset, length, kind))
+                offset += length
+            for f in (log_out, index_out):
+                f.flush()
+                os.fsync(f.fileno())
+        return segment.size - offset
+
+    def _install(self, segment: _Segment) -> None:
+        segment.close()
+        os.replace(segment.log_path + ".compact", segment.log_path)
+        os.replace(segment.index_path + ".compact", segment.index_path)
+        segment.open_sealed()
+
+    async def maintain(self) -> None:
+        """
+        Срок хранения и компакция закрытых сегментов; тяжёлая работа — в фоновом потоке.
+        Отмена не прерывает переписывание сегмента: close() дождётся его, прежде чем закрыть файлы.
+        """
+        self.apply_retention()
+        if not self._compaction_pending:
+            return
+        self._compaction_pending = False
+        deleted = dict(self._deleted)
+        for segment in self._segments[:-1]:
+            reclaimed = await asyncio.get_running_loop().run_in_executor(
+                self._background(), self._rewrite, segment, deleted
+            )
+            if segment not in self._segments:
+                return  # журнал закрыт (раздел отдан) или сегмент удалён по сроку, пока шло переписывание
+            if reclaimed:
+                self._install(segment)
+                self.counters["segments_compacted"] += 1
+                self.counters["bytes_reclaimed"] += reclaimed
+                logging.info(f"История: сегмент {segment.base} сжат, освобождено {reclaimed} байт")
+
+    def stats(self) -> Dict:
+        return {
+            "segments": len(self._segments),
+            "messages": sum(segment.count for segment in self._segments),
+            "bytes": sum(segment.size for segment in self._segments),
+            "conversations": len(self._heads),
+            **self.counters,
+        }
@@ -0,0 +1,269 @@
+# telegram_bot/media_relay.py
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import posixpath
+import uuid
+from typing import AsyncGenerator, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+
+from aiogram import Bot, types
+from aiogram.types import InputFile
+
+# Тип вложения Telegram -> тип сообщения amoCRM
+AMO_MESSAGE_TYPES = {
+    "photo": "picture",
+    "video": "video",
+    "animation": "video",
+    "video_note": "video",
+    "voice": "voice",
+    "audio": "audio",
+    "document": "file",
+}
+
+PHOTO_MAX_BYTES = 10 * 1024 * 1024  # sendPhoto; крупнее — документом
+CAPTION_MAX_LENGTH = 1024
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class _StreamedFile(InputFile):
+    """Файл по URL, который aiogram отправляет в Telegram по частям по мере скачивания."""
+
+    def __init__(self, relay: "MediaRelay", url: str, filename: str) -> None:
+        super().__init__(filename=filename, chunk_size=relay.chunk_size)
+        self.relay = relay
+        self.url = url
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        received = 0
+        async for chunk in bot.session.stream_content(
+            self.url, timeout=self.relay.timeout, chunk_size=self.chunk_size
+        ):
+            received += len(chunk)
+            if received > self.relay.max_bytes:
+                raise MediaTooLarge(f"{self.url}: больше {self.relay.max_bytes} байт")
+            yield chunk
+        self.relay.counters["uploaded_bytes"] += received
+
+
+class MediaRelay:
+    """
+    Пересылка вложений между Telegram и amoCRM без буферизации файлов в памяти.
+
+    amoCRM принимает вложения ссылкой (message.media) и сам скачивает файл,
+    поэтому входящие вложения отдаются по подписанной ссылке на /media:
+    файл идёт из файлового API Telegram в ответ amoCRM частями по chunk_size,
+    попутно сохраняясь в дисковый кэш (cache_dir, до cache_bytes, вытесняются
+    давно не читанные). Исходящие вложения по ссылке amoCRM так же потоком
+    уходят в sendPhoto/sendDocument/... через сессию бота.
+
+    Размер ограничен max_bytes в обе стороны (getFile Bot API отдаёт до 20 МБ),
+    одновременных передач — не больше max_concurrency.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        public_url: str,
+        secret: str,
+        max_bytes: int = 20 * 1024 * 1024,
+        max_concurrency: int = 4,
+        chunk_size: int = 64 * 1024,
+        cache_dir: Optional[str] = None,
+        cache_bytes: int = 1024 * 1024 * 1024,
+        timeout: int = 60,
+    ) -> None:
+        self.bot = bot
+        self.public_url = public_url.rstrip("/")
+        self.secret = secret.encode("utf-8")
+        self.max_bytes = max_bytes
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir if cache_bytes > 0 else None
+        self.cache_bytes = cache_bytes
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cache_size: Optional[int] = None
+        self._active = 0
+        self.counters = {
+            "downloads": 0, "cache_hits": 0, "downloaded_bytes": 0,
+            "uploads": 0, "uploaded_bytes": 0, "too_large": 0, "failed": 0,
+        }
+
+    def _slots(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def fits(self, media: Dict) -> bool:
+        """False, если размер известен заранее и превышает лимит."""
+        return not media.get("file_size") or media["file_size"] <= self.max_bytes
+
+    # --- Telegram -> amoCRM ---
+    @staticmethod
+    def describe(message: types.Message) -> Optional[Dict]:
+        """Вложение сообщения Telegram или None (текст, стикер, геопозиция и т.п.)."""
+        for attr, amo_type in AMO_MESSAGE_TYPES.items():
+            item = getattr(message, attr, None)
+            if not item:
+                continue
+            if attr == "photo":
+                item = item[-1]  # самый крупный размер
+            file_name = getattr(item, "file_name", None) or f"{attr}_{item.file_unique_id}"
+            return {
+                "type": amo_type,
+                "file_id": item.file_id,
+                "file_unique_id": item.file_unique_id,
+                "file_name": file_name,
+                "file_size": item.file_size,
+            }
+        return None
+
+    def _signature(self, file_id: str, file_unique_id: str) -> str:
+        return hmac.new(self.secret, f"{file_id}:{file_unique_id}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def verify(self, file_id: str, file_unique_id: str, signature: str) -> bool:
+        return hmac.compare_digest(self._signature(file_id, file_unique_id), signature)
+
+    def link(self, media: Dict) -> Dict:
+        """Вложение для amo_send: ссылка, по которой amoCRM скачает файл."""
+        query = urlencode({
+            "file_id": media["file_id"],
+            "name": media["file_name"],
+            "sig": self._signature(media["file_id"], media["file_unique_id"]),
+        })
+        return {
+            "type": media["type"],
+            "url": f"{self.public_url}/{media['file_unique_id']}?{query}",
+            "file_name": media["file_name"],
+            "file_size": media["file_size"],
+        }
+
+    def cached_path(self, file_unique_id: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, file_unique_id)
+        try:
+            os.utime(path)  # mtime — время последнего чтения для вытеснения
+        except FileNotFoundError:
+            return None
+        self.counters["cache_hits"] += 1
+        return path
+
+    async def download(self, file_id: str, file_unique_id: str) -> Tuple[Optional[int], AsyncGenerator[bytes, None]]:
+        """
+        Размер и поток частей файла из Telegram. Размер проверяется до начала
+        ответа; слот передачи поток занимает, только когда его начинают читать.
+        """
+        file = await self.bot.get_file(file_id)
+        if file.file_size and file.file_size > self.max_bytes:
+            self.counters["too_large"] += 1
+            raise MediaTooLarge(f"{file_id}: {file.file_size} байт")
+        return file.file_size, self._stream(file, file_unique_id)
+
+    async def _stream(self, file: types.File, file_unique_id: str) -> AsyncGenerator[bytes, None]:
+        url = self.bot.session.api.file_url(self.bot.token, file.file_path)
+        part_path = None
+        out = None
+        await self._slots().acquire()
+        self._active += 1
+        received = 0
+        try:
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                part_path = os.path.join(self.cache_dir, f".{file_unique_id}.{uuid.uuid4().hex}.part")
+                out = open(part_path, "wb")
+            async for chunk in self.bot.session.stream_content(url, timeout=self.timeout, chunk_size=self.chunk_size):
+                received += len(chunk)
+                if received > self.max_bytes:
+                    self.counters["too_large"] += 1
+                    raise MediaTooLarge(f"{file.file_id}: больше {self.max_bytes} байт")
+                if out is not None:
+                    out.write(chunk)  # часть уже в памяти; запись идёт в page cache
+                yield chunk
+            self.counters["downloads"] += 1
+            if out is not None:
+                out.close()
+                os.replace(part_path, os.path.join(self.cache_dir, file_unique_id))
+                self._add_to_cache(received)
+        except Exception as e:
+            self.counters["failed"] += 1
+            logging.error(f"Ошибка передачи вложения {file_unique_id}: {e}")
+            raise
+        finally:
+            self.counters["downloaded_bytes"] += received
+            self._active -= 1
+            self._slots().release()
+            if out is not None:
+                out.close()
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+    def _add_to_cache(self, size: int) -> None:
+        if self._cache_size is None:
+            self._cache_size = sum(
+                entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                if entry.is_file() and not entry.name.startswith(".")
+            )
+        else:
+            self._cache_size += size
+        if self._cache_size <= self.cache_bytes:
+            return
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and not entry.name.startswith(".")
+        )
+        for _, entry_size, path in entries:
+            if self._cache_size <= self.cache_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._cache_size -= entry_size
+
+    # --- amoCRM -> Telegram ---
+    async def send(self, chat_id, media: Dict, caption: Optional[str] = None) -> types.Message:
+        """Отправляет вложение amoCRM в чат; длинная подпись уходит отдельным сообщением."""
+        if not self.fits(media):
+            self.counters["too_large"] += 1
+            raise MediaTooLarge(f"{media['url']}: {media['file_size']} байт")
+        file_name = media.get("file_name") or posixpath.basename(urlparse(media["url"]).path) or "file"
+        file = _StreamedFile(self, media["url"], file_name)
+        long_caption = caption if caption and len(caption) > CAPTION_MAX_LENGTH else None
+        kwargs = {"caption": None if long_caption else caption or None, "parse_mode": None}
+        media_type = media.get("type")
+        async with self._slots():
+            self._active += 1
+            try:
+                if media_type == "picture" and (media.get("file_size") or 0) <= PHOTO_MAX_BYTES:
+                    message = await self.bot.send_photo(chat_id, file, **kwargs)
+                elif media_type == "video":
+                    message = await self.bot.send_video(chat_id, file, **kwargs)
+                elif media_type == "voice":
+                    message = await self.bot.send_voice(chat_id, file, **kwargs)
+                elif media_type == "audio":
+                    message = await self.bot.send_audio(chat_id, file, **kwargs)
+                else:
+                    message = await self.bot.send_document(chat_id, file, **kwargs)
+            finally:
+                self._active -= 1
+        self.counters["uploads"] += 1
+        if long_caption:
+            message = await self.bot.send_message(chat_id, long_caption, parse_mode=None)
+        return message
+
+    def stats(self) -> Dict:
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "cache_bytes": self._cache_size,
+            **self.counters,
+        }
@@ -0,0 +1,208 @@
+# telegram_bot/rpc_client.py
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aio_pika
+
+from common import tracing
+from common.metrics import timed
+from common.sharding import partition_for
+
+
+# Пакетные запросы: тип -> поле payload со списком элементов
+BATCH_FIELDS = {"find_users": "tg_ids", "upsert_users": "users"}
+
+
+class RpcClient:
+    """
+    Долгоживущий RPC-клиент к bd_connector поверх RabbitMQ.
+
+    Одно соединение, один канал и одна эксклюзивная очередь ответов на процесс.
+    Каждый вызов регистрирует future по correlation_id; обработчик очереди
+    ответов завершает его сразу при получении ответа.
+
+    При partitions > 0 (шардированный bd_connector) запрос уходит в очередь
+    раздела {request_queue}.pNNN по tg_id; пакетные запросы делятся по
+    разделам и собираются обратно в исходном порядке, а запросы без tg_id
+    опрашивают все разделы.
+
+    Очереди запросов объявляются и на стороне клиента (с теми же параметрами,
+    что у bd_connector): запрос, отправленный до того, как bd_connector
+    поднял раздел, ждёт в очереди, а не отбрасывается брокером.
+
+    Тем же клиентом реплики telegram_bot пересылают друг другу работу по
+    разделам tg_id (request_queue="tg_work"); hop — имя шага в метриках.
+    """
+
+    def __init__(self, url: str, request_queue: str = "user_requests", timeout: float = 10.0,
+                 partitions: int = 0, hop: str = "bd_rpc") -> None:
+        self.url = url
+        self.request_queue = request_queue
+        self.timeout = timeout
+        self.partitions = partitions
+        self.hop = hop
+        self.reply_queue_name = f"reply_{uuid.uuid4()}"
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._connect_lock: Optional[asyncio.Lock] = None  # создаётся внутри цикла событий
+
+    async def connect(self) -> None:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._channel is not None:
+                return
+            self._connection = await aio_pika.connect_robust(self.url)
+            self._channel = await self._connection.channel()
+            # Очередь переобъявляется robust-каналом после переподключения с тем же именем
+            reply_queue = await self._channel.declare_queue(
+                self.reply_queue_name, exclusive=True, auto_delete=True
+            )
+            await reply_queue.consume(self._on_response, no_ack=True)
+            for queue in self.request_queues():
+                await self._channel.declare_queue(queue, durable=True)
+            logging.info(f"RPC-клиент подключен к RabbitMQ, очередь ответов {self.reply_queue_name}")
+
+    async def subscribe(self, exchange_name: str, handler: Callable[[Dict], Awaitable[None]]) -> None:
+        """Подписывает процесс на fanout-обменник событий (своя эксклюзивная очередь)."""
+        if self._channel is None:
+            await self.connect()
+        exchange = await self._channel.declare_exchange(
+            exchange_name, aio_pika.ExchangeType.FANOUT, durable=True
+        )
+        queue = await self._channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(exchange)
+
+        async def on_event(msg: aio_pika.abc.AbstractIncomingMessage) -> None:
+            try:
+                await handler(json.loads(msg.body))
+            except Exception as e:
+                logging.error(f"Ошибка обработки события {exchange_name}: {e}")
+
+        await queue.consume(on_event, no_ack=True)
+        logging.info(f"Подписка на события {exchange_name} оформлена")
+
+    async def close(self) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+        if self._connection is not None:
+            await self._connection.close()
+        self._connection = None
+        self._channel = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def _on_response(self, msg: aio_pika.abc.AbstractIncomingMessage) -> None:
+        future = self._pending.pop(msg.correlation_id, None)
+        if future is None or future.done():
+            logging.warning(f"Ответ без ожидающего запроса: correlation_id={msg.correlation_id}")
+            return
+        try:
+            future.set_result(json.loads(msg.body))
+        except ValueError as e:
+            future.set_exception(e)
+
+    def request_queues(self) -> List[str]:
+        if not self.partitions:
+            return [self.request_queue]
+        return [f"{self.request_queue}.p{partition:03d}" for partition in range(self.partitions)]
+
+    def queue_for(self, tg_id: Any) -> str:
+        if not self.partitions:
+            return self.request_queue
+        return f"{self.request_queue}.p{partition_for(tg_id, self.partitions):03d}"
+
+    async def call(self, request_type: str, payload: Dict, timeout: Optional[float] = None) -> Dict:
+        """
+        Отправляет запрос и ждёт ответ.
+        Бросает asyncio.TimeoutError по таймауту; отмена вызова снимает ожидание.
+        """
+        if not self.partitions:
+            return await self._call(self.request_queue, request_type, payload, timeout)
+        if request_type in BATCH_FIELDS:
+            return await self._call_split(request_type, payload, timeout)
+        if payload.get("tg_id") is not None:
+            return await self._call(self.queue_for(payload["tg_id"]), request_type, payload, timeout)
+        # Поиск не по tg_id (например, по amocrm_id): спрашиваем все разделы
+        responses = await asyncio.gather(*(
+            self._call(queue, request_type, payload, timeout) for queue in self.request_queues()
+        ))
+        for response in responses:
+            if response.get("result") is not None:
+                return response
+        return responses[0]
+
+    async def publish(self, request_type: str, payload: Dict) -> None:
+        """
+        Ставит запрос в очередь без ожидания ответа (payload с tg_id при partitions > 0).
+        Возвращается, когда брокер подтвердил приём сохраняемого сообщения.
+        """
+        if self._channel is None:
+            await self.connect()
+        with timed(self.hop, request_type):
+            await self._channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps({"type": request_type, "payload": payload}).encode(),
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    headers=tracing.inject(),
+                ),
+                routing_key=self.queue_for(payload.get("tg_id")),
+            )
+
+    async def _call_split(self, request_type: str, payload: Dict, timeout: Optional[float]) -> Dict:
+        field = BATCH_FIELDS[request_type]
+        items = payload.get(field) or []
+        groups: Dict[str, List[int]] = {}
+        for i, item in enumerate(items):
+            tg_id = item.get("tg_id") if isinstance(item, dict) else item
+            groups.setdefault(self.queue_for(tg_id), []).append(i)
+        queues = list(groups)
+        responses = await asyncio.gather(*(
+            self._call(queue, request_type, dict(payload, **{field: [items[i] for i in groups[queue]]}), timeout)
+            for queue in queues
+        ))
+        result: List[Any] = [None] * len(items)
+        for queue, response in zip(queues, responses):
+            if response.get("error"):
+                return response
+            for i, item_result in zip(groups[queue], response.get("result") or []):
+                result[i] = item_result
+        return {"result": result}
+
+    async def _call(self, queue: str, request_type: str, payload: Dict, timeout: Optional[float]) -> Dict:
+        if self._channel is None:
+            await self.connect()
+        correlation_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            message = {
+                "type": request_type,
+                "payload": payload,
+                "correlation_id": correlation_id,
+                "reply_to": self.reply_queue_name
+            }
+            # Круговой путь: публикация, очередь, обработка в bd_connector и ответ
+            with timed(self.hop, request_type):
+                await self._channel.default_exchange.publish(
+                    aio_pika.Message(
+                        body=json.dumps(message).encode(),
+                        correlation_id=correlation_id,
+                        reply_to=self.reply_queue_name,
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        headers=tracing.inject(),
+                    ),
+                    routing_key=queue
+                )
+                return await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            self._pending.pop(correlation_id, None)
@@ -0,0 +1,47 @@
+# telegram_bot/single_flight.py
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    Не более одного выполнения операции на ключ одновременно.
+    Остальные вызовы с тем же ключом ждут результат уже идущей операции.
+    Успешный (непустой) результат ещё linger секунд отдаётся опоздавшим,
+    которые начали проверку до завершения операции.
+    """
+
+    def __init__(self, linger: float = 0.0) -> None:
+        self.linger = linger
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Возвращает (результат, leader): leader=True у вызова, который выполнил операцию."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            # shield: отмена ожидающего не должна отменять чужую операцию
+            return await asyncio.shield(flight), False
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._flights.pop(key, None)
+            flight.set_exception(e)
+            flight.exception()  # помечаем как полученное, если ждущих нет
+            raise
+        flight.set_result(result)
+        if result and self.linger > 0:
+            asyncio.get_running_loop().call_later(self.linger, self._forget, key, flight)
+        else:
+            self._forget(key, flight)
+        return result, True
+
+    def _forget(self, key: str, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
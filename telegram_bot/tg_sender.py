@@ -0,0 +1,214 @@
+# telegram_bot/tg_sender.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from common import tracing
+
+ChatId = Union[int, str]
+
+
+class RateLimiter:
+    """Token bucket: не больше rate операций в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "text", "media", "future", "attempts", "trace")
+
+    def __init__(self, chat_id: ChatId, text: str, media: Optional[Dict], future: asyncio.Future) -> None:
+        self.chat_id = chat_id
+        self.text = text
+        self.media = media
+        self.future = future
+        self.attempts = 0
+        self.trace = tracing.current()  # отправляет воркер, контекст трассы — от /send_to_tg
+
+
+class _ChatState:
+    __slots__ = ("queue", "next_allowed", "scheduled")
+
+    def __init__(self) -> None:
+        self.queue: Deque[_Outgoing] = deque()
+        self.next_allowed = 0.0
+        self.scheduled = False
+
+
+class TelegramSender:
+    """
+    Очередь исходящих сообщений в Telegram через сессию aiogram-бота.
+
+    Ограничения: глобально global_rate сообщений в секунду и не чаще одного
+    сообщения в per_chat_interval секунд в один чат; внутри чата порядок
+    сохраняется. На 429 чат ставится на паузу retry_after и сообщение
+    повторяется. Чат с пустой очередью забывается только когда его пауза
+    истекла, поэтому интервал и retry_after действуют и на одиночные ответы.
+    send() возвращает результат доставки; неотправленные к close() сообщения
+    получают ошибку. Вложения отправляет media_relay в той же очереди чата,
+    поэтому они не обгоняют текст.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 30.0, per_chat_interval: float = 1.0,
+                 workers: int = 16, max_retries: int = 3, media_relay=None) -> None:
+        self.bot = bot
+        self.media_relay = media_relay
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self._limiter = RateLimiter(global_rate)
+        self._chats: Dict[ChatId, _ChatState] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._queued = 0
+        self._in_flight = 0
+        self.counters = {"sent": 0, "failed": 0, "retry_after": 0}
+
+    async def start(self) -> None:
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Очередь отправки в Telegram запущена: воркеров={self.workers}")
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Ожидающие send() не должны висеть до конца остановки процесса
+        for chat in self._chats.values():
+            for item in chat.queue:
+                self._resolve(item, {"success": False, "error": "sender closed"})
+        self._chats.clear()
+        self._queued = 0
+        self._ready = None
+
+    async def send(self, chat_id: ChatId, text: str, media: Optional[Dict] = None) -> Dict:
+        """Ставит сообщение в очередь и ждёт результат: {"success", "message_id" | "error"}."""
+        if self._ready is None:
+            await self.start()
+        item = _Outgoing(chat_id, text, media, asyncio.get_running_loop().create_future())
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatState()
+        chat.queue.append(item)
+        self._queued += 1
+        self._schedule(chat_id, chat)
+        return await item.future
+
+    def _schedule(self, chat_id: ChatId, chat: _ChatState) -> None:
+        """Отдаёт чат воркерам, когда для него наступит разрешённое время; воркер при этом не спит."""
+        if chat.scheduled or not chat.queue:
+            return
+        chat.scheduled = True
+        delay = chat.next_allowed - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            chat = self._chats[chat_id]
+            item = chat.queue[0]
+            await self._limiter.acquire()
+            self._in_flight += 1
+            try:
+                finished = await self._deliver(chat, item)
+            finally:
+                self._in_flight -= 1
+            if finished:
+                chat.queue.popleft()
+                self._queued -= 1
+            chat.scheduled = False
+            if chat.queue:
+                self._schedule(chat_id, chat)
+            else:
+                self._evict(chat_id)
+
+    def _evict(self, chat_id: ChatId) -> None:
+        """Удаляет простаивающий чат, когда его next_allowed прошёл; раньше — следующий send() ждал бы паузу."""
+        chat = self._chats.get(chat_id)
+        if chat is None or chat.queue or chat.scheduled:
+            return
+        delay = chat.next_allowed - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._evict, chat_id)
+        else:
+            del self._chats[chat_id]
+
+    async def _deliver(self, chat: _ChatState, item: _Outgoing) -> bool:
+        """Отправляет сообщение; False — повторить после паузы чата."""
+        item.attempts += 1
+        chat.next_allowed = time.monotonic() + self.per_chat_interval
+        try:
+            with tracing.activate(item.trace):
+                if item.media is not None:
+                    message = await self.media_relay.send(item.chat_id, item.media, caption=item.text)
+                else:
+                    message = await self.bot.send_message(item.chat_id, item.text, parse_mode=None)
+        except TelegramRetryAfter as e:
+            self.counters["retry_after"] += 1
+            chat.next_allowed = time.monotonic() + e.retry_after
+            logging.warning(f"Telegram 429 для chat_id={item.chat_id}: пауза {e.retry_after}с")
+            if item.attempts <= self.max_retries:
+                return False
+            return self._resolve(item, {"success": False, "error": str(e)})
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if item.attempts <= self.max_retries:
+                chat.next_allowed = time.monotonic() + min(30, 2 ** item.attempts)
+                logging.warning(f"Временная ошибка Telegram для chat_id={item.chat_id}: {e}, повтор")
+                return False
+            return self._resolve(item, {"success": False, "error": str(e)})
+        except TelegramAPIError as e:
+            logging.error(f"Telegram error для chat_id={item.chat_id}: {e}")
+            return self._resolve(item, {"success": False, "error": str(e)})
+        except Exception as e:
+            logging.error(f"Ошибка отправки в Telegram для chat_id={item.chat_id}: {e}")
+            return self._resolve(item, {"success": False, "error": str(e)})
+        return self._resolve(item, {"success": True, "message_id": message.message_id})
+
+    def _resolve(self, item: _Outgoing, result: Dict) -> bool:
+        self.counters["sent" if result["success"] else "failed"] += 1
+        if not item.future.done():
+            item.future.set_result(result)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self._queued,
+            "chats_waiting": len(self._chats),  # с очередью или ещё на паузе
+            "in_flight": self._in_flight,
+            **self.counters,
+        }
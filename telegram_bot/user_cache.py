@@ -0,0 +1,53 @@
+# telegram_bot/user_cache.py
+
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class UserCache:
+    """
+    LRU-кэш tg_id -> запись пользователя с TTL.
+
+    Отсутствие пользователя тоже кэшируется (value=None), но на более короткий
+    negative_ttl: новый пользователь появится в БД через несколько секунд.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 3600.0, negative_ttl: float = 5.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self.counters = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, tg_id: str) -> Tuple[bool, Optional[Dict]]:
+        """(найдено_в_кэше, запись); запись None при найденном — кэшированное «нет такого»."""
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            self.counters["misses"] += 1
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[tg_id]
+            self.counters["misses"] += 1
+            return False, None
+        self._entries.move_to_end(tg_id)
+        self.counters["hits" if value is not None else "negative_hits"] += 1
+        return True, value
+
+    def put(self, tg_id: str, value: Optional[Dict]) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[tg_id] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def invalidate(self, tg_id: str) -> None:
+        if self._entries.pop(tg_id, None) is not None:
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        lookups = self.counters["hits"] + self.counters["negative_hits"] + self.counters["misses"]
+        hit_ratio = (lookups - self.counters["misses"]) / lookups if lookups else 0.0
+        return {"size": len(self._entries), "hit_ratio": round(hit_ratio, 4), **self.counters}
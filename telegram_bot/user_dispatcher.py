@@ -0,0 +1,116 @@
+# telegram_bot/user_dispatcher.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+Job = Callable[[], Awaitable[None]]
+
+
+class UserDispatcher:
+    """
+    Очереди обработки по tg_id.
+
+    Сообщения одного пользователя обрабатываются строго по порядку
+    (один воркер на активного пользователя), разные пользователи — параллельно,
+    не более max_concurrency одновременно. Если в очередях накопилось больше
+    max_pending задач, submit() ждёт, пока они разгрузятся: так обратное
+    давление доходит до источника апдейтов.
+    """
+
+    def __init__(self, max_concurrency: int = 64, max_pending: int = 10000) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._queues: Dict[str, Deque[Tuple[float, Job]]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._capacity: Optional[asyncio.Event] = None
+        self._pending = 0
+        self._running = 0
+        self._max_wait = 0.0
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "backpressure_waits": 0}
+
+    def _ensure_started(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._capacity = asyncio.Event()
+            self._capacity.set()
+
+    async def submit(self, key: str, job: Job) -> None:
+        """Ставит задачу в очередь пользователя; возвращается, не дожидаясь её выполнения."""
+        self._ensure_started()
+        # Постановка в очередь синхронная: порядок фиксируется в момент вызова
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append((time.monotonic(), job))
+        self._pending += 1
+        self.counters["submitted"] += 1
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._worker(key, queue))
+
+        if self._pending > self.max_pending:
+            if self._capacity.is_set():
+                logging.warning(f"Очереди пользователей переполнены ({self._pending}), ждём разгрузки")
+                self._capacity.clear()
+            self.counters["backpressure_waits"] += 1
+            await self._capacity.wait()
+
+    async def _worker(self, key: str, queue: Deque[Tuple[float, Job]]) -> None:
+        try:
+            while queue:
+                enqueued_at, job = queue[0]
+                try:
+                    async with self._semaphore:
+                        self._max_wait = max(self._max_wait, time.monotonic() - enqueued_at)
+                        self._running += 1
+                        try:
+                            await job()
+                            self.counters["completed"] += 1
+                        except Exception as e:
+                            self.counters["failed"] += 1
+                            logging.error(f"Ошибка обработки апдейта tg_id={key}: {e}")
+                        finally:
+                            self._running -= 1
+                finally:
+                    # И при отмене: иначе pending растёт, и submit() ждёт разгрузки вечно
+                    queue.popleft()
+                    self._release(1)
+        finally:
+            del self._workers[key]
+            if self._queues.get(key) is queue:
+                del self._queues[key]
+            if queue:
+                logging.warning(f"Обработка tg_id={key} прервана отменой, не выполнено апдейтов: {len(queue)}")
+                self._release(len(queue))
+                queue.clear()
+
+    def _release(self, count: int) -> None:
+        self._pending -= count
+        if self._pending <= self.max_pending:
+            self._capacity.set()
+
+    async def drain(self) -> None:
+        """Дожидается обработки всего, что уже поставлено в очереди."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    def stats(self, reset_max_wait: bool = False) -> Dict:
+        """
+        Метрики обратного давления. max_wait_s — наибольшее ожидание в очереди
+        с прошлого сброса; сбрасывает его только сборщик метрик (reset_max_wait),
+        чтобы другие читатели не забирали у него пик.
+        """
+        max_wait = self._max_wait
+        if reset_max_wait:
+            self._max_wait = 0.0
+        return {
+            "active_users": len(self._workers),
+            "running": self._running,
+            "pending": self._pending,
+            "max_user_queue": max((len(q) for q in self._queues.values()), default=0),
+            "max_wait_s": round(max_wait, 3),
+            **self.counters,
+        }
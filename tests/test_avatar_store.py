@@ -0,0 +1,93 @@
+# tests/test_avatar_store.py
+"""Аватары telegram_bot/avatar_store.py: смена аватара, общий каталог, частота проверок."""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_bot"))
+
+from avatar_store import AvatarStore  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.photos = {}  # user_id -> file_unique_id
+        self.calls = 0
+
+    async def get_user_profile_photos(self, user_id, limit=1):
+        self.calls += 1
+        unique_id = self.photos.get(user_id)
+        if unique_id is None:
+            return SimpleNamespace(total_count=0, photos=[])
+        return SimpleNamespace(total_count=1, photos=[[SimpleNamespace(file_id=f"id-{unique_id}", file_unique_id=unique_id)]])
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=f"photos/{file_id}.jpg")
+
+    async def download_file(self, file_path, destination):
+        with open(destination, "wb") as f:
+            f.write(file_path.encode())
+
+
+def files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".jpg"))
+
+
+def test_avatar_change_replaces_and_collects_old_file(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        store = AvatarStore(str(tmp_path))
+        await store.open()
+        bot.photos[1] = "A"
+        assert await store.fetch(bot, 1) == "A.jpg"
+        bot.photos[1] = "B"
+        assert await store.fetch(bot, 1) == "B.jpg"
+        assert store.current("1") == "B.jpg"
+        assert await store.collect_garbage("1") == 1
+        return store
+
+    store = asyncio.run(scenario())
+    assert files(tmp_path) == ["B.jpg"]
+    assert store.counters["changed"] == 1
+
+
+def test_second_writer_keeps_files_it_references(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        first, second = AvatarStore(str(tmp_path)), AvatarStore(str(tmp_path))
+        bot.photos[1] = bot.photos[2] = "A"
+        await first.fetch(bot, 1)
+        await second.fetch(bot, 2)  # то же изображение, без повторной загрузки
+        bot.photos[1] = "B"
+        await first.fetch(bot, 1)
+        await first.collect_garbage("1")  # first не знает о пользователе 2, но индекс на диске знает
+
+    asyncio.run(scenario())
+    assert files(tmp_path) == ["A.jpg", "B.jpg"]
+    assert AvatarStore(str(tmp_path)).current("2") == "A.jpg"
+
+
+def test_refresh_is_rate_limited_per_user(tmp_path):
+    async def scenario():
+        bot = FakeBot()
+        bot.photos[1] = "A"
+        store = AvatarStore(str(tmp_path), refresh_interval=3600)
+        ready = []
+
+        async def on_ready(filename):
+            ready.append(filename)
+
+        for _ in range(3):
+            store.refresh(bot, 1, on_ready)
+            await asyncio.sleep(0.05)
+        store.refresh_interval = 0
+        bot.photos[1] = "B"
+        store.refresh(bot, 1, on_ready)
+        await asyncio.sleep(0.05)
+        return bot.calls, ready
+
+    calls, ready = asyncio.run(scenario())
+    assert calls == 2
+    assert ready == ["A.jpg", "B.jpg"]
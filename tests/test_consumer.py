@@ -0,0 +1,90 @@
+# tests/test_consumer.py
+"""Порядок запросов по tg_id в common/consumer.py, включая пакетные; остановка потребителя."""
+
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common.consumer import RequestConsumer  # noqa: E402
+
+
+def batch_keys(request_type, payload):
+    if request_type == "upsert_users":
+        return [item.get("tg_id") for item in payload["users"]]
+    return [payload.get("tg_id")]
+
+
+class FakeMessage(SimpleNamespace):
+    acked = False
+
+    async def ack(self, multiple=False):
+        self.acked = True
+
+
+def message(tag, request_type, payload):
+    body = json.dumps({"type": request_type, "payload": payload}).encode()
+    return FakeMessage(delivery_tag=tag, body=body, headers={}, reply_to=None, correlation_id=None)
+
+
+def test_batch_and_single_requests_for_one_tg_id_do_not_interleave():
+    users = {"1": {"name": "old", "avatar": None}}
+    events = []
+
+    async def handler(request_type, payload):
+        if request_type == "upsert_users":
+            # чтение — пауза (запись журнала) — запись слитой версии
+            merged = {**users["1"], **payload["users"][1]}
+            events.append("batch read")
+            await asyncio.sleep(0.05)
+            users["1"] = merged
+            events.append("batch write")
+        else:
+            events.append(f"single write {payload['tg_id']}")
+            if payload["tg_id"] == "1":
+                users["1"] = {**users["1"], "avatar": payload["avatar"]}
+        return None
+
+    async def scenario():
+        consumer = RequestConsumer(None, "q", handler, ordering_keys=batch_keys)
+        consumer._semaphore = asyncio.Semaphore(8)
+        await asyncio.gather(
+            consumer._on_message(message(1, "upsert_users", {"users": [{"tg_id": "2"}, {"tg_id": "1", "name": "new"}]})),
+            consumer._on_message(message(2, "create_user", {"tg_id": "1", "avatar": "a.jpg"})),
+            consumer._on_message(message(3, "create_user", {"tg_id": "3", "avatar": "b.jpg"})),
+        )
+        assert consumer._ordering.active_keys == 0
+
+    asyncio.run(scenario())
+    # tg_id=3 не ждёт пакет; tg_id=1 — ждёт, и обновление аватара не теряется
+    assert events[0] == "batch read" and events[1] == "single write 3"
+    assert events[2:] == ["batch write", "single write 1"]
+    assert users["1"] == {"name": "new", "avatar": "a.jpg", "tg_id": "1"}
+
+
+def test_stop_gives_up_on_stuck_requests_without_ack():
+    async def handler(request_type, payload):
+        if payload["tg_id"] == "stuck":
+            await asyncio.Future()
+        return None
+
+    async def scenario():
+        consumer = RequestConsumer(None, "q", handler, drain_timeout=0.2)
+        consumer._semaphore = asyncio.Semaphore(8)
+        done = message(1, "create_user", {"tg_id": "1"})
+        stuck = message(2, "create_user", {"tg_id": "stuck"})
+        # aio_pika вызывает обработчик в отдельной задаче на каждую доставку
+        tasks = [asyncio.create_task(consumer._on_message(m)) for m in (done, stuck)]
+        await asyncio.sleep(0.05)
+
+        started = asyncio.get_running_loop().time()
+        await consumer.stop()
+        assert asyncio.get_running_loop().time() - started < 1
+        assert done.acked and not stuck.acked  # без ack брокер вернёт его в очередь
+        assert tasks[1].cancelled()
+        assert consumer._ordering.active_keys == 0 and consumer.in_flight == 0
+
+    asyncio.run(scenario())
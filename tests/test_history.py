@@ -0,0 +1,223 @@
+# tests/test_history.py
+"""Журнал истории telegram_bot/history.py: смена сегментов, срок хранения, компакция, чтение, восстановление."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_bot"))
+
+from history import ENTRY, ConversationLog  # noqa: E402
+
+
+def open_log(directory, **options) -> ConversationLog:
+    log = ConversationLog(str(directory), **options)
+    log.open()
+    return log
+
+
+def texts(records):
+    return [record["text"] for record in records]
+
+
+def test_tail_and_range(tmp_path):
+    log = open_log(tmp_path)
+    for i in range(10):
+        log.append("a", "in", f"a{i}", ts=1000 + i)
+        log.append("b", "out", f"b{i}", ts=1000 + i)
+    assert texts(log.tail("a", 3)) == ["a7", "a8", "a9"]
+    assert texts(log.tail("b", 100)) == [f"b{i}" for i in range(10)]
+    assert log.tail("missing") == []
+    assert texts(log.range("a", since=1002, until=1004)) == ["a2", "a3", "a4"]
+    assert texts(log.range("a", since=1002, limit=2)) == ["a8", "a9"]
+    assert log.tail("a", 1)[0]["direction"] == "in"
+    log.close()
+
+
+def test_rollover_keeps_chains_across_segments_and_reopen(tmp_path):
+    log = open_log(tmp_path, segment_bytes=500)
+    for i in range(60):
+        log.append(f"c{i % 3}", "in", f"m{i}", ts=1000 + i)
+    assert log.stats()["segments"] > 3
+    assert log.counters["segments_rolled"] == log.stats()["segments"] - 1
+    expected = [f"m{i}" for i in range(60) if i % 3 == 1]
+    assert texts(log.tail("c1", 100)) == expected
+    log.close()
+
+    log = open_log(tmp_path, segment_bytes=500)
+    assert texts(log.tail("c1", 100)) == expected
+    log.append("c1", "out", "after reopen", ts=2000)
+    assert texts(log.tail("c1", 2)) == [expected[-1], "after reopen"]
+    log.close()
+
+
+def test_retention_drops_old_sealed_segments_only(tmp_path):
+    log = open_log(tmp_path, segment_bytes=300, retention=100)
+    for i in range(20):
+        log.append("old", "in", f"old{i}", ts=1000 + i)
+    for i in range(20):
+        log.append("new", "in", f"new{i}", ts=5000 + i)
+    segments = log.stats()["segments"]
+
+    removed = log.apply_retention(now=5050)
+    assert removed > 0
+    assert log.stats()["segments"] == segments - removed
+    assert log.tail("old", 100) == []  # цепочка обрывается на удалённом сегменте
+    assert len(log.tail("new", 100)) >= 15
+
+    # Активный сегмент не удаляется, даже если весь устарел
+    log.apply_retention(now=10 ** 9)
+    assert log.stats()["segments"] == 1
+    assert texts(log.tail("new", 1)) == ["new19"]
+    log.close()
+
+
+def test_compaction_removes_deleted_conversation(tmp_path):
+    log = open_log(tmp_path, segment_bytes=400)
+    for i in range(30):
+        log.append("gone", "in", f"secret{i}", ts=1000 + i)
+        log.append("kept", "in", f"kept{i}", ts=1000 + i)
+    assert log.delete_conversation("gone")
+    assert not log.delete_conversation("gone")
+    assert log.tail("gone") == []
+    log.append("kept", "in", "tail", ts=3000)  # удаление уже в закрытом сегменте
+    log.append("gone", "in", "fresh", ts=3001)
+
+    size_before = log.stats()["bytes"]
+    asyncio.run(log.maintain())
+    assert log.counters["segments_compacted"] > 0
+    assert log.counters["bytes_reclaimed"] > 0
+    assert log.stats()["bytes"] == size_before - log.counters["bytes_reclaimed"]
+    assert texts(log.tail("kept", 100)) == [f"kept{i}" for i in range(30)] + ["tail"]
+    assert texts(log.tail("gone", 100)) == ["fresh"]
+    log.close()
+
+    for name in os.listdir(tmp_path):
+        if name.endswith(".log"):
+            assert b"secret" not in (tmp_path / name).read_bytes()
+
+    log = open_log(tmp_path, segment_bytes=400)
+    assert texts(log.tail("gone", 100)) == ["fresh"]
+    assert len(log.tail("kept", 100)) == 31
+    log.close()
+
+
+def test_interrupted_compaction_is_finished_or_discarded(tmp_path):
+    log = open_log(tmp_path, segment_bytes=200)
+    for i in range(20):
+        log.append("a", "in", f"a{i}", ts=1000 + i)
+    log.close()
+    sealed = sorted(p for p in os.listdir(tmp_path) if p.endswith(".log"))[0]
+    base = os.path.join(tmp_path, sealed[:-4])
+    # Сбой до замены .log: обе копии остаются и отбрасываются
+    for suffix in (".log.compact", ".idx.compact"):
+        with open(base + suffix, "wb") as f:
+            f.write(b"junk")
+    log = open_log(tmp_path, segment_bytes=200)
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".compact")]
+    assert texts(log.tail("a", 100)) == [f"a{i}" for i in range(20)]
+    log.close()
+
+    # Сбой после замены .log: остаётся только .idx.compact, его нужно установить
+    os.replace(base + ".idx", base + ".idx.compact")
+    log = open_log(tmp_path, segment_bytes=200)
+    assert os.path.exists(base + ".idx") and not os.path.exists(base + ".idx.compact")
+    assert texts(log.tail("a", 100)) == [f"a{i}" for i in range(20)]
+    log.close()
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    log = open_log(tmp_path)
+    for i in range(5):
+        log.append("a", "in", f"a{i}", ts=1000 + i)
+    log.close()
+    log_path = os.path.join(tmp_path, f"{0:020d}.log")
+    index_path = os.path.join(tmp_path, f"{0:020d}.idx")
+    # Сбой между записью тела и индекса; затем — недописанная запись индекса
+    with open(log_path, "ab") as f:
+        f.write(b'{"conversation": "a", "te')
+    with open(index_path, "ab") as f:
+        f.write(b"\x01" * (ENTRY.size // 2))
+
+    log = open_log(tmp_path)
+    assert texts(log.tail("a", 100)) == [f"a{i}" for i in range(5)]
+    assert os.path.getsize(index_path) == 5 * ENTRY.size
+    log.append("a", "in", "a5", ts=1005)
+    log.close()
+    log = open_log(tmp_path)
+    assert texts(log.tail("a", 2)) == ["a4", "a5"]
+    log.close()
+
+
+def test_close_waits_for_cancelled_compaction(tmp_path, monkeypatch):
+    log = open_log(tmp_path, segment_bytes=400)
+    for i in range(30):
+        log.append("gone", "in", f"secret{i}", ts=1000 + i)
+        log.append("kept", "in", f"kept{i}", ts=1000 + i)
+    log.delete_conversation("gone")
+    log.append("kept", "in", "tail", ts=3000)
+
+    rewrite = ConversationLog._rewrite
+    results = []
+
+    def slow_rewrite(segment, deleted):
+        time.sleep(0.1)  # сегмент читается, пока цикл уже закрывает журнал
+        try:
+            results.append(rewrite(segment, deleted))
+        except Exception as e:
+            results.append(e)
+            raise
+
+    monkeypatch.setattr(ConversationLog, "_rewrite", staticmethod(slow_rewrite))
+
+    async def scenario():
+        task = asyncio.create_task(log.maintain())
+        await asyncio.sleep(0.02)
+        task.cancel()
+        log.close()
+
+    asyncio.run(scenario())
+    assert results and not any(isinstance(r, Exception) for r in results)
+    log = open_log(tmp_path, segment_bytes=400)
+    assert len(log.tail("kept", 100)) == 31
+    log.close()
+
+
+def test_log_closed_during_compaction_stays_closed(tmp_path, monkeypatch):
+    log = open_log(tmp_path, segment_bytes=400)
+    for i in range(30):
+        log.append("gone", "in", f"secret{i}", ts=1000 + i)
+        log.append("kept", "in", f"kept{i}", ts=1000 + i)
+    log.delete_conversation("gone")
+    segments = list(log._segments)
+
+    rewrite = ConversationLog._rewrite
+
+    def slow_rewrite(segment, deleted):
+        time.sleep(0.1)
+        return rewrite(segment, deleted)
+
+    monkeypatch.setattr(ConversationLog, "_rewrite", staticmethod(slow_rewrite))
+
+    async def scenario():
+        task = asyncio.create_task(log.maintain())
+        await asyncio.sleep(0.02)
+        log.close()  # раздел отдан другой реплике, обслуживание не отменялось
+        await task
+
+    asyncio.run(scenario())
+    assert all(segment.log_fd is None for segment in segments)
+    assert log.counters["segments_compacted"] == 0
+
+
+def test_directory_is_held_by_one_log(tmp_path):
+    first = open_log(tmp_path)
+    second = ConversationLog(str(tmp_path))
+    with pytest.raises(BlockingIOError):
+        second.open(blocking=False)
+    first.close()
+    second.open(blocking=False)
+    second.close()
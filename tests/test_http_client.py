@@ -0,0 +1,90 @@
+# tests/test_http_client.py
+"""Автомат отключения и учёт ошибок common/http_client.py."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common.http_client import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, Upstream  # noqa: E402
+
+
+def test_late_request_does_not_release_half_open_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    late = breaker.before_request()  # начат, пока автомат closed
+    breaker.record(False, breaker.before_request())
+    assert breaker.state == OPEN
+
+    probe = breaker.before_request()
+    assert probe and breaker.state == HALF_OPEN
+    breaker.record(True, late)  # опоздавший ответ не решает и не освобождает пробу
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+
+    breaker.record(True, probe)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record(False, breaker.before_request())
+    breaker.record(False, breaker.before_request())
+    assert breaker.state == OPEN and breaker.opens == 2
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_caller_exception_is_not_an_upstream_failure():
+    async def ok(request):
+        return web.json_response({"ok": True})
+
+    async def scenario():
+        runner, url = await serve(ok)
+        client = Upstream("test", url, failure_threshold=1)
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                async with client.request("GET", "/") as response:
+                    await response.json()
+                    raise ValueError("caller bug")
+        await client.close()
+        await runner.cleanup()
+        return client
+
+    client = asyncio.run(scenario())
+    assert client.breaker.state == CLOSED
+    assert client.counters["failures"] == 0
+
+
+def test_timeouts_can_be_excluded_from_breaker():
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.json_response({"ok": True})
+
+    async def scenario(count_timeouts):
+        runner, url = await serve(slow)
+        client = Upstream("test", url, timeout=0.1, failure_threshold=1, count_timeouts=count_timeouts)
+        with pytest.raises(asyncio.TimeoutError):
+            async with client.request("GET", "/"):
+                pass
+        await client.close()
+        await runner.cleanup()
+        return client
+
+    tolerant = asyncio.run(scenario(False))
+    assert tolerant.breaker.state == CLOSED and tolerant.counters["timeouts"] == 1
+    strict = asyncio.run(scenario(True))
+    assert strict.breaker.state == OPEN
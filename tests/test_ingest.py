@@ -0,0 +1,73 @@
+# tests/test_ingest.py
+"""Очередь вебхуков amo_get/ingest.py: порядок ответов внутри чата при повторах."""
+
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "amo_get"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ingest import WebhookQueue  # noqa: E402
+
+
+class FakeMessage(SimpleNamespace):
+    async def ack(self, multiple=False):
+        self.acked = True
+
+    async def nack(self, requeue=True):
+        self.acked = False
+
+
+class FakeExchange:
+    """Запоминает публикации по очередям — вместо брокера."""
+
+    def __init__(self):
+        self.queues = {}
+
+    async def publish(self, message, routing_key):
+        incoming = FakeMessage(body=message.body, message_id=message.message_id, headers=message.headers)
+        self.queues.setdefault(routing_key, []).append(incoming)
+
+    def drain(self, name):
+        return self.queues.pop(name, [])
+
+
+def new_message(text, tg_id="1"):
+    body = json.dumps({"tg_id": tg_id, "text": text}).encode()
+    return FakeMessage(body=body, message_id=text, headers={})
+
+
+def test_replies_of_one_chat_keep_order_across_retries():
+    delivered = []
+    failures = {"a": 2}
+
+    async def forwarder(payload):
+        if failures.get(payload["text"], 0):
+            failures[payload["text"]] -= 1
+            return False
+        delivered.append(payload["text"])
+        return True
+
+    async def scenario():
+        queue = WebhookQueue("amqp://unused", forwarder, max_attempts=5, max_backoff=4)
+        assert queue.delays == [1, 2, 4, 4]
+        exchange = FakeExchange()
+        queue._channel = SimpleNamespace(default_exchange=exchange)
+        queue._semaphore = asyncio.Semaphore(16)
+
+        # Воркеры обрабатывают доставки параллельно
+        await asyncio.gather(*(queue._on_message(new_message(t)) for t in ("a", "b", "c")),
+                             queue._on_message(new_message("x", tg_id="2")))
+        assert delivered == ["x"]  # другой чат не ждёт
+
+        for name in ("amo_incoming.retry.0", "amo_incoming.retry.1", "amo_incoming.retry.1"):
+            for message in exchange.drain(name):
+                await queue._on_message(message)
+        assert delivered == ["x", "a", "b", "c"]
+        assert queue.counters["retried"] == 2 and queue.counters["held_back"] == 4
+        assert queue._held == {} and queue._tails == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+# tests/test_outbox.py
+"""Outbox amo_send/outbox.py: порядок внутри чата при повторах, отклонённые сообщения."""
+
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "amo_send"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from outbox import Outbox, PermanentFailure  # noqa: E402
+
+
+class FakeMessage(SimpleNamespace):
+    async def ack(self, multiple=False):
+        self.acked = True
+
+    async def nack(self, requeue=True):
+        self.acked = False
+
+
+class FakeExchange:
+    """Запоминает публикации по очередям — вместо брокера."""
+
+    def __init__(self):
+        self.queues = {}
+
+    async def publish(self, message, routing_key):
+        incoming = FakeMessage(body=message.body, message_id=message.message_id, headers=message.headers)
+        self.queues.setdefault(routing_key, []).append(incoming)
+
+    def drain(self, name):
+        return self.queues.pop(name, [])
+
+
+def new_message(text, conversation="conv-1", message_id=None):
+    body = json.dumps({"amocrm_id": conversation, "tg_id": "1", "text": text}).encode()
+    return FakeMessage(body=body, message_id=message_id or text, headers={})
+
+
+def outbox_with(sender):
+    outbox = Outbox("amqp://unused", sender, delays=[5, 30])
+    exchange = FakeExchange()
+    outbox._channel = SimpleNamespace(default_exchange=exchange)
+    return outbox, exchange
+
+
+def test_later_messages_wait_behind_a_retried_one():
+    delivered = []
+    failures = {"a": 2}
+
+    async def sender(payload):
+        if failures.get(payload["text"], 0):
+            failures[payload["text"]] -= 1
+            return False
+        delivered.append(payload["text"])
+        return True
+
+    async def scenario():
+        outbox, exchange = outbox_with(sender)
+        await outbox._on_message(new_message("a"))
+        await outbox._on_message(new_message("b"))
+        await outbox._on_message(new_message("x", conversation="conv-2"))
+        assert delivered == ["x"]  # другой чат не ждёт
+
+        # Истёк TTL: retry-очереди по порядку возвращаются в основную
+        for name in ("amo_outbox.retry.0", "amo_outbox.retry.1", "amo_outbox.retry.1"):
+            for message in exchange.drain(name):
+                await outbox._on_message(message)
+        assert delivered == ["x", "a", "b"]
+        assert outbox.counters["held_back"] == 2
+        assert outbox._held == {}
+        # Удержание не тратит попытки сообщения b
+        assert outbox.counters["retried"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_permanent_failure_is_parked_at_once_and_releases_the_chat():
+    delivered = []
+
+    async def sender(payload):
+        if payload["text"] == "bad":
+            raise PermanentFailure("amoCRM ответил 400")
+        delivered.append(payload["text"])
+        return True
+
+    async def scenario():
+        outbox, exchange = outbox_with(sender)
+        await outbox._on_message(new_message("bad"))
+        await outbox._on_message(new_message("good"))
+        parked = exchange.drain("amo_outbox.parked")
+        assert [m.message_id for m in parked] == ["bad"]
+        assert parked[0].headers["x-attempt"] == 1
+        assert delivered == ["good"]
+        assert outbox.counters["parked"] == 1 and outbox.counters["retried"] == 0
+
+    asyncio.run(scenario())
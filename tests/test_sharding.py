@@ -0,0 +1,77 @@
+# tests/test_sharding.py
+"""Распределение разделов common/sharding.py: отпускание не задерживает heartbeat, поздний захват."""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common.sharding import ShardManager, rendezvous_owner  # noqa: E402
+
+
+def test_slow_release_runs_outside_rebalance():
+    released = asyncio.Event()
+    stopped = []
+
+    async def start_partition(partition):
+        return f"handle-{partition}"
+
+    async def stop_partition(partition, handle):
+        await released.wait()  # потребитель дорабатывает начатые запросы
+        stopped.append(partition)
+
+    async def scenario():
+        shards = ShardManager(None, 8, "a", start_partition, stop_partition)
+        await shards._rebalance()
+        await asyncio.gather(*shards._acquiring.values())
+        assert sorted(shards._owned) == list(range(8))
+
+        # Появилась вторая реплика: часть разделов переезжает к ней
+        shards._peers["b"] = time.monotonic()
+        moving = [p for p in range(8) if rendezvous_owner(p, ["a", "b"]) == "b"]
+        await asyncio.wait_for(shards._rebalance(), 1)
+        assert sorted(shards.stats()["releasing"]) == moving
+        assert not set(moving) & set(shards._owned)
+
+        released.set()
+        await asyncio.sleep(0)
+        await asyncio.gather(*shards._releasing.values())
+        assert sorted(stopped) == moving
+        assert shards.stats()["releasing"] == []
+
+    asyncio.run(scenario())
+
+
+def test_partition_started_after_it_moved_away_is_released():
+    opened = asyncio.Event()
+    proceed = asyncio.Event()
+    stopped = []
+
+    async def start_partition(partition):
+        opened.set()
+        await proceed.wait()  # открытие хранилища раздела
+        return f"handle-{partition}"
+
+    async def stop_partition(partition, handle):
+        stopped.append(partition)
+
+    async def scenario():
+        shards = ShardManager(None, 1, "a", start_partition, stop_partition)
+        await shards._rebalance()
+        await opened.wait()
+
+        # Пока раздел открывается, появляется реплика, которой он принадлежит
+        peer = next(name for name in (f"r{i}" for i in range(100)) if rendezvous_owner(0, ["a", name]) == name)
+        shards._peers[peer] = time.monotonic()
+        await shards._rebalance()
+        proceed.set()
+        await asyncio.gather(*shards._acquiring.values())
+        await asyncio.gather(*shards._releasing.values())
+        assert shards._owned == {} and stopped == [0]
+        # Повторный пересчёт без изменения состава ничего не меняет
+        await shards._rebalance()
+        assert shards.stats()["acquiring"] == [] and shards.stats()["releasing"] == []
+
+    asyncio.run(scenario())
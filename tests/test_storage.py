@@ -0,0 +1,140 @@
+# tests/test_storage.py
+"""Хранилище пользователей bd_connector/storage.py: восстановление после сбоя, откат пачки, компакция."""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bd_connector"))
+
+import storage  # noqa: E402
+from storage import UserStore  # noqa: E402
+
+
+def user(tg_id: str, amocrm_id: str = None) -> dict:
+    return {"tg_id": tg_id, "amocrm_id": amocrm_id or f"amo-{tg_id}", "name": "User"}
+
+
+def record(tg_id: str, **fields) -> bytes:
+    return (json.dumps({"op": "put", "key": tg_id, "value": user(tg_id, **fields)}, ensure_ascii=False) + "\n").encode()
+
+
+async def open_store(path, **options) -> UserStore:
+    store = UserStore(path, fsync_interval=0, **options)
+    store.open()
+    await store.start()
+    return store
+
+
+def reopen(path) -> UserStore:
+    store = UserStore(path)
+    store.open()
+    return store
+
+
+def test_put_survives_reopen(tmp_path):
+    path = tmp_path / "users.json"
+
+    async def scenario():
+        store = await open_store(path)
+        await store.put("1", user("1"))
+        await store.put_many([("2", user("2")), ("1", user("1", amocrm_id="amo-new"))])
+        await store.close()
+
+    asyncio.run(scenario())
+    store = reopen(path)
+    assert store.get("1")["amocrm_id"] == "amo-new"
+    assert store.get_by_amocrm_id("amo-2")["tg_id"] == "2"
+    assert store.get_by_amocrm_id("amo-1") is None
+    assert len(store) == 2
+
+
+def test_crash_recovery_replays_log_and_truncates_torn_tail(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"1": user("1")}))
+    with open(tmp_path / "users.log", "wb") as f:
+        f.write(record("2") + record("3") + record("4")[:20])  # сбой посреди последней записи
+
+    store = reopen(path)
+    assert sorted(store._users) == ["1", "2", "3"]
+    assert os.path.getsize(tmp_path / "users.log") == 0  # журнал свёрнут в снимок
+    assert sorted(json.loads(path.read_text())) == ["1", "2", "3"]
+
+
+def test_corrupt_interior_line_does_not_cut_off_later_records(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text("{}")
+    with open(tmp_path / "users.log", "wb") as f:
+        f.write(record("1"))
+        f.write(b"garbage\n")
+        f.write(record("2")[:15] + record("3"))  # оборванный фрагмент приклеился к следующей записи
+        f.write(record("4"))
+
+    store = reopen(path)
+    assert sorted(store._users) == ["1", "3", "4"]
+
+
+def test_interrupted_compaction_is_replayed_in_order(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"1": user("1")}))
+    with open(tmp_path / "users.log.compacting", "wb") as f:
+        f.write(record("2") + record("1", amocrm_id="amo-old"))
+    with open(tmp_path / "users.log", "wb") as f:
+        f.write(record("1", amocrm_id="amo-latest"))
+
+    store = reopen(path)
+    assert store.get("1")["amocrm_id"] == "amo-latest"
+    assert store.get("2") is not None
+    assert not (tmp_path / "users.log.compacting").exists()
+
+
+def test_failed_write_is_rolled_back(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    real_fsync = os.fsync
+    failures = [OSError(5, "Input/output error")]
+
+    def flaky_fsync(fd):
+        if failures:
+            raise failures.pop()
+        real_fsync(fd)
+
+    async def scenario():
+        store = await open_store(path)
+        await store.put("1", user("1"))
+        monkeypatch.setattr(storage.os, "fsync", flaky_fsync)
+        try:
+            await store.put("2", user("2"))
+        except OSError:
+            pass
+        else:
+            raise AssertionError("put() должен был получить ошибку fsync")
+        assert store.get("2") is None
+        await store.put("3", user("3"))
+        await store.close()
+
+    asyncio.run(scenario())
+    log_lines = (tmp_path / "users.log").read_bytes().splitlines()
+    assert [json.loads(line)["key"] for line in log_lines] == ["1", "3"]
+    store = reopen(path)
+    assert sorted(store._users) == ["1", "3"]
+
+
+def test_compaction_folds_log_into_snapshot(tmp_path):
+    path = tmp_path / "users.json"
+
+    async def scenario():
+        store = await open_store(path, compact_threshold=5)
+        for i in range(12):
+            await store.put(str(i), user(str(i)))
+        while store._compaction_task is not None:
+            await asyncio.sleep(0.01)
+        await store.put("extra", user("extra"))
+        await store.close()
+
+    asyncio.run(scenario())
+    assert len(json.loads(path.read_text())) >= 10
+    assert not (tmp_path / "users.log.compacting").exists()
+    assert len((tmp_path / "users.log").read_bytes().splitlines()) < 5
+    store = reopen(path)
+    assert len(store) == 13
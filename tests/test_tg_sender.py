@@ -0,0 +1,83 @@
+# tests/test_tg_sender.py
+"""Темп отправки telegram_bot/tg_sender.py в один чат; остановка очереди."""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_bot"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+
+from tg_sender import TelegramSender  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self, retry_after: int = 0) -> None:
+        self.sent = []  # (chat_id, время отправки)
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", retry_after)
+        self.sent.append((chat_id, time.monotonic()))
+
+        class Message:
+            message_id = len(self.sent)
+        return Message()
+
+
+def gaps(sent):
+    return [b[1] - a[1] for a, b in zip(sent, sent[1:])]
+
+
+def test_single_replies_to_one_chat_are_paced():
+    async def scenario():
+        bot = FakeBot()
+        sender = TelegramSender(bot, global_rate=1000, per_chat_interval=0.2, workers=4)
+        await sender.start()
+        for i in range(3):
+            # Каждый ответ ждёт своей доставки: очередь чата между ними пуста
+            assert (await sender.send(1, f"m{i}"))["success"]
+        await sender.send(2, "other chat")
+        await sender.close()
+        return bot.sent
+
+    sent = asyncio.run(scenario())
+    assert all(gap >= 0.19 for gap in gaps([s for s in sent if s[0] == 1]))
+    assert sent[-1][1] - sent[-2][1] < 0.1  # другой чат не ждёт
+
+
+def test_retry_after_pause_outlives_drained_queue():
+    async def scenario():
+        bot = FakeBot(retry_after=1)
+        sender = TelegramSender(bot, global_rate=1000, per_chat_interval=0.01, workers=2, max_retries=0)
+        await sender.start()
+        started = time.monotonic()
+        assert not (await sender.send(1, "first"))["success"]  # 429 без повтора: очередь чата пуста
+        assert (await sender.send(1, "second"))["success"]
+        await sender.close()
+        return started, bot.sent
+
+    started, sent = asyncio.run(scenario())
+    assert len(sent) == 1
+    assert sent[0][1] - started >= 0.99
+
+
+def test_close_fails_queued_sends():
+    async def scenario():
+        bot = FakeBot()
+        sender = TelegramSender(bot, global_rate=1000, per_chat_interval=10, workers=2)
+        await sender.start()
+        pending = [asyncio.create_task(sender.send(1, f"m{i}")) for i in range(3)]
+        await asyncio.sleep(0.05)  # первое ушло, остальные ждут паузу чата
+        await sender.close()
+        return await asyncio.wait_for(asyncio.gather(*pending), 1)
+
+    results = asyncio.run(scenario())
+    assert results[0]["success"]
+    assert results[1:] == [{"success": False, "error": "sender closed"}] * 2
@@ -0,0 +1,53 @@
+# tests/test_user_db.py
+"""Запросы bd_connector/user_db.py: хранилище раздела, некорректный пакет, tg_id числом."""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bd_connector"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import user_db  # noqa: E402
+from storage import UserStore  # noqa: E402
+
+
+def test_empty_partition_store_is_used_instead_of_the_shared_one(tmp_path):
+    async def scenario():
+        store = UserStore(tmp_path / "users.p000.json", fsync_interval=0)
+        store.open()
+        await store.start()
+        assert len(store) == 0  # пустое хранилище ложно в булевом контексте
+        created = await user_db.handle_request("create_user", {"tg_id": "42", "amocrm_id": "amo-42"}, store)
+        assert created == {"result": {"success": True}}
+        assert store.get("42")["amocrm_id"] == "amo-42"
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_batch_that_is_not_a_list_gets_an_error_reply(tmp_path):
+    async def scenario():
+        store = UserStore(tmp_path / "users.json")
+        store.open()
+        for request_type, field in user_db.BATCH_REQUESTS.items():
+            response = await user_db.handle_request(request_type, {field: 5}, store)
+            assert response == {"result": None, "error": f"{field} must be a list"}
+            assert user_db.request_tg_ids(request_type, {field: 5}) == []
+
+    asyncio.run(scenario())
+
+
+def test_single_requests_normalize_int_tg_id(tmp_path):
+    async def scenario():
+        store = UserStore(tmp_path / "users.json", fsync_interval=0)
+        store.open()
+        await store.start()
+        created = await user_db.handle_request("create_user", {"tg_id": 42, "amocrm_id": "amo-42"}, store)
+        assert created == {"result": {"success": True}}
+        assert store.get("42")["amocrm_id"] == "amo-42"
+        found = await user_db.handle_request("find_user", {"tg_id": 42}, store)
+        assert found["result"]["amocrm_id"] == "amo-42"
+        await store.close()
+
+    asyncio.run(scenario())
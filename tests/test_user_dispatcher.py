@@ -0,0 +1,55 @@
+# tests/test_user_dispatcher.py
+"""Очереди по tg_id telegram_bot/user_dispatcher.py: учёт pending при отмене, пик ожидания в stats()."""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_bot"))
+
+from user_dispatcher import UserDispatcher  # noqa: E402
+
+
+def test_cancelled_job_does_not_leak_pending():
+    ran = []
+
+    async def scenario():
+        dispatcher = UserDispatcher(max_concurrency=4, max_pending=2)
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def job():
+            ran.append("b")
+
+        await dispatcher.submit("1", cancelled)
+        await dispatcher.submit("1", job)
+        await dispatcher.drain()
+        assert dispatcher.stats()["pending"] == 0
+        # Очередь не считается переполненной: submit не ждёт разгрузки
+        for i in range(3):
+            await asyncio.wait_for(dispatcher.submit(str(i), job), 1)
+        await dispatcher.drain()
+        assert dispatcher.stats()["pending"] == 0
+
+    asyncio.run(scenario())
+    assert ran == ["b"] * 3
+
+
+def test_max_wait_is_reset_only_by_the_collector():
+    async def scenario():
+        dispatcher = UserDispatcher()
+
+        async def job():
+            await asyncio.sleep(0.05)
+
+        for _ in range(2):
+            await dispatcher.submit("1", job)
+        await dispatcher.drain()
+        peak = dispatcher.stats()["max_wait_s"]
+        assert peak >= 0.04
+        assert dispatcher.stats()["max_wait_s"] == peak  # /dispatcher не забирает пик у /metrics
+        assert dispatcher.stats(reset_max_wait=True)["max_wait_s"] == peak
+        assert dispatcher.stats()["max_wait_s"] == 0
+
+    asyncio.run(scenario())